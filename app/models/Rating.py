@@ -1,10 +1,20 @@
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
+from bson import ObjectId
+from bson.errors import InvalidId
 from pydantic import BaseModel, Field
+from pymongo import ASCENDING, DESCENDING
+
+# Set on a user once their embedded ratings were copied to the ratings collection, see app/utils/migrate_ratings.py
+MIGRATED_FIELD = 'ratings_migrated'
+
+# Checkpoint document of that migration in the `migrations` collection, 'completed' once every user was copied
+MIGRATION_ID = 'embedded_ratings'
 
 
 class Rating(BaseModel):
+    user_id: str
     item_id: str
     score: int
     timestamp: datetime
@@ -14,5 +24,77 @@ class Rating(BaseModel):
     deleted_at: Optional[datetime] = None
 
 
+def find_user_ratings(db, user_id: str, limit: int = 0, migrated: Optional[bool] = None) -> List[Dict]:
+    """
+    Returns a user's ratings as they were embedded in the users collection.
+
+    Ratings live in their own collection, one document per rating, and this
+    query is backed by its (user_id, timestamp) index, see app/utils/indexes.py.
+    Users the migration has not copied yet are read from their embedded
+    array, which the write routes keep up to date until then.
+
+    Args:
+        db: The MongoDB database
+        user_id (str): The user's id
+        limit (int): Return only the latest `limit` ratings, latest first; all of them, oldest first, when 0
+        migrated (Optional[bool]): The user's MIGRATED_FIELD, when the caller already read the user;
+            migrated users skip the lookup of an embedded array
+
+    Returns:
+        List[Dict]: item_id, score, timestamp, created_at, updated_at and version of every rating
+    """
+    embedded = None if migrated else find_embedded_ratings(db, user_id)
+    if embedded is not None:
+        embedded.sort(key=lambda rating: rating.get('timestamp') or 0, reverse=bool(limit))
+        return embedded[:limit] if limit else embedded
+
+    projection = {'_id': 0, 'user_id': 0}
+    if limit:
+        return list(db.ratings.find({'user_id': user_id}, projection).sort('timestamp', DESCENDING).limit(limit))
+    return list(db.ratings.find({'user_id': user_id}, projection).sort('timestamp', ASCENDING))
+
+
+def find_item_ratings(db, item_id: str) -> List[Dict]:
+    """
+    Returns the ratings of an item with their user_id, score and timestamp.
+
+    The ratings collection answers through its item_id index. Until the
+    migration records its completion, the ratings embedded in users it has not
+    copied yet are merged in, and replace what the collection holds for those
+    users, as in find_user_ratings().
+
+    Args:
+        db: The MongoDB database
+        item_id (str): The item's id
+
+    Returns:
+        List[Dict]: user_id, score and timestamp of every rating
+    """
+    ratings = list(db.ratings.find({'item_id': item_id}, {'_id': 0, 'user_id': 1, 'score': 1, 'timestamp': 1}))
+    if is_migration_complete(db):
+        return ratings
+
+    legacy = db.users.find({'ratings.item_id': item_id, MIGRATED_FIELD: {'$ne': True}}, {'ratings': 1})
+    embedded = [
+        {'user_id': str(user['_id']), 'score': rating.get('score'), 'timestamp': rating.get('timestamp')}
+        for user in legacy for rating in user['ratings'] if rating.get('item_id') == item_id
+    ]
+    legacy_users = {rating['user_id'] for rating in embedded}
+    return [rating for rating in ratings if rating['user_id'] not in legacy_users] + embedded
+
+
+def is_migration_complete(db) -> bool:
+    """Checks whether the migration recorded that every embedded rating was copied."""
+    checkpoint = db.migrations.find_one({'_id': MIGRATION_ID}, {'completed': 1})
+    return bool(checkpoint and checkpoint.get('completed'))
 
 
+def find_embedded_ratings(db, user_id: str) -> Optional[List[Dict]]:
+    """Returns the embedded ratings of a user that were not migrated yet, None for every other user."""
+    try:
+        object_id = ObjectId(user_id)
+    except (TypeError, InvalidId):
+        return None
+    user = db.users.find_one({'_id': object_id, MIGRATED_FIELD: {'$ne': True}, 'ratings.0': {'$exists': True}},
+                             {'ratings': 1})
+    return list(user['ratings']) if user else None
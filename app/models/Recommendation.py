@@ -8,6 +8,7 @@ class Recommendation(BaseModel):
     item_id: str
     user_id: str
     pred_score: float
+    model_version: Optional[str] = None
     explanation: Optional[str] = None
     enjoy_score: Optional[int] = None
     is_known: Optional[bool] = None
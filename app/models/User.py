@@ -2,8 +2,6 @@ from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel, Field
 
-from app.models import Rating
-
 
 class User(BaseModel):
     test_group: str  # A/B test group
@@ -18,7 +16,6 @@ class User(BaseModel):
     os: Optional[str] = None
     language: Optional[str] = None
     personality: List[int] = Field(default_factory=list)
-    ratings: List[Rating] = Field(default_factory=list)
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
     version: int = Field(default=1)
@@ -0,0 +1,49 @@
+"""
+Command line entry point of the recommender model.
+
+`build` trains the model and publishes it to Config.MODEL_DIR, unless the
+published model was already trained on the current ratings dataset with the
+current hyperparameters. Run it in CI or in the Docker build, so that the
+server only has to load the artifact at startup.
+
+Usage:
+    python -m app.recsys build [--force]
+    python -m app.recsys status
+    python -m app.recsys rollback VERSION
+"""
+import argparse
+import json
+import time
+
+from app.recsys.registry import get_model, rollback_model
+from app.utils.recommender import ensure_model, is_model_up_to_date
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m app.recsys', description='Build and inspect the recommender model.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='Build the model artifact unless it is up to date')
+    build.add_argument('--force', action='store_true', help='Rebuild even if the model is up to date')
+    commands.add_parser('status', help='Show the published model and whether it is up to date')
+    rollback = commands.add_parser('rollback', help='Serve a kept model version again')
+    rollback.add_argument('version', help='Version to serve, see the model directory')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        version = ensure_model(args.force)
+        print(f"Model version {version} ready in {time.perf_counter() - start:.1f}s")
+    elif args.command == 'rollback':
+        generation = rollback_model(args.version)
+        print(f"Model version {args.version} current as generation {generation}")
+    else:
+        try:
+            model = get_model()
+        except FileNotFoundError as e:
+            print(e)
+        else:
+            print(json.dumps({
+                'version': model['version'],
+                'generation': model['generation'],
+                'metadata': model['metadata'],
+                'up_to_date': is_model_up_to_date(model)
+            }, indent=2))
@@ -0,0 +1,113 @@
+"""
+Weighted alternating least squares over the observed ratings only.
+
+Unlike svds on the centered matrix, missing ratings do not contribute to the
+loss. Both half-steps are split into blocks of rows that are solved in a
+thread pool: each block accumulates its k x k normal equations with BLAS
+products and solves them as one batched np.linalg.solve, both of which
+release the GIL, so the blocks run on all cores.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def solve_block(R: csr_matrix, fixed: np.ndarray, start: int, stop: int, reg: float) -> np.ndarray:
+    """
+    Solves the ridge problems of rows start..stop of R against the fixed factors.
+
+    Row i gets (F_i^T F_i + reg * n_i * I) x_i = F_i^T r_i, where F_i are the
+    fixed factors of the n_i entries observed in row i (weighted-lambda
+    regularization, so heavy raters are not shrunk less than light ones).
+
+    Args:
+        R (csr_matrix): Centered ratings, rows are the factors being solved for
+        fixed (np.ndarray): Factors of the columns of R, columns x k
+        start (int): First row of the block
+        stop (int): Row after the last one of the block
+        reg (float): Regularization strength
+
+    Returns:
+        np.ndarray: (stop - start) x k factors
+    """
+    k = fixed.shape[1]
+    lhs = np.empty((stop - start, k, k))
+    rhs = np.empty((stop - start, k))
+
+    for row in range(start, stop):
+        observed = slice(R.indptr[row], R.indptr[row + 1])
+        gathered = fixed[R.indices[observed]]
+        lhs[row - start] = gathered.T @ gathered
+        rhs[row - start] = R.data[observed] @ gathered
+
+    counts = np.diff(R.indptr[start:stop + 1])
+    lhs += (reg * np.maximum(counts, 1))[:, None, None] * np.eye(k)
+
+    return np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+
+
+def als_half_step(R: csr_matrix, fixed: np.ndarray, reg: float, executor: ThreadPoolExecutor,
+                  block_nnz: int) -> np.ndarray:
+    """Solves every row of R in parallel blocks of about block_nnz observed ratings."""
+    # Block boundaries so that each block gathers roughly block_nnz ratings
+    targets = np.arange(block_nnz, R.nnz, block_nnz)
+    boundaries = np.unique(np.concatenate(([0], np.searchsorted(R.indptr, targets), [R.shape[0]])))
+
+    blocks = [
+        executor.submit(solve_block, R, fixed, start, stop, reg)
+        for start, stop in zip(boundaries[:-1], boundaries[1:])
+    ]
+    return np.vstack([block.result() for block in blocks])
+
+
+def train_als(matrix_norm: csr_matrix, k: int = 30, reg: float = 0.1, iterations: int = 10,
+              workers: Optional[int] = None, block_nnz: int = 4096, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Factorizes the centered rating matrix with weighted ALS.
+
+    Args:
+        matrix_norm (csr_matrix): Users x movies ratings centered on the user means
+        k (int): Number of latent factors
+        reg (float): Regularization strength
+        iterations (int): Number of user + item sweeps
+        workers (Optional[int]): Threads solving blocks, defaults to the number of CPUs
+        block_nnz (int): Approximate number of ratings per block
+        seed (int): Seed of the initial item factors
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: users x k and movies x k factors
+    """
+    rng = np.random.default_rng(seed)
+    R = matrix_norm.tocsr()
+    Rt = R.T.tocsr()
+    item_factors = rng.normal(scale=0.1, size=(R.shape[1], k))
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for _ in range(iterations):
+            user_factors = als_half_step(R, item_factors, reg, executor, block_nnz)
+            item_factors = als_half_step(Rt, user_factors, reg, executor, block_nnz)
+
+    return user_factors, item_factors
+
+
+def to_svd_factors(user_factors: np.ndarray, item_factors: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Rewrites X . Y^T as U . diag(sigma) . Vt with orthonormal rows in Vt.
+
+    Y = W . diag(S) . Zt is decomposed, so that Vt = W^T, sigma = S and
+    U = X . Zt^T: the product, and therefore every prediction for the training
+    users, is unchanged, and Vt scaled by sigma are the ALS item factors up to a
+    rotation, which serving folds new users in with (see fold_in_ridge()).
+
+    Args:
+        user_factors (np.ndarray): users x k factors
+        item_factors (np.ndarray): movies x k factors
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: U, sigma and Vt
+    """
+    W, S, Zt = np.linalg.svd(item_factors, full_matrices=False)
+    return user_factors @ Zt.T, S, W.T
@@ -0,0 +1,172 @@
+"""
+Inverted-file (IVF) approximate nearest-neighbour index over the item factors.
+
+Items are partitioned with k-means; a query only scores the items of the
+few partitions whose centroids have the highest inner product with it.
+Pure NumPy, so it needs no native dependency.
+
+The recommender ranks items by (mean + q . v_j) / penalty_j, which is the
+inner product of the query [mean, q] with the item vector [1, v_j] / penalty_j,
+so those augmented vectors are what gets clustered.
+
+Without a popularity penalty that is a maximum inner product search over
+vectors whose norms are heavy-tailed: the best items are the few with large
+norms, sitting at the edge of lists whose centroid is pulled towards the many
+small-norm items, so the centroid alone ranks their list too low. Every list
+therefore also keeps the vectors of its n_exemplars largest-norm items, and a
+list is probed by the best inner product of its centroid and its exemplars.
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+def get_item_vectors(Vt: np.ndarray, popularity_penalty: np.ndarray) -> np.ndarray:
+    """Returns the items x (k + 1) vectors whose inner product with [mean, q] is the final score."""
+    return np.vstack([np.ones(Vt.shape[1]), Vt]).T / popularity_penalty[:, None]
+
+
+def kmeans(vectors: np.ndarray, n_lists: int, iterations: int = 20, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lloyd's k-means.
+
+    Args:
+        vectors (np.ndarray): n x d points
+        n_lists (int): Number of clusters
+        iterations (int): Number of assignment/update rounds
+        seed (int): Seed of the initial centroids
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: n_lists x d centroids and the cluster of every point
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    squared_norms = (vectors ** 2).sum(axis=1)
+
+    for _ in range(iterations):
+        # argmin ||x - c||^2 = argmin ||x||^2 - 2 x.c + ||c||^2
+        distances = squared_norms[:, None] - 2 * vectors @ centroids.T + (centroids ** 2).sum(axis=1)
+        assignments = distances.argmin(axis=1)
+
+        counts = np.bincount(assignments, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+
+        # Re-seed empty clusters with the points farthest from their centroid
+        if not nonempty.all():
+            farthest = np.argsort(distances[np.arange(len(vectors)), assignments])[::-1]
+            centroids[~nonempty] = vectors[farthest[:(~nonempty).sum()]]
+
+    return centroids, assignments
+
+
+def build_ivf_index(item_vectors: np.ndarray, n_lists: int, n_exemplars: int = 16, iterations: int = 20,
+                    seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+    Partitions the items into n_lists inverted lists.
+
+    Args:
+        item_vectors (np.ndarray): items x d vectors, see get_item_vectors()
+        n_lists (int): Number of partitions
+        n_exemplars (int): Largest-norm items per list whose vectors are kept for probing
+        iterations (int): Number of k-means rounds
+        seed (int): Seed of the initial centroids
+
+    Returns:
+        Dict[str, np.ndarray]: "ann_centroids", "ann_exemplars" unless n_exemplars
+        is 0, plus "ann_items" holding the item positions grouped by list and
+        "ann_offsets" delimiting each list in it
+    """
+    n_lists = min(n_lists, len(item_vectors))
+    centroids, assignments = kmeans(item_vectors, n_lists, iterations, seed)
+    return group_ivf_lists(item_vectors, centroids, assignments, n_exemplars)
+
+
+def group_ivf_lists(item_vectors: np.ndarray, centroids: np.ndarray, assignments: np.ndarray,
+                    n_exemplars: int) -> Dict[str, np.ndarray]:
+    """
+    Builds the index arrays from the list of every item.
+
+    Args:
+        item_vectors (np.ndarray): items x d vectors
+        centroids (np.ndarray): n_lists x d centroids
+        assignments (np.ndarray): The list of every item
+        n_exemplars (int): Largest-norm items per list whose vectors are kept
+
+    Returns:
+        Dict[str, np.ndarray]: The index arrays, see build_ivf_index(); lists
+        with fewer than n_exemplars items repeat their centroid as exemplar
+    """
+    n_lists = len(centroids)
+    norms = (item_vectors ** 2).sum(axis=1)
+    order = np.lexsort((-norms, assignments))
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=n_lists))))
+
+    index = {
+        "ann_centroids": centroids.astype(np.float32),
+        "ann_offsets": offsets.astype(np.int64),
+        "ann_items": order.astype(np.int32)
+    }
+    if n_exemplars > 0:
+        # The first n_exemplars items of every list, which is sorted by descending norm
+        exemplars = np.repeat(centroids[:, None, :], n_exemplars, axis=1)
+        for rank in range(n_exemplars):
+            present = offsets[:-1] + rank < offsets[1:]
+            exemplars[present, rank] = item_vectors[order[offsets[:-1][present] + rank]]
+        index["ann_exemplars"] = exemplars.astype(np.float32)
+    return index
+
+
+def reassign_ivf_items(index: Dict[str, np.ndarray], item_vectors: np.ndarray,
+                       positions: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Moves some items to the list of their nearest centroid, keeping the centroids.
+
+    Used after an incremental update changed a few items' vectors: the lists
+    stay those of the full build, but every updated item sits in the list a
+    build would put it in given these centroids, and the exemplars are picked
+    again from the updated vectors.
+
+    Args:
+        index (Dict[str, np.ndarray]): Arrays as returned by build_ivf_index()
+        item_vectors (np.ndarray): items x d vectors of every item, see get_item_vectors()
+        positions (np.ndarray): Positions of the items whose vectors changed
+
+    Returns:
+        Dict[str, np.ndarray]: The index arrays, with the same centroids
+    """
+    centroids = np.asarray(index["ann_centroids"], dtype=np.float64)
+    offsets = index["ann_offsets"]
+    assignments = np.empty(offsets[-1], dtype=np.int64)
+    assignments[index["ann_items"]] = np.repeat(np.arange(len(centroids)), np.diff(offsets))
+
+    distances = -2 * item_vectors[positions] @ centroids.T + (centroids ** 2).sum(axis=1)
+    assignments[positions] = distances.argmin(axis=1)
+
+    n_exemplars = index["ann_exemplars"].shape[1] if "ann_exemplars" in index else 0
+    return group_ivf_lists(item_vectors, centroids, assignments, n_exemplars)
+
+
+def probe_ivf_index(query: np.ndarray, index: Dict[str, np.ndarray], n_probe: int) -> np.ndarray:
+    """
+    Returns the item positions of the n_probe lists closest to the query.
+
+    Args:
+        query (np.ndarray): The (k + 1) query vector [mean, q]
+        index (Dict[str, np.ndarray]): Arrays as returned by build_ivf_index()
+        n_probe (int): Number of lists to read
+
+    Returns:
+        np.ndarray: Candidate item positions
+    """
+    centroids = index["ann_centroids"]
+    n_probe = min(n_probe, len(centroids))
+    scores = centroids @ query
+    if "ann_exemplars" in index:
+        scores = np.maximum(scores, (index["ann_exemplars"] @ query).max(axis=1))
+    lists = np.argpartition(-scores, n_probe - 1)[:n_probe]
+
+    offsets = index["ann_offsets"]
+    return np.concatenate([index["ann_items"][offsets[i]:offsets[i + 1]] for i in lists])
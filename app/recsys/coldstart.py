@@ -0,0 +1,149 @@
+"""
+Precomputed cold-start recommendation lists.
+
+Users with too few ratings for the factorization are served from lists of the
+best movies by Bayesian-average rating: overall, per genre and per genre pair.
+The lists are built with the model and stored as rows of a keys x N table;
+serving one is a dict lookup plus a slice.
+
+Genres come from movies.csv and are stored per movie as a bitmask over the
+model's genre vocabulary, aligned with the columns of Vt.
+"""
+from itertools import combinations
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from app.utils.settings import Config
+
+# Key of the list of the best movies of every genre
+OVERALL_KEY = ""
+
+# Ratings at or above this count as liking a movie's genres
+LIKED_RATING = 3.5
+
+
+def load_movie_genres(path: Optional[str] = None) -> pd.Series:
+    """
+    Loads the genres of every movie.
+
+    Args:
+        path (Optional[str]): CSV file to read, defaults to Config.MOVIES_PATH
+
+    Returns:
+        pd.Series: The list of genres of every movieId
+    """
+    movies = pd.read_csv(path or Config.MOVIES_PATH, usecols=['movieId', 'genres'], dtype={'movieId': np.int32})
+    genres = movies['genres'].fillna('').str.split('|')
+    genres = genres.map(lambda names: [name for name in names if name and name != '(no genres listed)'])
+    return pd.Series(genres.to_numpy(), index=movies['movieId'])
+
+
+def bayesian_average(matrix: csr_matrix, prior_count: float) -> np.ndarray:
+    """
+    Returns the Bayesian average rating of every column of the rating matrix.
+
+    Each movie's ratings are shrunk towards the global mean as if it had
+    prior_count extra ratings equal to that mean, so a movie with a handful of
+    5-star ratings does not outrank a classic with thousands of 4.5s.
+    """
+    counts = matrix.getnnz(axis=0)
+    sums = np.asarray(matrix.sum(axis=0)).ravel()
+    global_mean = matrix.data.mean() if matrix.nnz else 0.0
+    return (prior_count * global_mean + sums) / (prior_count + counts)
+
+
+def build_cold_start_tables(matrix: csr_matrix, movie_ids: np.ndarray, movie_genres: pd.Series,
+                            list_size: int = 50, prior_count: float = 10.0) -> Dict[str, np.ndarray]:
+    """
+    Builds the overall, per-genre and per-genre-pair lists of the best rated movies.
+
+    Args:
+        matrix (csr_matrix): Users x movies rating matrix
+        movie_ids (np.ndarray): movieIds of the matrix columns
+        movie_genres (pd.Series): Genres of every movieId, as returned by load_movie_genres()
+        list_size (int): Movies kept per list
+        prior_count (float): Weight of the global mean in the Bayesian average
+
+    Returns:
+        Dict[str, np.ndarray]: "genres", the genre vocabulary; "movie_genres", the genre
+        bitmask of every movie; "cold_start_keys", the key of every list ("" overall,
+        "Genre" or "Genre|Genre"); "cold_start_items", lists x list_size positions
+        (-1 pads short lists); and "cold_start_scores", their Bayesian averages
+    """
+    genre_lists = movie_genres.reindex(movie_ids).map(lambda names: names if isinstance(names, list) else [])
+    # Genres are int64 bitmasks, so at most 63 of them are kept
+    genres = sorted({name for names in genre_lists for name in names})[:63]
+    bits = {name: 1 << bit for bit, name in enumerate(genres)}
+    genre_masks = np.array([sum(bits.get(name, 0) for name in set(names)) for names in genre_lists], dtype=np.int64)
+
+    scores = bayesian_average(matrix, prior_count)
+    order = np.argsort(-scores, kind='stable')
+    ordered_masks = genre_masks[order]
+
+    keys = [OVERALL_KEY] + genres + ['|'.join(pair) for pair in combinations(genres, 2)]
+    items = np.full((len(keys), list_size), -1, dtype=np.int32)
+    for row, key in enumerate(keys):
+        key_mask = sum(bits[name] for name in key.split('|')) if key else 0
+        top = order[(ordered_masks & key_mask) == key_mask][:list_size]
+        items[row, :len(top)] = top
+
+    # Genre pairs no movie belongs to are dropped
+    keep = items[:, 0] >= 0
+    keep[0] = True
+    items = items[keep]
+    return {
+        "genres": np.array(genres, dtype=str),
+        "movie_genres": genre_masks,
+        "cold_start_keys": np.array(keys, dtype=str)[keep],
+        "cold_start_items": items,
+        "cold_start_scores": np.where(items >= 0, scores[items], 0).astype(np.float32)
+    }
+
+
+def get_cold_start_key(positions: np.ndarray, scores: np.ndarray, model: Dict) -> str:
+    """
+    Picks the list that matches the genres a user liked.
+
+    The two genres that weigh most across the liked movies select their genre
+    pair list, falling back to the top genre's list and then to the overall one.
+    """
+    liked = scores >= LIKED_RATING
+    if not liked.any():
+        return OVERALL_KEY
+
+    genres = model["genres"]
+    masks = model["movie_genres"][positions[liked]]
+    has_genre = (masks[:, None] >> np.arange(len(genres))) & 1
+    weights = has_genre.T @ scores[liked]
+    top = [genres[bit] for bit in np.argsort(-weights, kind='stable')[:2] if weights[bit] > 0]
+
+    for key in ('|'.join(sorted(top)), top[0] if top else OVERALL_KEY):
+        if key in model["cold_start_index"]:
+            return key
+    return OVERALL_KEY
+
+
+def get_cold_start_items(positions: np.ndarray, scores: np.ndarray, model: Dict, top_n: int,
+                         available: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Serves a precomputed list to a user with few ratings.
+
+    Args:
+        positions (np.ndarray): Positions of the movies the user rated
+        scores (np.ndarray): The user's ratings of those movies
+        model (Dict): Model holding the cold-start tables
+        top_n (int): Number of movies to return
+        available (Optional[np.ndarray]): Mask of the movies that may be recommended, all by default
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Positions of the recommended movies and their Bayesian averages
+    """
+    row = model["cold_start_index"][get_cold_start_key(positions, scores, model)]
+    items = model["cold_start_items"][row]
+    keep = (items >= 0) & ~np.isin(items, positions)
+    if available is not None:
+        keep &= available[np.maximum(items, 0)]
+    return items[keep][:top_n], model["cold_start_scores"][row][keep][:top_n]
@@ -0,0 +1,227 @@
+"""
+Rating data access and the sparse rating matrix.
+
+load_ratings() parses ratings.csv only once: its columns are then kept as a
+compact columnar cache of .npy files (int32 ids, ratings encoded as uint8
+half-stars, int32 timestamps) that later loads map straight from disk. The
+cache is rebuilt when the source file's size, mtime and content hash no
+longer match the ones it was built from.
+
+Usage:
+    python -m app.recsys.matrix [--ratings PATH]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from app.utils.settings import Config
+
+# Columns of ratings.csv and the dtypes they are loaded with
+RATINGS_DTYPES = {
+    'userId': np.int32,
+    'movieId': np.int32,
+    'rating': np.float32,
+    'timestamp': np.int64
+}
+
+# File in a cache directory describing the source it was built from
+CACHE_META_FILE = "source.json"
+
+
+def hash_file(path: Path, chunk_size: int = 1 << 20) -> str:
+    """Returns the SHA-1 of a file, read in chunks."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_ratings_cache_dir(path: Path) -> Path:
+    """Returns the cache directory of a ratings CSV file."""
+    return Path(Config.RATINGS_CACHE_DIR) / path.stem
+
+
+def read_cache_meta(cache_dir: Path) -> Optional[Dict]:
+    try:
+        with open(cache_dir / CACHE_META_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def is_cache_valid(path: Path, cache_dir: Path) -> bool:
+    """
+    Checks that a cache was built from the current content of the source file.
+
+    Size and mtime are compared first; if only the mtime changed (e.g. after a
+    checkout) the content hash decides, and a match refreshes the stored mtime.
+    """
+    meta = read_cache_meta(cache_dir)
+    if meta is None:
+        return False
+
+    stat = path.stat()
+    if meta["size"] != stat.st_size:
+        return False
+    if meta["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    if meta["sha1"] != hash_file(path):
+        return False
+
+    meta["mtime_ns"] = stat.st_mtime_ns
+    write_cache_meta(cache_dir, meta)
+    return True
+
+
+def write_cache_meta(cache_dir: Path, meta: Dict) -> None:
+    tmp_file = cache_dir / f".{CACHE_META_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, cache_dir / CACHE_META_FILE)
+
+
+def build_ratings_cache(path: Optional[str] = None) -> Path:
+    """
+    Converts a ratings CSV file into its columnar cache.
+
+    The cache is written into a temporary directory and renamed into place, so
+    concurrent readers never see a partial one.
+
+    Args:
+        path (Optional[str]): CSV file to convert, defaults to Config.RATINGS_PATH
+
+    Returns:
+        Path: The cache directory
+    """
+    path = Path(path or Config.RATINGS_PATH)
+    cache_dir = get_ratings_cache_dir(path)
+    stat = path.stat()
+    ratings = pd.read_csv(path, dtype=RATINGS_DTYPES)
+
+    columns = {
+        'userId': ratings['userId'].to_numpy(),
+        'movieId': ratings['movieId'].to_numpy(),
+        'timestamp': ratings['timestamp'].to_numpy()
+    }
+    # MovieLens ratings are half stars from 0.5 to 5, which fit a uint8 of half stars
+    half_stars = ratings['rating'].to_numpy() * 2
+    if len(ratings) and (half_stars == np.round(half_stars)).all() and 0 <= half_stars.min() <= half_stars.max() <= 255:
+        columns['rating'] = half_stars.astype(np.uint8)
+    else:
+        columns['rating'] = ratings['rating'].to_numpy()
+
+    timestamps = columns['timestamp']
+    int32 = np.iinfo(np.int32)
+    if len(ratings) and int32.min <= timestamps.min() and timestamps.max() <= int32.max:
+        columns['timestamp'] = timestamps.astype(np.int32)
+
+    cache_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = cache_dir.parent / f".{cache_dir.name}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+    for name, column in columns.items():
+        np.save(tmp_dir / f"{name}.npy", column)
+    write_cache_meta(tmp_dir, {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": hash_file(path)})
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.rename(tmp_dir, cache_dir)
+    return cache_dir
+
+
+def get_dataset_checksum(path: Optional[str] = None) -> str:
+    """Returns the SHA-1 of a ratings CSV file, taken from its cache when that is valid."""
+    path = Path(path or Config.RATINGS_PATH)
+    if Config.RATINGS_CACHE_DIR:
+        cache_dir = get_ratings_cache_dir(path)
+        if is_cache_valid(path, cache_dir):
+            return read_cache_meta(cache_dir)["sha1"]
+    return hash_file(path)
+
+
+def load_ratings(path: Optional[str] = None) -> pd.DataFrame:
+    """
+    Loads the ratings dataset with compact dtypes, from its columnar cache.
+
+    The cache is built on first use and whenever the CSV file changes; set
+    Config.RATINGS_CACHE_DIR to an empty string to always parse the CSV file.
+
+    Args:
+        path (Optional[str]): CSV file to read, defaults to Config.RATINGS_PATH
+
+    Returns:
+        pd.DataFrame: userId, movieId, rating and timestamp columns
+    """
+    path = Path(path or Config.RATINGS_PATH)
+    if not Config.RATINGS_CACHE_DIR:
+        return pd.read_csv(path, dtype=RATINGS_DTYPES)
+
+    cache_dir = get_ratings_cache_dir(path)
+    if not is_cache_valid(path, cache_dir):
+        build_ratings_cache(path)
+
+    columns = {name: np.load(cache_dir / f"{name}.npy") for name in RATINGS_DTYPES}
+    if columns['rating'].dtype == np.uint8:
+        columns['rating'] = columns['rating'] / np.float32(2)
+    return pd.DataFrame({name: columns[name].astype(dtype, copy=False) for name, dtype in RATINGS_DTYPES.items()})
+
+
+def build_rating_matrix(ratings: pd.DataFrame) -> Tuple[csr_matrix, np.ndarray, np.ndarray]:
+    """
+    Builds a sparse users x movies CSR matrix holding only the observed ratings.
+
+    Args:
+        ratings (pd.DataFrame): Ratings with userId, movieId and rating columns
+
+    Returns:
+        Tuple[csr_matrix, np.ndarray, np.ndarray]: The rating matrix and the sorted
+        userIds and movieIds its rows and columns map to
+    """
+    user_ids, rows = np.unique(ratings['userId'].to_numpy(), return_inverse=True)
+    movie_ids, cols = np.unique(ratings['movieId'].to_numpy(), return_inverse=True)
+
+    matrix = csr_matrix(
+        (ratings['rating'].to_numpy(dtype=np.float64), (rows.astype(np.int32), cols.astype(np.int32))),
+        shape=(len(user_ids), len(movie_ids))
+    )
+    return matrix, user_ids.astype(np.int32), movie_ids.astype(np.int32)
+
+
+def center_rating_matrix(matrix: csr_matrix) -> Tuple[csr_matrix, np.ndarray]:
+    """
+    Subtracts each user's mean rating from their observed entries only.
+
+    Missing entries stay implicit zeros, i.e. they are treated as "equal to the
+    user's mean" without ever being materialized.
+
+    Args:
+        matrix (csr_matrix): Users x movies rating matrix
+
+    Returns:
+        Tuple[csr_matrix, np.ndarray]: The centered matrix and the per-user means
+    """
+    counts = np.diff(matrix.indptr)
+    user_means = np.asarray(matrix.sum(axis=1)).ravel() / np.maximum(counts, 1)
+
+    centered = matrix.copy()
+    centered.data -= np.repeat(user_means, counts)
+    return centered, user_means
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the columnar cache of the ratings dataset.')
+    parser.add_argument('--ratings', default=Config.RATINGS_PATH, help='Ratings CSV file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    cache_dir = build_ratings_cache(args.ratings)
+    print(f"Ratings cache built at {cache_dir} in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,44 @@
+"""
+Offline evaluation helpers shared by the evaluation benchmark and the
+hyper-parameter sweep.
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def time_split(ratings: pd.DataFrame, train_fraction: float) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Splits every user's ratings by time: their first train_fraction trains, the rest is held out.
+
+    A global timestamp cutoff would leave only the few users still active at the
+    end of the timeline in the test set; per user, everyone with at least two
+    ratings is tested on their latest ones and keeps at least one for training.
+    """
+    ordered = ratings.sort_values(['userId', 'timestamp'], kind='stable')
+    position = ordered.groupby('userId').cumcount().to_numpy()
+    counts = ordered.groupby('userId')['userId'].transform('size').to_numpy()
+    train = position < np.maximum(np.floor(counts * train_fraction), 1)
+    return ordered[train], ordered[~train]
+
+
+def latest_histories(ratings: pd.DataFrame, history: int) -> Dict[int, Dict[str, float]]:
+    """Returns every user's `history` latest ratings as the {movie_id: rating} dict the recommender takes."""
+    latest = ratings.sort_values('timestamp').groupby('userId').tail(history)
+    return {
+        user_id: dict(zip(user_ratings['movieId'].astype(str), user_ratings['rating'].astype(float)))
+        for user_id, user_ratings in latest.groupby('userId')
+    }
+
+
+def ranking_metrics(recommended, relevant, k: int) -> Tuple[float, float, float]:
+    """Returns precision@k, recall@k and binary NDCG@k of one user's recommendations."""
+    hits = np.array([movie_id in relevant for movie_id in recommended[:k]], dtype=np.float64)
+    precision = hits.sum() / k
+    recall = hits.sum() / len(relevant)
+
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    ideal = discounts[:min(len(relevant), k)].sum()
+    ndcg = (hits * discounts[:len(hits)]).sum() / ideal
+    return precision, recall, ndcg
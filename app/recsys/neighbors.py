@@ -0,0 +1,83 @@
+"""
+Precomputed item-item neighbour table.
+
+The top-K cosine neighbours of every movie are computed from the user-centered
+rating matrix (adjusted cosine), a block of movies at a time, so only a
+block x movies slice of the similarity matrix ever exists. The table is kept
+as a movies x K int32 array of neighbour positions and a float16 array of
+similarities, aligned with the columns of the model's Vt.
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+
+
+def build_item_neighbors(matrix_norm: csr_matrix, k: int = 20, block_size: int = 512) -> Dict[str, np.ndarray]:
+    """
+    Computes the top-k cosine neighbours of every column of the rating matrix.
+
+    Args:
+        matrix_norm (csr_matrix): Users x movies ratings centered on the user means
+        k (int): Number of neighbours kept per movie
+        block_size (int): Movies whose similarities are computed at once
+
+    Returns:
+        Dict[str, np.ndarray]: "neighbor_items", movies x k positions (-1 pads
+        movies with fewer neighbours), and "neighbor_scores", their float16 similarities
+    """
+    items = matrix_norm.T.tocsr()
+    norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=1)).ravel())
+    items = diags(1 / np.maximum(norms, 1e-12)) @ items
+    items_t = items.T.tocsc()
+
+    n_items = items.shape[0]
+    k = min(k, n_items - 1)
+    neighbor_items = np.full((n_items, k), -1, dtype=np.int32)
+    neighbor_scores = np.zeros((n_items, k), dtype=np.float16)
+
+    for start in range(0, n_items, block_size):
+        stop = min(start + block_size, n_items)
+        similarities = (items[start:stop] @ items_t).toarray()
+        similarities[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        # Only positively correlated movies count as neighbours
+        positive = top_scores > 0
+        neighbor_items[start:stop] = np.where(positive, top, -1)
+        neighbor_scores[start:stop] = np.where(positive, top_scores, 0)
+
+    return {"neighbor_items": neighbor_items, "neighbor_scores": neighbor_scores}
+
+
+def merge_neighbors(neighbor_items: np.ndarray, neighbor_scores: np.ndarray, seeds: np.ndarray,
+                    weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merges the neighbour lists of a few seed movies into one scored candidate list.
+
+    Each candidate scores the sum over seeds of weight * similarity; the seeds
+    themselves are left out.
+
+    Args:
+        neighbor_items (np.ndarray): movies x k neighbour positions
+        neighbor_scores (np.ndarray): movies x k similarities
+        seeds (np.ndarray): Positions of the seed movies
+        weights (np.ndarray): Weight of every seed
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Candidate positions and scores, best first
+    """
+    candidates = neighbor_items[seeds].ravel()
+    scores = (neighbor_scores[seeds].astype(np.float32) * np.asarray(weights, dtype=np.float32)[:, None]).ravel()
+
+    valid = (candidates >= 0) & ~np.isin(candidates, seeds)
+    candidates, inverse = np.unique(candidates[valid], return_inverse=True)
+    merged = np.bincount(inverse, weights=scores[valid], minlength=len(candidates))
+
+    order = np.argsort(-merged, kind='stable')
+    return candidates[order], merged[order]
@@ -0,0 +1,276 @@
+"""
+Staged recommendation pipeline.
+
+A recommendation runs through four kinds of stages, all working on NumPy
+arrays of candidate positions (columns of the model's Vt):
+
+    - generators propose candidates: factor scoring over every movie or the
+      probed ANN partitions, item neighbours of the rated movies, popularity
+    - filters drop candidates: already rated, unavailable in `items`
+    - scorers compute named score columns aligned with the candidates; the
+      "score" column is what the rerankers rank by
+    - rerankers pick and order the final top N: plain top N, or MMR for
+      genre diversity
+
+Every stage call is timed, per request in context["timings"] and overall in
+the pipeline's StageTimings, so it is visible where latency goes.
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.recsys.ann import probe_ivf_index
+from app.recsys.coldstart import OVERALL_KEY
+from app.recsys.neighbors import merge_neighbors
+from app.recsys.quantize import score_items
+
+Generator = Callable[[Dict], np.ndarray]
+Filter = Callable[[np.ndarray, Dict], np.ndarray]
+Scorer = Callable[[np.ndarray, Dict[str, np.ndarray], Dict], None]
+Reranker = Callable[[np.ndarray, Dict[str, np.ndarray], Dict, int], np.ndarray]
+
+# Set bits of every byte value, to count genres shared by two bitmasks
+_BIT_COUNTS = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+class StageTimings:
+    """Thread-safe call counts and total and worst latency of every pipeline stage."""
+
+    def __init__(self):
+        self._stages: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._stages.setdefault(stage, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stages.clear()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                stage: {
+                    'calls': calls,
+                    'mean_ms': total / calls * 1000,
+                    'max_ms': worst * 1000
+                }
+                for stage, (calls, total, worst) in self._stages.items()
+            }
+
+
+class RecommendationPipeline:
+    """
+    Runs generators, filters, scorers and rerankers over candidate positions.
+
+    Stages are plain functions, so adding one means writing the function and
+    listing it here, not rewriting the hot path.
+    """
+
+    def __init__(self, generators: Sequence[Generator], filters: Sequence[Filter] = (),
+                 scorers: Sequence[Scorer] = (), rerankers: Sequence[Reranker] = ()):
+        self.generators = list(generators)
+        self.filters = list(filters)
+        self.scorers = list(scorers)
+        self.rerankers = list(rerankers)
+        self.timings = StageTimings()
+
+    def _timed(self, context: Dict, stage: Callable, *args):
+        start = time.perf_counter()
+        result = stage(*args)
+        seconds = time.perf_counter() - start
+        context["timings"][stage.__name__] = context["timings"].get(stage.__name__, 0.0) + seconds
+        self.timings.record(stage.__name__, seconds)
+        return result
+
+    def run(self, context: Dict, top_n: int) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Recommends top_n movies.
+
+        Args:
+            context (Dict): The request, see get_recommendation_context(); gets a "timings" entry
+            top_n (int): Number of movies to return
+
+        Returns:
+            Tuple[np.ndarray, Dict[str, np.ndarray]]: The positions of the recommended movies,
+            best first, and their score columns
+        """
+        context["timings"] = {}
+
+        # Union of all generated candidates, in position order; once a generator
+        # proposes the whole catalog the remaining ones cannot add anything
+        n_items = len(context["model"]["movie_ids"])
+        generated = []
+        for generator in self.generators:
+            generated.append(self._timed(context, generator, context))
+            if len(generated[-1]) == n_items:
+                generated = generated[-1:]
+                break
+        if len(generated) == 1:
+            candidates = generated[0]
+        else:
+            selected = np.zeros(n_items, dtype=bool)
+            for positions in generated:
+                selected[positions] = True
+            candidates = np.flatnonzero(selected)
+
+        for candidate_filter in self.filters:
+            candidates = candidates[self._timed(context, candidate_filter, candidates, context)]
+
+        columns: Dict[str, np.ndarray] = {}
+        for scorer in self.scorers:
+            self._timed(context, scorer, candidates, columns, context)
+
+        for reranker in self.rerankers:
+            order = self._timed(context, reranker, candidates, columns, context, top_n)
+            candidates = candidates[order]
+            columns = {name: column[order] for name, column in columns.items()}
+
+        return candidates[:top_n], {name: column[:top_n] for name, column in columns.items()}
+
+
+# ------------------------------------------- Generators -------------------------------------------
+
+def factor_candidates(context: Dict) -> np.ndarray:
+    """Every movie, or only the movies of the ANN partitions closest to the user when the model has an index."""
+    model = context["model"]
+    if "ann_centroids" in model and context["ann_probes"] > 0:
+        query = np.concatenate(([context["user_mean"]], context["query"]))
+        return probe_ivf_index(query, model, context["ann_probes"])
+    return np.arange(len(model["movie_ids"]))
+
+
+def neighbor_candidates(context: Dict) -> np.ndarray:
+    """The nearest neighbours of the rated movies, from the precomputed neighbour table."""
+    model = context["model"]
+    if "neighbor_items" not in model:
+        return np.empty(0, dtype=np.int64)
+    candidates, _ = merge_neighbors(model["neighbor_items"], model["neighbor_scores"], context["positions"],
+                                    context["scores"])
+    return candidates
+
+
+def popularity_candidates(context: Dict) -> np.ndarray:
+    """The best rated movies overall, from the precomputed cold-start table."""
+    model = context["model"]
+    if "cold_start_index" not in model:
+        return np.empty(0, dtype=np.int64)
+    items = model["cold_start_items"][model["cold_start_index"][OVERALL_KEY]]
+    return items[items >= 0]
+
+
+# -------------------------------------------- Filters ---------------------------------------------
+
+def rated_filter(candidates: np.ndarray, context: Dict) -> np.ndarray:
+    """Drops the movies the user already rated."""
+    rated = np.zeros(len(context["model"]["movie_ids"]), dtype=bool)
+    rated[context["positions"][context["scores"] > 0]] = True
+    return ~rated[candidates]
+
+
+def availability_filter(candidates: np.ndarray, context: Dict) -> np.ndarray:
+    """Drops the movies missing from the `items` collection, when the caller passed their mask."""
+    available = context.get("available")
+    if available is None:
+        return np.ones(len(candidates), dtype=bool)
+    return available[candidates]
+
+
+# -------------------------------------------- Scorers ---------------------------------------------
+
+def factor_scorer(candidates: np.ndarray, columns: Dict[str, np.ndarray], context: Dict) -> None:
+    """
+    Predicts the user's rating of every candidate from the folded-in factors.
+
+    Callers that already predicted every movie, e.g. in one batch product, pass
+    them as context["predicted"] and the candidates' ratings are only gathered.
+    """
+    model = context["model"]
+    if context.get("predicted") is not None:
+        columns["predicted"] = context["predicted"][candidates]
+        columns["score"] = columns["predicted"]
+        return
+    # Gathering most of the columns of Vt costs more than scoring them all
+    if len(candidates) > len(model["movie_ids"]) // 2:
+        predicted = score_items(context["query"], model)[candidates]
+    else:
+        predicted = score_items(context["query"], model, candidates)
+    columns["predicted"] = predicted + context["user_mean"]
+    columns["score"] = columns["predicted"]
+
+
+def popularity_penalty_scorer(candidates: np.ndarray, columns: Dict[str, np.ndarray], context: Dict) -> None:
+    """Divides the score by the popularity penalty of every candidate."""
+    columns["score"] = columns["score"] / context["model"]["popularity_penalty"][candidates]
+
+
+# ------------------------------------------- Rerankers --------------------------------------------
+
+def top_n_order(scores: np.ndarray, top_n: int, keys: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Returns the indices of the top_n highest scores, ordered by (-score, key).
+
+    Ties are broken by the ascending key, the index by default, including ties
+    at the cut-off, so the same scores always give the same list whichever way
+    they were computed.
+    """
+    top_n = min(top_n, len(scores))
+    if top_n <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    kth = np.partition(scores, len(scores) - top_n)[len(scores) - top_n]
+    top = np.flatnonzero(scores >= kth)
+    order = np.lexsort((top if keys is None else keys[top], -scores[top]))
+    return top[order[:top_n]]
+
+
+def top_n_reranker(candidates: np.ndarray, columns: Dict[str, np.ndarray], context: Dict, top_n: int) -> np.ndarray:
+    """The top_n candidates by score, best first and lowest position on ties, ignoring non-finite scores."""
+    scores = columns["score"]
+    top = top_n_order(scores, top_n, candidates)
+    return top[np.isfinite(scores[top])]
+
+
+def genre_similarity(masks: np.ndarray, mask: int) -> np.ndarray:
+    """Jaccard similarity of the genre bitmasks of many movies to one movie's."""
+    shared = _BIT_COUNTS[(masks & mask).view(np.uint8)].reshape(len(masks), -1).sum(axis=1)
+    union = _BIT_COUNTS[(masks | mask).view(np.uint8)].reshape(len(masks), -1).sum(axis=1)
+    return shared / np.maximum(union, 1)
+
+
+def mmr_genre_reranker(candidates: np.ndarray, columns: Dict[str, np.ndarray], context: Dict,
+                       top_n: int) -> np.ndarray:
+    """
+    Maximal marginal relevance over genres.
+
+    From the best pool_size * top_n candidates, movies are picked one at a
+    time by lambda * relevance - (1 - lambda) * the largest genre similarity
+    to a movie already picked, so the list does not fill up with one genre.
+    Relevance is the score rescaled to [0, 1] over the pool.
+    """
+    model = context["model"]
+    pool = top_n_reranker(candidates, columns, context, top_n * context["mmr_pool_size"])
+    if "movie_genres" not in model or len(pool) <= 1:
+        return pool[:top_n]
+
+    scores = columns["score"][pool]
+    relevance = (scores - scores.min()) / max(scores.max() - scores.min(), 1e-12)
+    masks = np.ascontiguousarray(model["movie_genres"][candidates[pool]], dtype=np.int64)
+    mmr_lambda = context["mmr_lambda"]
+
+    picked = []
+    max_similarity = np.zeros(len(pool))
+    available = np.ones(len(pool), dtype=bool)
+    for _ in range(min(top_n, len(pool))):
+        gains = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity, -np.inf)
+        best = int(np.argmax(gains))
+        picked.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, genre_similarity(masks, int(masks[best])))
+    return pool[picked]
@@ -0,0 +1,90 @@
+"""
+Compact storage of the item factors.
+
+The model's Vt can be stored as float64, float32, float16 or int8. int8
+factors are scaled per item: every column of Vt is divided by its largest
+absolute value / 127 and the scales are kept as "Vt_scale". Scoring reads the
+stored factors a block of items at a time and dequantizes each block to
+float32 on the fly, so a full-precision copy of Vt never exists in memory.
+"""
+from typing import Dict, Union
+
+import numpy as np
+
+# Storage types supported for the item factors
+FACTOR_DTYPES = ("float64", "float32", "float16", "int8")
+
+Columns = Union[slice, np.ndarray]
+
+
+def quantize_item_factors(Vt: np.ndarray, dtype: str) -> Dict[str, np.ndarray]:
+    """
+    Converts the item factors to their storage type.
+
+    Args:
+        Vt (np.ndarray): factors x items matrix
+        dtype (str): One of FACTOR_DTYPES
+
+    Returns:
+        Dict[str, np.ndarray]: "Vt" in the storage type and, for int8, the per-item "Vt_scale"
+    """
+    if dtype not in FACTOR_DTYPES:
+        raise ValueError(f"Unsupported item factor dtype: {dtype}")
+    if dtype != "int8":
+        return {"Vt": Vt.astype(dtype)}
+
+    scale = np.abs(Vt).max(axis=0) / 127
+    scale[scale == 0] = 1
+    quantized = np.clip(np.round(Vt / scale), -127, 127).astype(np.int8)
+    return {"Vt": quantized, "Vt_scale": scale.astype(np.float32)}
+
+
+def get_item_factors(model: Dict, columns: Columns = slice(None)) -> np.ndarray:
+    """
+    Returns some columns of the item factors in a floating point type.
+
+    float64 and float32 factors are returned as stored; float16 and int8
+    factors are dequantized to float32.
+
+    Args:
+        model (Dict): Model holding "Vt" and, for int8 factors, "Vt_scale"
+        columns (Columns): Item positions or a slice of them
+
+    Returns:
+        np.ndarray: factors x len(columns) matrix
+    """
+    Vt = model["Vt"][:, columns]
+    if "Vt_scale" in model:
+        return Vt.astype(np.float32) * model["Vt_scale"][columns]
+    if Vt.dtype == np.float16:
+        return Vt.astype(np.float32)
+    return Vt
+
+
+def score_items(query: np.ndarray, model: Dict, columns: Columns = slice(None), block_size: int = 4096) -> np.ndarray:
+    """
+    Multiplies queries by the item factors of some columns.
+
+    Quantized factors are dequantized block_size items at a time, so only a
+    factors x block_size float32 buffer is ever materialized.
+
+    Args:
+        query (np.ndarray): factors vector or users x factors matrix
+        model (Dict): Model holding the item factors
+        columns (Columns): Item positions or a slice of them
+        block_size (int): Items dequantized at once
+
+    Returns:
+        np.ndarray: Scores of the selected items, per query row
+    """
+    Vt = model["Vt"]
+    if Vt.dtype in (np.float64, np.float32):
+        return query @ Vt[:, columns]
+
+    if isinstance(columns, slice):
+        columns = np.arange(Vt.shape[1])[columns]
+    scores = np.empty(query.shape[:-1] + (len(columns),), dtype=np.float32)
+    for start in range(0, len(columns), block_size):
+        block = columns[start:start + block_size]
+        scores[..., start:start + len(block)] = query @ get_item_factors(model, block)
+    return scores
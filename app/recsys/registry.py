@@ -0,0 +1,346 @@
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are not serialized across processes
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+from app.utils.settings import Config
+
+# Arrays that make up a model artifact, one .npy file each
+MODEL_ARRAYS = ("sigma", "Vt", "user_ratings_mean", "user_ids", "movie_ids", "popularity_penalty")
+
+# Arrays a model artifact may carry, loaded when present
+OPTIONAL_ARRAYS = ("Vt_scale", "item_evidence", "ann_centroids", "ann_exemplars", "ann_offsets", "ann_items",
+                   "neighbor_items", "neighbor_scores", "genres", "movie_genres", "cold_start_keys", "cold_start_items",
+                   "cold_start_scores")
+
+# File in the model directory naming the version that is currently served and its generation
+CURRENT_FILE = "CURRENT"
+
+# File in the model directory locked while a process builds a model
+BUILD_LOCK_FILE = ".build.lock"
+
+# File in the model directory locked while a process publishes a version
+PUBLISH_LOCK_FILE = ".publish.lock"
+
+# Training parameters of a version, stored next to its arrays
+METADATA_FILE = "model.json"
+
+# Training parameters promoted for future builds, stored in the model directory
+HYPERPARAMETERS_FILE = "hyperparameters.json"
+
+_model: Optional[Dict] = None
+_model_checked_at = 0.0
+_model_lock = threading.Lock()
+
+
+class StaleModelError(RuntimeError):
+    """Raised when a model derived from one version is published after another version became current."""
+
+
+def get_model_dir(model_dir: Optional[str] = None) -> Path:
+    return Path(model_dir or Config.MODEL_DIR)
+
+
+def read_current(model_dir: Optional[str] = None) -> Tuple[Optional[str], int]:
+    """
+    Reads the CURRENT file.
+
+    Returns:
+        Tuple[Optional[str], int]: The current version, or None if no model was
+        published yet, and its generation, which every publish increments
+    """
+    try:
+        lines = (get_model_dir(model_dir) / CURRENT_FILE).read_text().split()
+    except FileNotFoundError:
+        return None, 0
+    if not lines:
+        return None, 0
+    return lines[0], int(lines[1]) if len(lines) > 1 else 0
+
+
+def get_current_version(model_dir: Optional[str] = None) -> Optional[str]:
+    """Returns the version named in the CURRENT file, or None if no model was published yet."""
+    return read_current(model_dir)[0]
+
+
+@contextmanager
+def model_build_lock(model_dir: Optional[str] = None) -> Iterator[None]:
+    """
+    Holds an exclusive lock on the model directory across processes.
+
+    Worker processes that find no up-to-date model take it before building, so
+    one of them builds and the others wait and load its result.
+    """
+    with _file_lock(get_model_dir(model_dir) / BUILD_LOCK_FILE):
+        yield
+
+
+@contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_version_dir(version: Optional[str] = None, model_dir: Optional[str] = None) -> Path:
+    """Returns the directory of a model version, the current one by default."""
+    version = version or get_current_version(model_dir)
+    if version is None:
+        raise FileNotFoundError(f"No model found at {get_model_dir(model_dir)}. Please run `python -m app.recsys build`.")
+    return get_model_dir(model_dir) / version
+
+
+def save_model(arrays: Dict[str, np.ndarray], model_dir: Optional[str] = None, inherit: bool = False,
+               metadata: Optional[Dict[str, Any]] = None, base_version: Optional[str] = None) -> str:
+    """
+    Publishes the model arrays as a new version and makes it the current one.
+
+    The arrays are written as .npy files into a fresh version directory, which is
+    renamed into place once complete. The CURRENT file, naming the version and
+    the next generation number, is then replaced atomically, so readers only
+    ever see a finished version, and processes that still have an older version
+    memory-mapped keep reading its pages. Reading the generation and replacing
+    CURRENT happen under a lock on the model directory, so concurrent
+    publishers, e.g. the scheduler and the updater, never reuse a generation.
+
+    Args:
+        arrays (Dict[str, np.ndarray]): Arrays named as in MODEL_ARRAYS or OPTIONAL_ARRAYS, other keys are ignored
+        model_dir (Optional[str]): Model directory, defaults to Config.MODEL_DIR
+        inherit (bool): Hard-link every file of the base version that `arrays`
+            does not replace into the new one, so an update can change a few arrays
+        metadata (Optional[Dict[str, Any]]): Training parameters saved as model.json
+        base_version (Optional[str]): Version the arrays were derived from; it must
+            still be the current one, defaults to whatever is current
+
+    Returns:
+        str: The new version
+
+    Raises:
+        StaleModelError: If another version became current since base_version was loaded
+    """
+    root = get_model_dir(model_dir)
+    root.mkdir(parents=True, exist_ok=True)
+
+    version = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    tmp_dir = root / f".{version}.tmp"
+    tmp_dir.mkdir()
+
+    for name in MODEL_ARRAYS + OPTIONAL_ARRAYS:
+        if name in arrays:
+            np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(arrays[name]))
+    if metadata is not None:
+        with open(tmp_dir / METADATA_FILE, "w") as f:
+            json.dump(metadata, f)
+
+    with _file_lock(root / PUBLISH_LOCK_FILE):
+        current_version, generation = read_current(model_dir)
+        if base_version is not None and base_version != current_version:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise StaleModelError(f"Model version {base_version} is no longer current, {current_version} is")
+        if inherit and current_version is not None:
+            for source in (root / current_version).iterdir():
+                target = tmp_dir / source.name
+                if not target.exists():
+                    try:
+                        os.link(source, target)
+                    except OSError:
+                        shutil.copy2(source, target)
+
+        os.rename(tmp_dir, root / version)
+        write_current(root, version, generation + 1)
+
+        prune_versions(model_dir)
+    clear_model()
+    return version
+
+
+def write_current(root: Path, version: str, generation: int) -> None:
+    """Replaces the CURRENT file atomically; callers hold the publish lock."""
+    tmp_current = root / f".{CURRENT_FILE}.tmp"
+    tmp_current.write_text(f"{version}\n{generation}\n")
+    os.replace(tmp_current, root / CURRENT_FILE)
+
+
+def rollback_model(version: str, model_dir: Optional[str] = None) -> int:
+    """
+    Makes a kept version the current one again.
+
+    The version is published under the next generation, like a new build, so
+    every worker's get_model() picks it up at its next check.
+
+    Args:
+        version (str): Version to serve, one of the MODEL_KEEP_VERSIONS kept ones
+        model_dir (Optional[str]): Model directory, defaults to Config.MODEL_DIR
+
+    Returns:
+        int: The generation it is served under
+
+    Raises:
+        FileNotFoundError: If the version is not in the model directory
+    """
+    root = get_model_dir(model_dir)
+    if version.startswith(".") or not all((root / version / f"{name}.npy").exists() for name in MODEL_ARRAYS):
+        raise FileNotFoundError(f"No model version {version} at {root}")
+
+    with _file_lock(root / PUBLISH_LOCK_FILE):
+        _, generation = read_current(model_dir)
+        write_current(root, version, generation + 1)
+    clear_model()
+    return generation + 1
+
+
+def prune_versions(model_dir: Optional[str] = None, keep: Optional[int] = None) -> None:
+    """Deletes all but the `keep` newest versions, never the current one."""
+    root = get_model_dir(model_dir)
+    keep = Config.MODEL_KEEP_VERSIONS if keep is None else keep
+    current_version = get_current_version(model_dir)
+
+    versions = sorted(path for path in root.iterdir() if path.is_dir() and not path.name.startswith("."))
+    for path in versions[:-keep] if keep > 0 else versions:
+        if path.name != current_version:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def load_hyperparameters(model_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Returns the promoted training parameters, or an empty dict if none were promoted."""
+    path = get_model_dir(model_dir) / HYPERPARAMETERS_FILE
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_hyperparameters(hyperparameters: Dict[str, Any], model_dir: Optional[str] = None) -> None:
+    """Promotes training parameters so that every future build uses them."""
+    root = get_model_dir(model_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    tmp_file = root / f".{HYPERPARAMETERS_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(hyperparameters, f, indent=2)
+    os.replace(tmp_file, root / HYPERPARAMETERS_FILE)
+
+
+def load_metadata(version: Optional[str] = None, model_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Returns the training metadata of a model version, the current one by default, without loading its arrays."""
+    path = get_version_dir(version, model_dir) / METADATA_FILE
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_model(model_dir: Optional[str] = None, version: Optional[str] = None) -> Dict:
+    """
+    Loads a model version with every array memory-mapped read-only.
+
+    Worker processes that map the same files share the physical pages through
+    the OS page cache instead of each holding a private copy, so adding a
+    worker adds only its small private structures (the movieId index and the
+    cold-start key dict), not another copy of the arrays.
+
+    Args:
+        model_dir (Optional[str]): Model directory, defaults to Config.MODEL_DIR
+        version (Optional[str]): Version to load, defaults to the current one
+
+    Returns:
+        Dict: The model arrays, its "version" and "generation" (0 when it is not
+        the current version), its training "metadata", a
+        "movie_index" mapping movieIds to columns of Vt and, with cold-start
+        tables, a "cold_start_index" mapping list keys to their rows
+    """
+    current_version, generation = read_current(model_dir)
+    path = get_version_dir(version or current_version, model_dir)
+    missing = [name for name in MODEL_ARRAYS if not (path / f"{name}.npy").exists()]
+    if missing:
+        raise FileNotFoundError(f"No model found at {path} (missing {', '.join(missing)}). Please run `python -m app.recsys build`.")
+
+    model = {
+        name: np.load(path / f"{name}.npy", mmap_mode="r")
+        for name in MODEL_ARRAYS + OPTIONAL_ARRAYS
+        if name in MODEL_ARRAYS or (path / f"{name}.npy").exists()
+    }
+    model["version"] = path.name
+    model["generation"] = generation if path.name == current_version else 0
+    model["metadata"] = load_metadata(path.name, model_dir)
+    model["movie_index"] = pd.Index(model["movie_ids"])
+    if "cold_start_keys" in model:
+        model["cold_start_index"] = {str(key): row for row, key in enumerate(model["cold_start_keys"])}
+    return model
+
+
+def get_model() -> Dict:
+    """
+    Returns the process-wide model, loading it on first use.
+
+    At most every Config.MODEL_RELOAD_INTERVAL seconds the CURRENT file is
+    checked, and when its version or generation changed the version it names
+    replaces the served one, a rollback to an older version included. Callers
+    keep the dict they got, so in-flight requests finish on the old version.
+
+    Returns:
+        Dict: The model as returned by load_model()
+    """
+    global _model, _model_checked_at
+    model = _model
+    if model is not None and time.monotonic() - _model_checked_at < Config.MODEL_RELOAD_INTERVAL:
+        return model
+
+    with _model_lock:
+        if _model is None or time.monotonic() - _model_checked_at >= Config.MODEL_RELOAD_INTERVAL:
+            current_version, generation = read_current()
+            if _model is None or (current_version is not None
+                                  and (current_version, generation) != (_model["version"], _model["generation"])):
+                _model = load_model(version=current_version)
+            _model_checked_at = time.monotonic()
+        return _model
+
+
+def clear_model() -> None:
+    """Drops the process-wide model so that the next get_model() reloads it from disk."""
+    global _model
+    with _model_lock:
+        _model = None
+
+
+def get_worker_memory() -> Dict[str, Optional[int]]:
+    """
+    Returns the memory of this process, to compare worker processes.
+
+    Pages of the memory-mapped model count in the resident size (rss_kib) of
+    every worker that touched them, but are split between them in the
+    proportional size (pss_kib); private_kib is what the worker alone holds.
+    The sizes are None where /proc/self/smaps_rollup is unavailable.
+
+    Returns:
+        Dict[str, Optional[int]]: pid, rss_kib, pss_kib and private_kib
+    """
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1])
+    except OSError:
+        pass
+    private = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0) if fields else None
+    return {"pid": os.getpid(), "rss_kib": fields.get('Rss'), "pss_kib": fields.get('Pss'), "private_kib": private}
@@ -0,0 +1,151 @@
+"""
+Periodic full retraining of the recommender model.
+
+Each run trains on ratings.csv plus every scored rating of the Mongo `ratings`
+collection and publishes the result as a new model version. Serving
+processes pick the new version up on their next get_model() check, without
+a restart.
+
+With RETRAIN_INTERVAL set, every serving worker process runs a scheduler
+thread. A retraining is skipped when the current version was trained less
+than half an interval ago, so each interval runs one retraining whatever the
+number of workers, and timer drift between the workers cannot make all of them
+skip. Setting RETRAIN_INTERVAL=0 and running this module as a separate worker
+keeps retraining out of the serving processes altogether.
+
+Usage:
+    python -m app.recsys.scheduler [--interval SECONDS] [--once]
+"""
+import argparse
+import threading
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.recsys.matrix import get_dataset_checksum, load_ratings
+from app.recsys.registry import get_current_version, load_metadata, model_build_lock
+from app.recsys.updater import fetch_movielens_ids, fetch_new_ratings, save_watermark
+from app.utils.db import connect_db
+from app.utils.recommender import precompute_svd
+
+
+def fetch_mongo_ratings(db, first_user_id: int) -> Tuple[pd.DataFrame, float]:
+    """
+    Returns the scored Mongo ratings in the layout of ratings.csv.
+
+    Application users get consecutive userIds starting at first_user_id so they
+    never collide with the MovieLens users.
+
+    Args:
+        db: The MongoDB database
+        first_user_id (int): userId given to the first application user
+
+    Returns:
+        Tuple[pd.DataFrame, float]: The ratings and the newest rating timestamp
+    """
+    ratings = fetch_new_ratings(db, 0)
+    if not ratings:
+        return load_ratings().iloc[:0], 0.0
+
+    movielens_ids = fetch_movielens_ids(db, [rating['item_id'] for rating in ratings])
+    user_ids = {}
+    rows = []
+    for rating in ratings:
+        movie_id = movielens_ids.get(rating['item_id'])
+        if movie_id is not None:
+            user_id = user_ids.setdefault(rating['user_id'], first_user_id + len(user_ids))
+            rows.append((user_id, movie_id, rating['score'], int(rating['timestamp'])))
+
+    frame = pd.DataFrame(rows, columns=['userId', 'movieId', 'rating', 'timestamp']).astype({
+        'userId': np.int32,
+        'movieId': np.int32,
+        'rating': np.float32,
+        'timestamp': np.int64
+    })
+    # A rating submitted twice for the same movie counts once, with its latest score
+    frame = frame.sort_values('timestamp').drop_duplicates(['userId', 'movieId'], keep='last')
+    return frame, max(rating['timestamp'] for rating in ratings)
+
+
+def retrain(db=None, k: Optional[int] = None, min_age: float = 0.0) -> Optional[str]:
+    """
+    Retrains the model on ratings.csv plus the Mongo ratings and publishes it.
+
+    Training and publishing hold the model directory's build lock, so the
+    incremental updater never derives a version from one that is being replaced,
+    and schedulers of other worker processes wait and then see the new version.
+
+    Args:
+        db: The MongoDB database, or None to train on ratings.csv only
+        k (Optional[int]): Number of latent factors, defaults to the promoted or configured one
+        min_age (float): Seconds since the current version was trained below which
+            the retraining is skipped, 0 to always retrain
+
+    Returns:
+        Optional[str]: The published model version, or None if the retraining was skipped
+    """
+    with model_build_lock():
+        if min_age > 0 and get_current_version() is not None:
+            trained_at = load_metadata().get("trained_at")
+            if trained_at is not None and time.time() - trained_at < min_age:
+                return None
+
+        ratings = load_ratings()
+        sources = {"mongo_ratings": 0, "mongo_watermark": 0.0}
+        if db is not None:
+            mongo_ratings, watermark = fetch_mongo_ratings(db, int(ratings['userId'].max()) + 1)
+            ratings = pd.concat([ratings, mongo_ratings], ignore_index=True)
+            sources = {"mongo_ratings": len(mongo_ratings), "mongo_watermark": watermark}
+
+        # dataset_checksum covers ratings.csv only; the Mongo count and newest rating complete the training data
+        version = precompute_svd(k, ratings, dataset_checksum=get_dataset_checksum(), sources=sources)
+
+        # The incremental updater continues from the newest rating this version was trained on
+        save_watermark(sources["mongo_watermark"], version=version)
+    return version
+
+
+def run_scheduler(db, interval: float, stop_event: Optional[threading.Event] = None) -> None:
+    """
+    Retrains every `interval` seconds until interrupted or stop_event is set.
+
+    A retraining is skipped when another process published one less than half
+    an interval ago.
+    """
+    stop_event = stop_event or threading.Event()
+    while not stop_event.wait(interval):
+        try:
+            start = time.perf_counter()
+            version = retrain(db, min_age=interval / 2)
+            if version is not None:
+                print(f"Model version {version} trained in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            print(f"Error retraining the model: {e}")
+
+
+def start_scheduler(db, interval: float) -> threading.Event:
+    """
+    Starts run_scheduler() in a daemon thread.
+
+    Returns:
+        threading.Event: Set it to stop the scheduler
+    """
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_scheduler, args=(db, interval, stop_event), name='model-scheduler', daemon=True)
+    thread.start()
+    return stop_event
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Periodically retrain the recommender model.')
+    parser.add_argument('--interval', type=float, default=3600, help='Seconds between retrainings')
+    parser.add_argument('--once', action='store_true', help='Retrain once and exit')
+    args = parser.parse_args()
+
+    db = connect_db()
+    if args.once:
+        print(f"Published model version {retrain(db)}")
+    else:
+        run_scheduler(db, args.interval)
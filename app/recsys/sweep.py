@@ -0,0 +1,218 @@
+"""
+Parallel hyper-parameter sweep of the recommender.
+
+Every combination of engine, number of factors and popularity weight is trained
+on the older ratings and evaluated on the users' later ones, with the metrics of
+recsys/benchmarks/evaluate.py. Configurations run in a ProcessPoolExecutor: the
+training matrix is copied once into shared memory blocks and every worker maps
+it as a CSR matrix, so it is never pickled per task.
+
+The leaderboard, best NDCG first, is written as JSON. With --promote the best
+configuration is saved as the model directory's hyperparameters.json, which
+precompute_svd() and the scheduler build with from then on, and a model trained
+with it on all ratings is published for the server to load.
+
+Usage:
+    python -m app.recsys.sweep [--engine svd als] [--k 10 20 30 50] [--popularity-weight 0 0.5 1]
+                               [--workers 4] [--output leaderboard.json] [--promote]
+"""
+import argparse
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from app.recsys.matrix import build_rating_matrix, center_rating_matrix, get_dataset_checksum, load_ratings
+from app.recsys.metrics import latest_histories, ranking_metrics, time_split
+from app.recsys.registry import model_build_lock, save_hyperparameters
+from app.utils.recommender import (factorize, fold_in_user, get_batch_recommendation_items, get_popularity_penalty,
+                                   precompute_svd)
+from app.utils.settings import Config
+
+# Arrays of a CSR matrix that are placed in shared memory
+CSR_ARRAYS = ("data", "indices", "indptr")
+
+# State of a worker process, set once by init_worker()
+_worker: Dict = {}
+
+
+def share_matrix(matrix: csr_matrix) -> Tuple[List[SharedMemory], Dict]:
+    """
+    Copies the arrays of a CSR matrix into new shared memory blocks.
+
+    Returns:
+        Tuple[List[SharedMemory], Dict]: The blocks, to be unlinked by the caller,
+        and the spec attach_matrix() rebuilds the matrix from
+    """
+    blocks = []
+    spec = {"shape": matrix.shape}
+    for name in CSR_ARRAYS:
+        array = getattr(matrix, name)
+        block = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        spec[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, spec
+
+
+def attach_matrix(spec: Dict) -> Tuple[csr_matrix, List[SharedMemory]]:
+    """Maps a matrix shared by share_matrix() without copying it."""
+    blocks = []
+    arrays = {}
+    for name in CSR_ARRAYS:
+        block_name, shape, dtype = spec[name]
+        block = SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    matrix = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=spec["shape"], copy=False)
+    return matrix, blocks
+
+
+def init_worker(spec: Dict, user_ids: np.ndarray, movie_ids: np.ndarray,
+                histories: Dict[int, Dict[str, float]], test: pd.DataFrame) -> None:
+    """Attaches the shared training matrix and keeps the held-out split for every task of this worker."""
+    matrix, blocks = attach_matrix(spec)
+    _worker.update(matrix=matrix, blocks=blocks, user_ids=user_ids, movie_ids=movie_ids, histories=histories,
+                   test=test)
+
+
+def evaluate_config(config: Dict, top_k: int = 10, relevance_threshold: float = 4.0) -> Dict:
+    """
+    Trains one configuration on the shared matrix and evaluates it on the held-out ratings.
+
+    Args:
+        config (Dict): engine, k and popularity_weight
+        top_k (int): Cut-off of the ranking metrics
+        relevance_threshold (float): Test ratings counted as relevant
+
+    Returns:
+        Dict: The configuration with its metrics and training time
+    """
+    start = time.perf_counter()
+    matrix = _worker["matrix"]
+    matrix_norm, user_ratings_mean = center_rating_matrix(matrix)
+    _, sigma, Vt = factorize(matrix_norm, config["k"], config["engine"])
+    rating_mass = np.asarray(matrix.sum(axis=0)).ravel()
+    model = {
+        "version": "sweep",
+        "sigma": sigma,
+        "Vt": Vt,
+        "user_ratings_mean": user_ratings_mean,
+        "user_ids": _worker["user_ids"],
+        "movie_ids": _worker["movie_ids"],
+        "movie_index": pd.Index(_worker["movie_ids"]),
+        "popularity_penalty": get_popularity_penalty(rating_mass, config["popularity_weight"]),
+        "metadata": {"engine": config["engine"]}
+    }
+    if config["engine"] == 'als':
+        model["metadata"]["als_regularization"] = Config.ALS_REGULARIZATION
+    train_seconds = time.perf_counter() - start
+
+    histories = _worker["histories"]
+    test = _worker["test"]
+    recommendations = get_batch_recommendation_items(histories, top_k, model=model)
+
+    errors, ndcgs, recalls = [], [], []
+    for user_id, user_test in test.groupby('userId'):
+        if user_id not in histories:
+            continue  # Cold-start users are not served by the factorization
+
+        positions = model["movie_index"].get_indexer(user_test['movieId'].to_numpy())
+        known = positions >= 0
+        if known.any():
+            user_factors, user_mean = fold_in_user(histories[user_id], model)
+            predictions = (user_factors * sigma) @ Vt[:, positions[known]] + user_mean
+            errors.append(np.clip(predictions, 0.5, 5) - user_test['rating'].to_numpy()[known])
+
+        relevant = set(user_test.loc[user_test['rating'] >= relevance_threshold, 'movieId'])
+        if relevant:
+            _, recall, ndcg = ranking_metrics(list(recommendations[user_id][0]), relevant, top_k)
+            recalls.append(recall)
+            ndcgs.append(ndcg)
+
+    errors = np.concatenate(errors) if errors else np.empty(0)
+    return {
+        **config,
+        'rmse': float(np.sqrt(np.mean(errors ** 2))) if len(errors) else None,
+        f'recall@{top_k}': float(np.mean(recalls)) if recalls else None,
+        f'ndcg@{top_k}': float(np.mean(ndcgs)) if ndcgs else None,
+        'train_seconds': train_seconds
+    }
+
+
+def run_sweep(ratings: pd.DataFrame, configs: List[Dict], workers: int, train_fraction: float = 0.8,
+              history: int = 6, top_k: int = 10) -> List[Dict]:
+    """
+    Evaluates every configuration in parallel on a per-user time-based split.
+
+    Args:
+        ratings (pd.DataFrame): Ratings to split into training and held-out sets
+        configs (List[Dict]): Configurations with engine, k and popularity_weight
+        workers (int): Number of worker processes
+        train_fraction (float): Share of each user's ratings used for training
+        history (int): Latest training ratings fed to the recommender per test user
+        top_k (int): Cut-off of the ranking metrics
+
+    Returns:
+        List[Dict]: The leaderboard, best NDCG first and lowest RMSE on ties
+    """
+    train, test = time_split(ratings, train_fraction)
+    matrix, user_ids, movie_ids = build_rating_matrix(train)
+    histories = latest_histories(train, history)
+
+    blocks, spec = share_matrix(matrix)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(spec, user_ids, movie_ids, histories, test)) as executor:
+            results = list(executor.map(evaluate_config, configs, itertools.repeat(top_k)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    ndcg = f'ndcg@{top_k}'
+    return sorted(results, key=lambda result: (-(result[ndcg] or 0.0), result['rmse'] or np.inf))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep recommender hyper-parameters on a per-user time-based split.')
+    parser.add_argument('--engine', nargs='+', default=[Config.RECSYS_ENGINE], choices=['svd', 'als'])
+    parser.add_argument('--k', type=int, nargs='+', default=[10, 20, 30, 50], help='Numbers of latent factors')
+    parser.add_argument('--popularity-weight', type=float, nargs='+', default=[0.0, 0.5, 1.0],
+                        help='Strengths of the popularity penalty')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, defaults to the CPU count')
+    parser.add_argument('--train-fraction', type=float, default=0.8, help="Share of each user's ratings used for training")
+    parser.add_argument('--history', type=int, default=6, help='Latest ratings fed to the recommender per user')
+    parser.add_argument('--top-k', type=int, default=10, help='Cut-off of the ranking metrics')
+    parser.add_argument('--output', default='leaderboard.json', help='Write the leaderboard to this JSON file')
+    parser.add_argument('--promote', action='store_true', help='Promote the best configuration and publish it')
+    args = parser.parse_args()
+
+    configs = [
+        {'engine': engine, 'k': k, 'popularity_weight': weight}
+        for engine, k, weight in itertools.product(args.engine, args.k, args.popularity_weight)
+    ]
+    ratings = load_ratings()
+    start = time.perf_counter()
+    leaderboard = run_sweep(ratings, configs, args.workers, args.train_fraction, args.history, args.top_k)
+    print(f"Evaluated {len(configs)} configurations in {time.perf_counter() - start:.1f}s")
+
+    with open(args.output, 'w') as f:
+        json.dump(leaderboard, f, indent=2)
+    for rank, result in enumerate(leaderboard, 1):
+        print(rank, json.dumps(result))
+
+    if args.promote:
+        best = {name: leaderboard[0][name] for name in ('engine', 'k', 'popularity_weight')}
+        save_hyperparameters(best)
+        with model_build_lock():
+            version = precompute_svd(best['k'], ratings, best['engine'], best['popularity_weight'],
+                                     dataset_checksum=get_dataset_checksum())
+        print(f"Promoted {best} as model version {version}")
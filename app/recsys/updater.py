@@ -0,0 +1,287 @@
+"""
+Incremental model updates from the ratings users submit through the API.
+
+Ratings are stored in the `ratings` collection and never reach ratings.csv, so
+this module pulls the ones added since a watermark, maps them to MovieLens ids
+and refines only the item factors they touch. Application users are not part
+of the training matrix; they are folded in at request time, so their factors
+follow from the updated item factors.
+
+Usage:
+    python -m app.recsys.updater [--interval SECONDS] [--once]
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+from pymongo import ASCENDING
+
+from app.recsys.ann import get_item_vectors, reassign_ivf_items
+from app.recsys.quantize import get_item_factors, quantize_item_factors
+from app.recsys.registry import StaleModelError, get_version_dir, load_model, model_build_lock, save_model
+from app.utils.db import connect_db
+from app.utils.item_index import item_index
+from app.utils.recommender import fold_in_positions, get_popularity_penalty
+
+# Watermark of the last Mongo rating folded into a model version, kept next to its arrays
+UPDATER_STATE_FILE = "updater_state.json"
+
+
+def load_watermark(model_dir: Optional[str] = None, version: Optional[str] = None) -> float:
+    state_file = get_version_dir(version, model_dir) / UPDATER_STATE_FILE
+    if not state_file.exists():
+        return 0.0
+    with open(state_file) as f:
+        return json.load(f)["watermark"]
+
+
+def save_watermark(watermark: float, model_dir: Optional[str] = None, version: Optional[str] = None) -> None:
+    # Replace rather than overwrite, the file may be hard-linked into older versions
+    state_file = get_version_dir(version, model_dir) / UPDATER_STATE_FILE
+    tmp_file = state_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump({"watermark": watermark}, f)
+    os.replace(tmp_file, state_file)
+
+
+def fetch_new_ratings(db, watermark: float) -> List[Dict]:
+    """
+    Returns the scored ratings of the ratings collection with a timestamp after the watermark.
+
+    Args:
+        db: The MongoDB database
+        watermark (float): Timestamp of the last rating already applied
+
+    Returns:
+        List[Dict]: Ratings as {user_id, item_id, score, timestamp}
+    """
+    return list(db.ratings.find(
+        {'timestamp': {'$gt': watermark}, 'score': {'$ne': None}},
+        {'_id': 0, 'user_id': 1, 'item_id': 1, 'score': 1, 'timestamp': 1}
+    ))
+
+
+def fetch_user_histories(db, user_ids: List[str]) -> Dict[str, Dict[str, float]]:
+    """
+    Returns the full {item_id: score} rating history of the given users.
+
+    Args:
+        db: The MongoDB database
+        user_ids (List[str]): Users whose histories are needed
+
+    Returns:
+        Dict[str, Dict[str, float]]: Scored ratings per user, the latest score of an item rated twice
+    """
+    histories = {}
+    ratings = db.ratings.find({'user_id': {'$in': user_ids}, 'score': {'$ne': None}},
+                              {'_id': 0, 'user_id': 1, 'item_id': 1, 'score': 1}).sort('timestamp', ASCENDING)
+    for rating in ratings:
+        histories.setdefault(rating['user_id'], {})[rating['item_id']] = rating['score']
+    return histories
+
+
+def fetch_movielens_ids(db, item_ids: List[str]) -> Dict[str, int]:
+    """
+    Maps item ObjectId strings to MovieLens ids.
+
+    Inside the server the in-memory item index answers without a query; the
+    standalone updater, which never loads it, asks the `items` collection.
+
+    Args:
+        db: The MongoDB database
+        item_ids (List[str]): Item ids as stored in the users' ratings
+
+    Returns:
+        Dict[str, int]: movieLensId per item id, items without one are left out
+    """
+    if len(item_index):
+        item_ids = list(set(item_ids))
+        return {
+            item_id: int(movie_id)
+            for item_id, movie_id in zip(item_ids, item_index.to_movielens_ids(item_ids)) if movie_id is not None
+        }
+
+    object_ids = [ObjectId(item_id) for item_id in set(item_ids) if ObjectId.is_valid(item_id)]
+    items = db.items.find({'_id': {'$in': object_ids}, 'movieLensId': {'$exists': True}}, {'movieLensId': 1})
+    return {str(item['_id']): int(item['movieLensId']) for item in items}
+
+
+def update_item_factors(model: Dict, Vt: np.ndarray, evidence: np.ndarray,
+                        histories: List[Tuple[np.ndarray, np.ndarray]],
+                        new_ratings: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                        steps: int = 3, reg: float = 1.0) -> np.ndarray:
+    """
+    Refines the item factors touched by new ratings with localized ALS steps.
+
+    Each step folds the affected users in with the current factors through
+    fold_in_positions(), the projection or, for ALS models, the ridge solve
+    serving uses, and then solves for every affected item the ridge problem
+
+        min_v  sum_u (r_uj - mean_u - p_u . v)^2 + reg * sum_f w_fj (v_f - v_old_f)^2
+
+    over its new ratings only. The anchor weights w_j are the item's evidence
+    e_j (see get_item_evidence()) plus its mean over the factors, so that no
+    factor is left unanchored. Weighting the anchor by the training ratings
+    behind v_old keeps everything learned from the full training set: a new
+    rating counts about as much as one training rating. The cost is
+    O(new ratings * k^2).
+
+    Args:
+        model (Dict): The model Vt belongs to, for its sigma and fold-in metadata
+        Vt (np.ndarray): factors x items matrix, updated in place
+        evidence (np.ndarray): factors x items evidence of Vt, the new ratings are added in place
+        histories (List[Tuple[np.ndarray, np.ndarray]]): (positions, scores) of every affected user
+        new_ratings (Tuple[np.ndarray, np.ndarray, np.ndarray]): (user row in histories, item position, score)
+        steps (int): Number of alternating user/item steps
+        reg (float): Strength of the anchor to the current item factors
+
+    Returns:
+        np.ndarray: Positions of the updated items
+    """
+    users, items, scores = new_ratings
+    updated_items = np.unique(items)
+
+    # New ratings grouped by item, one group per entry of updated_items
+    order = np.argsort(items, kind='stable')
+    boundaries = np.flatnonzero(np.diff(items[order])) + 1
+    user_means = np.array([history_scores.mean() for _, history_scores in histories])
+    anchors = Vt[:, updated_items].copy()
+    item_evidence = evidence[:, updated_items].astype(np.float64)
+    anchor_weights = reg * (item_evidence + item_evidence.mean(axis=0))
+    current = {"Vt": Vt, "sigma": model["sigma"], "metadata": model["metadata"]}
+
+    for _ in range(steps):
+        # User step: fold every affected user in with the current item factors, scaled like the serving query
+        user_factors = np.stack([
+            fold_in_positions(positions, history_scores, current)[0] * model["sigma"]
+            for positions, history_scores in histories
+        ])
+
+        # Item step: one k x k ridge solve per affected item
+        residuals = scores - user_means[users]
+        for column, observed in enumerate(np.split(order, boundaries)):
+            P = user_factors[users[observed]]
+            lhs = P.T @ P + np.diag(anchor_weights[:, column])
+            rhs = P.T @ residuals[observed] + anchor_weights[:, column] * anchors[:, column]
+            Vt[:, updated_items[column]] = np.linalg.solve(lhs, rhs)
+
+    # The new ratings are evidence for the next update
+    np.add.at(evidence.T, items, user_factors[users] ** 2)
+    return updated_items
+
+
+def apply_new_ratings(db, model_dir: Optional[str] = None, steps: int = 3, reg: float = 1.0) -> int:
+    """
+    Folds the Mongo ratings added since the last watermark into the current
+    model and publishes the result as a new version.
+
+    The update runs under the model directory's build lock, so the scheduler
+    and the sweep never publish while it computes. Should another version
+    become current anyway, e.g. by a rollback, nothing is published and the
+    ratings are applied to that version on the next run.
+
+    Args:
+        db: The MongoDB database
+        model_dir (Optional[str]): Model directory, defaults to Config.MODEL_DIR
+        steps (int): Number of alternating user/item steps
+        reg (float): Strength of the anchor to the current item factors
+
+    Returns:
+        int: Number of new ratings applied
+    """
+    with model_build_lock(model_dir):
+        try:
+            return _apply_new_ratings(db, model_dir, steps, reg)
+        except StaleModelError as e:
+            print(f"Skipped publishing the updated model: {e}")
+            return 0
+
+
+def _apply_new_ratings(db, model_dir: Optional[str], steps: int, reg: float) -> int:
+    model = load_model(model_dir)
+    if "item_evidence" not in model:
+        print(f"Model version {model['version']} has no item evidence, rebuild it to apply new ratings")
+        return 0
+    watermark = load_watermark(model_dir, model["version"])
+    new_ratings = fetch_new_ratings(db, watermark)
+    if not new_ratings:
+        return 0
+
+    user_ids = list({rating['user_id'] for rating in new_ratings})
+    histories = fetch_user_histories(db, user_ids)
+    movielens_ids = fetch_movielens_ids(db, [item_id for history in histories.values() for item_id in history])
+
+    movie_index = model["movie_index"]
+
+    def to_positions(item_ids):
+        ids = np.array([movielens_ids.get(item_id, -1) for item_id in item_ids], dtype=np.int64)
+        return movie_index.get_indexer(ids)
+
+    # Affected users' histories as (positions, scores) over the model's movies
+    user_rows = {}
+    user_histories = []
+    for user_id, history in histories.items():
+        positions = to_positions(history.keys())
+        known = positions >= 0
+        if known.any():
+            user_rows[user_id] = len(user_histories)
+            user_histories.append((positions[known], np.array(list(history.values()), dtype=np.float64)[known]))
+
+    # New ratings on movies the model knows; the rest waits for the next full retraining
+    rows = np.array([user_rows.get(rating['user_id'], -1) for rating in new_ratings], dtype=np.int64)
+    items = to_positions([rating['item_id'] for rating in new_ratings])
+    scores = np.array([rating['score'] for rating in new_ratings], dtype=np.float64)
+    known = (rows >= 0) & (items >= 0)
+
+    version = model["version"]
+    if known.any():
+        Vt = np.array(get_item_factors(model), dtype=np.float64)
+        evidence = np.array(model["item_evidence"])
+        update_item_factors(model, Vt, evidence, user_histories, (rows[known], items[known], scores[known]),
+                            steps, reg)
+
+        # Add the new ratings to each movie's rating mass behind the popularity penalty
+        popularity_penalty = model["popularity_penalty"]
+        popularity_weight = model["metadata"].get("popularity_weight", 0.0)
+        if popularity_weight > 0:
+            rating_mass = np.expm1((popularity_penalty.astype(np.float64) - 1) / popularity_weight)
+            np.add.at(rating_mass, items[known], scores[known])
+            popularity_penalty = get_popularity_penalty(rating_mass, popularity_weight)
+
+        # Publish a new version that shares every other array with the one it was derived from
+        factor_dtype = model["metadata"].get("item_factor_dtype", "float64")
+        arrays = {"popularity_penalty": popularity_penalty, "item_evidence": evidence,
+                  **quantize_item_factors(Vt, factor_dtype)}
+
+        # Move the updated items, whose factors and penalty changed, to the ANN list they now belong to
+        if "ann_centroids" in model:
+            arrays.update(reassign_ivf_items(model, get_item_vectors(Vt, popularity_penalty), np.unique(items[known])))
+        version = save_model(arrays, model_dir, inherit=True, base_version=version)
+
+    save_watermark(max(rating['timestamp'] for rating in new_ratings), model_dir, version)
+    return int(known.sum())
+
+
+def run_updater(db, interval: float, model_dir: Optional[str] = None) -> None:
+    """Applies new ratings every `interval` seconds until interrupted."""
+    while True:
+        applied = apply_new_ratings(db, model_dir)
+        if applied:
+            print(f"Applied {applied} new ratings to the model")
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fold new ratings from MongoDB into the model.')
+    parser.add_argument('--interval', type=float, default=120, help='Seconds between updates')
+    parser.add_argument('--once', action='store_true', help='Apply pending ratings once and exit')
+    args = parser.parse_args()
+
+    if args.once:
+        print(f"Applied {apply_new_ratings(connect_db())} new ratings to the model")
+    else:
+        run_updater(connect_db(), args.interval)
@@ -3,6 +3,9 @@ from bson.errors import InvalidId
 from flask import Blueprint, request, jsonify, current_app
 
 from app.models.Item import get_movie_poster, search_items, get_movie_genres
+from app.models.Rating import find_item_ratings
+from app.utils.item_index import item_index
+from app.utils.recommender import get_similar_items
 
 items_bp = Blueprint('items', __name__)
 
@@ -58,19 +61,46 @@ def get_item_ratings(item_id):
     except InvalidId:
         return jsonify({'message': 'Cannot find item'}), 404
 
-    item = current_app.db.items.find_one({'_id': object_id})
+    item = current_app.db.items.find_one({'_id': object_id}, {'_id': 1})
     if item:
-        user_ratings = current_app.db.users.find({'ratings.item_id': str(object_id)})
-        ratings = []
-        for user in user_ratings:
-            for rating in user['ratings']:
-                if rating['item_id'] == str(object_id):
-                    ratings.append({
-                        'user_id': str(user['_id']),
-                        'score': rating['score'],
-                        'timestamp': rating['timestamp']
-                    })
+        # Served by the item_id index of the ratings collection, plus the embedded ratings not migrated yet
+        ratings = find_item_ratings(current_app.db, str(object_id))
         return jsonify(ratings), 200
     else:
         return jsonify({'message': 'Cannot find item'}), 404
 
+
+@items_bp.route('/items/<item_id>/similar', methods=['GET'])
+def get_item_similar(item_id):
+    try:
+        object_id = ObjectId(item_id)
+    except InvalidId:
+        return jsonify({'message': 'Cannot find item'}), 404
+
+    if object_id not in item_index:
+        return jsonify({'message': 'Cannot find item'}), 404
+    movie_id = item_index.to_movielens_ids([object_id])[0]
+    if movie_id is None:
+        return jsonify([]), 200
+
+    limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+    try:
+        similar = get_similar_items({movie_id: 1.0}, limit)
+    except Exception as e:
+        current_app.logger.error(f"Error fetching similar items: {e}")
+        return jsonify({'error': 'Failed to fetch similar items'}), 500
+
+    # Fetch the similar items in one query by _id and return them in similarity order
+    item_ids = item_index.to_object_ids(similar.index)
+    similarities = {item_id: float(similarity) for item_id, similarity in zip(item_ids, similar) if item_id is not None}
+    similar_items = current_app.db.items.find({'_id': {'$in': [ObjectId(item_id) for item_id in similarities]}})
+    items = []
+    for similar_item in similar_items:
+        similar_item['_id'] = str(similar_item['_id'])
+        similar_item['poster_path'] = get_movie_poster(similar_item.get('poster_path'))
+        similar_item['genres'] = get_movie_genres(similar_item.get('genres'))
+        similar_item['similarity'] = similarities[similar_item['_id']]
+        items.append(similar_item)
+    items.sort(key=lambda i: i['similarity'], reverse=True)
+
+    return jsonify(items), 200
@@ -4,8 +4,11 @@ from bson import ObjectId
 from bson.errors import InvalidId
 from flask import Blueprint, request, jsonify, current_app
 
-from app.utils.auth.auth import token_required
+from app.models.Rating import MIGRATED_FIELD, find_user_ratings
+from app.utils.auth.auth import token_required, firewall
+from app.utils.item_index import item_index
 from app.utils.llm.llm_connector import explain_recommendation
+from app.utils.recommender import recommendation_cache, recommendation_pipeline
 from app.utils.s_big5 import calculate_ocens
 
 recommendations_bp = Blueprint('recommendations', __name__)
@@ -34,21 +37,19 @@ def get_recommendation_explanation(sub, recommendation_id):
             return jsonify({'message': 'Cannot find recommendation'}), 404
 
         if 'explanation' not in recommendation:
-            item_to_recommend = current_app.db.items.find_one({'_id': ObjectId(recommendation['item_id'])})
-            item_to_recommend = item_to_recommend['title']
+            # Titles come from the in-memory item index, without a query per item
+            item_to_recommend = item_index.get_title(recommendation['item_id'])
 
             rated_items = []
-            for rating in sorted(user['ratings'], key=lambda r: r['timestamp'], reverse=True)[:6]:
-                try:
-                    item = current_app.db.items.find_one({'_id': ObjectId(rating['item_id'])})
-                    if item:
-                        rated_items.append({
-                            'title': item['title'],
-                            'score': rating['score']
-                        })
-                except Exception as e:
-                    current_app.logger.error(f"Error fetching item for rating: {rating} - {str(e)}")
+            for rating in find_user_ratings(current_app.db, sub, limit=6, migrated=user.get(MIGRATED_FIELD, False)):
+                title = item_index.get_title(rating['item_id'])
+                if title is None:
+                    current_app.logger.error(f"Error fetching item for rating: {rating}")
                     continue  # Skip invalid or missing items
+                rated_items.append({
+                    'title': title,
+                    'score': rating['score']
+                })
 
 
             if user['test_group'] == 'A':
@@ -67,6 +68,18 @@ def get_recommendation_explanation(sub, recommendation_id):
         return jsonify({'message': 'Cannot find recommendation'}), 404
 
 
+@recommendations_bp.route('/recommendations/cache/stats', methods=['GET'])
+@firewall
+def get_recommendation_cache_stats():
+    return jsonify(recommendation_cache.stats()), 200
+
+
+@recommendations_bp.route('/recommendations/pipeline/stats', methods=['GET'])
+@firewall
+def get_recommendation_pipeline_stats():
+    return jsonify(recommendation_pipeline.timings.stats()), 200
+
+
 @recommendations_bp.route('/recommendations/<recommendation_id>/', methods=['GET'])
 @token_required
 def get_recommendation(sub, recommendation_id):
@@ -1,12 +1,18 @@
+import json
+import re
 from datetime import datetime
 
 from bson import ObjectId
 from bson.errors import InvalidId
-from flask import Blueprint, request, jsonify, current_app, abort
+from flask import Blueprint, Response, request, jsonify, current_app, abort, stream_with_context
+from pymongo import ASCENDING, UpdateOne
 
+from app.models.Rating import MIGRATED_FIELD, find_user_ratings
 from app.utils.AB_testing import get_balanced_ab_group
 from app.utils.auth.auth import get_jwt, token_required, firewall
-from app.utils.recommender import get_recommendations
+from app.utils.item_index import item_index
+from app.utils.recommender import get_available_movies, get_batch_recommendations, get_cached_recommendations, \
+    invalidate_cached_recommendations
 from app.utils.s_big5 import calculate_ocens
 
 users_bp = Blueprint('users', __name__)
@@ -17,10 +23,84 @@ users_bp = Blueprint('users', __name__)
 @users_bp.route('/users', methods=['GET'])
 @firewall
 def get_users():
-    users = list(current_app.db.users.find())
+    # Keyset pagination on _id: ?after=<last _id of the previous page>&limit=N
+    after = request.args.get('after')
+    try:
+        limit = int(request.args.get('limit', current_app.config['USERS_PAGE_SIZE']))
+        query = {'_id': {'$gt': ObjectId(after)}} if after else {}
+    except (ValueError, InvalidId):
+        return jsonify({'message': 'Invalid limit or after value'}), 400
+    if limit < 0:
+        return jsonify({'message': 'Invalid limit or after value'}), 400
+
+    # Only the requested fields, ?fields=test_group,created_at; everything but legacy embedded ratings by default
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    if any(not re.fullmatch(r'[A-Za-z0-9_.]+', field) for field in fields):
+        return jsonify({'message': 'Invalid fields value'}), 400
+    projection = {field: 1 for field in fields} if fields else {'ratings': 0}
+
+    cursor = current_app.db.users.find(query, projection).sort('_id', ASCENDING)
+
+    if request.args.get('format') == 'ndjson':
+        # Stream the whole table, or `limit` users if given, one JSON document per line; the cursor fetches
+        # bounded batches, so server memory stays constant whatever the number of users
+        cursor = cursor.batch_size(current_app.config['USERS_EXPORT_BATCH_SIZE'])
+        if 'limit' in request.args:
+            cursor = cursor.limit(limit)
+
+        def generate():
+            for user in cursor:
+                user['_id'] = str(user['_id'])
+                yield json.dumps(user, default=str) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    limit = min(max(limit, 1), current_app.config['USERS_PAGE_MAX_SIZE'])
+    users = list(cursor.limit(limit))
     for user in users:
         user['_id'] = str(user['_id'])
-    return jsonify(users)
+    response = jsonify(users)
+    # A full page may be followed by more users, fetched with ?after=<X-Next-After>
+    if len(users) == limit:
+        response.headers['X-Next-After'] = users[-1]['_id']
+    return response
+
+
+def is_valid_user_ratings(user_ratings) -> bool:
+    """Checks that a batch entry is a {movieLensId: rating} dict, with numeric or null ratings."""
+    if not isinstance(user_ratings, dict):
+        return False
+    return all(
+        str(movie_id).isdigit()
+        and (rating is None or (isinstance(rating, (int, float)) and not isinstance(rating, bool)))
+        for movie_id, rating in user_ratings.items()
+    )
+
+
+@users_bp.route('/recommendations/batch', methods=['POST'])
+@firewall
+def get_users_batch_recommendations():
+    data = request.get_json()
+
+    # Validate the input data
+    if not data:
+        return jsonify({'message': 'No input data provided'}), 400
+    if not isinstance(data.get('users'), dict):
+        return jsonify({'message': 'Missing users'}), 400
+    for user_key, user_ratings in data['users'].items():
+        if not is_valid_user_ratings(user_ratings):
+            return jsonify({'message': f'Invalid ratings of user {user_key}'}), 400
+    top_n = data.get('top_n', 3)
+    if not isinstance(top_n, int) or top_n < 1:
+        return jsonify({'message': 'Invalid top_n value'}), 400
+
+    try:
+        # Dict where the key is the caller's user key and the value is a {movieLensId: rating} dict
+        recommendations = get_batch_recommendations(data['users'], top_n)
+        return jsonify(recommendations), 200
+    except Exception as e:
+        current_app.logger.error(f"Error generating batch recommendations: {e}")
+        return jsonify({'error': 'Failed to generate recommendations'}), 500
 
 
 @users_bp.route('/users/<user_id>', methods=['GET'])
@@ -59,9 +139,9 @@ def get_user_ratings(sub, user_id):
         abort(404, description="User not found")
 
     # Try to find the user in the database
-    user = current_app.db.users.find_one({'_id': object_id})
+    user = current_app.db.users.find_one({'_id': object_id}, {'_id': 1, MIGRATED_FIELD: 1})
     if user:
-        ratings = user['ratings']
+        ratings = find_user_ratings(current_app.db, user_id, migrated=user.get(MIGRATED_FIELD, False))
         return jsonify(ratings), 200
     else:
         # If user is not found, return a 404 error
@@ -104,56 +184,64 @@ def get_user_recommendation(sub, user_id):
         abort(404, description="User not found")
 
     # Find the user in the database
-    user = current_app.db.users.find_one({'_id': object_id})
+    user = current_app.db.users.find_one({'_id': object_id}, {'_id': 1, MIGRATED_FIELD: 1})
     if not user:
         abort(404, description="User not found")
 
-    # Retrieve the user's ratings
-    ratings = user.get('ratings', [])
-    if not ratings:
-        return jsonify({'message': 'No ratings found'}), 404
+    # Retrieve the user's last 6 ratings, users with few or none get the precomputed cold-start lists
+    ratings = find_user_ratings(current_app.db, user_id, limit=6, migrated=user.get(MIGRATED_FIELD, False))
 
-    ratings = sorted(ratings, key=lambda x: x['timestamp'], reverse=True)[:6]
-
-    # Fetch items based on the last 6 ratings
-    item_ids = [ObjectId(rating['item_id']) for rating in ratings]
-    items = list(current_app.db.items.find({'_id': {'$in': item_ids}}))
-
-    #Dict where the key is the movieLensId and the value is the rating
-    items = {item['movieLensId']: rating['score'] for item in items for rating in ratings if item['_id'] == ObjectId(rating['item_id'])}
+    #Dict where the key is the movieLensId and the value is the rating, from the in-memory item index
+    movie_ids = item_index.to_movielens_ids(rating['item_id'] for rating in ratings)
+    items = {movie_id: rating['score'] for movie_id, rating in zip(movie_ids, ratings) if movie_id is not None}
 
     try:
         current_time = datetime.now()
         # Get recommendations based on the items
+        res = get_cached_recommendations(user_id, items, available=get_available_movies())
+
         recommendations = []
-        res = get_recommendations(items)
-        for r in res:
-            matching_item = current_app.db.items.find_one({'movieLensId': r['movieLensId']})
-            if matching_item:
-                recommendation = {
-                    'item_id': str(matching_item['_id']),
+        for r, item_id in zip(res, item_index.to_object_ids(r['movieLensId'] for r in res)):
+            if item_id is not None:
+                recommendations.append({
+                    'item_id': item_id,
                     'user_id': user_id,
                     'pred_score': r['pred_score'],
+                    'model_version': r['model_version'],
                     'timestamp': datetime.timestamp(current_time),
                     'created_at': datetime.timestamp(current_time),
                     'updated_at': datetime.timestamp(current_time),
                     'version': 1
+                })
+
+        # Insert the recommendations that do not already exist by user and item, else update the existing
+        # ones, all in one unordered bulk write
+        if recommendations:
+            result = current_app.db.recommendations.bulk_write([
+                UpdateOne(
+                    {'user_id': user_id, 'item_id': recommendation['item_id']},
+                    {'$set': {'updated_at': recommendation['updated_at'],
+                              'model_version': recommendation['model_version']},
+                     '$setOnInsert': {key: value for key, value in recommendation.items()
+                                      if key not in ('updated_at', 'model_version')}},
+                    upsert=True
+                )
+                for recommendation in recommendations
+            ], ordered=False)
+            for index, inserted_id in result.upserted_ids.items():
+                recommendations[index]['_id'] = str(inserted_id)
+
+            # The ids of the recommendations that already existed are not returned by the bulk write
+            existing = [recommendation['item_id'] for recommendation in recommendations if '_id' not in recommendation]
+            if existing:
+                existing_ids = {
+                    found['item_id']: str(found['_id'])
+                    for found in current_app.db.recommendations.find(
+                        {'user_id': user_id, 'item_id': {'$in': existing}}, {'_id': 1, 'item_id': 1})
                 }
-                # Insert the recommendation into the database if it does not already exist by user and item
-                # else update the existing recommendation
-                existing_recommendation = current_app.db.recommendations.find_one(
-                    {'user_id': user_id, 'item_id': recommendation['item_id']})
-                if existing_recommendation:
-                    current_app.db.recommendations.update_one(
-                        {'_id': object_id},
-                        {'$set': {'updated_at': datetime.timestamp(current_time)}}
-                    )
-                    recommendation['_id'] = str(existing_recommendation['_id'])
-
-                else:
-                    insert_result = current_app.db.recommendations.insert_one(recommendation)
-                    recommendation['_id'] = str(insert_result.inserted_id)
-                recommendations.append(recommendation)
+                for recommendation in recommendations:
+                    if '_id' not in recommendation:
+                        recommendation['_id'] = existing_ids.get(recommendation['item_id'])
         return jsonify(recommendations), 200
 
     except Exception as e:
@@ -169,20 +257,25 @@ def add_new_user():
     data = request.get_json()
     current_time = datetime.now()
     # Construct the user object with default values where necessary
+    user_id = ObjectId()
     user = {
+        '_id': user_id,
         'browser': data.get('browser'),
         'os': data.get('os'),
         'language': data.get('language'),
-        'ratings': data.get('ratings', []),
-        "test_group": get_balanced_ab_group(),
+        "test_group": get_balanced_ab_group(str(user_id)),
+        MIGRATED_FIELD: True,
         'created_at': datetime.timestamp(current_time),
         'updated_at': datetime.timestamp(current_time),
         'version': 1
     }
 
     try:
-        # Insert the new user into the database
+        # Insert the new user into the database, and their ratings into the ratings collection
         user_id = current_app.db.users.insert_one(user).inserted_id
+        ratings = data.get('ratings', [])
+        if ratings:
+            current_app.db.ratings.insert_many([{**rating, 'user_id': str(user_id)} for rating in ratings])
     except Exception as e:
         # Handle database insertion errors
         current_app.logger.error(f"Error inserting new user: {e}")
@@ -190,6 +283,7 @@ def add_new_user():
 
     # Convert the ObjectId to a string for JSON serialization
     user['_id'] = str(user_id)
+    user['ratings'] = ratings
 
     # Generate the JWT for the new user
     token = get_jwt({'sub': str(user_id)})
@@ -230,17 +324,25 @@ def add_user_rating(sub, user_id):
     }
 
     try:
-        # Insert the new rating into the database, using the user_id to identify the user, set updated_at and version
-        current_app.db.users.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$push': {'ratings': rating},
-             '$set': {'updated_at': datetime.timestamp(current_time), 'version': data.get('version', 1) + 1}}
+        # Set the user's updated_at and version; until the migration copied a user's embedded ratings, reads
+        # fall back to them, so the new rating is appended there too
+        user_update = {'$set': {'updated_at': datetime.timestamp(current_time), 'version': data.get('version', 1) + 1}}
+        result = current_app.db.users.update_one(
+            {'_id': ObjectId(user_id), MIGRATED_FIELD: {'$ne': True}, 'ratings': {'$exists': True}},
+            {**user_update, '$push': {'ratings': rating}}
         )
+        if result.matched_count == 0:
+            current_app.db.users.update_one({'_id': ObjectId(user_id)}, user_update)
+
+        # Insert the new rating into the ratings collection, keyed like the migration's copies so it is never doubled
+        key = {'user_id': user_id, 'item_id': rating['item_id'], 'timestamp': rating['timestamp']}
+        current_app.db.ratings.update_one(key, {'$setOnInsert': {**rating, **key}}, upsert=True)
     except Exception as e:
         # Handle database insertion errors
         current_app.logger.error(f"Error inserting new rating: {e}")
         return jsonify({'error': 'Failed to add new rating'}), 400
 
+    invalidate_cached_recommendations(user_id)
     return jsonify(rating), 201
 
 
@@ -263,7 +365,7 @@ def update_user(sub, user_id):
 
     # Filter out any fields that should not be updated
     disallowed_fields = ['_id', 'user_id', 'password', 'created_at', 'updated_at', 'version', 'deleted_at', 'ratings',
-                         'recommendations', 'test_group']
+                         'recommendations', 'test_group', MIGRATED_FIELD]
     update_data = {key: value for key, value in data.items() if key not in disallowed_fields}
     update_data['updated_at'] = datetime.timestamp(datetime.now())
     update_data['version'] = current_app.db.users.find_one({'_id': object_id})['version'] + 1
@@ -319,14 +421,21 @@ def update_user_rating(sub, user_id):
     }
 
     try:
+        # Update the embedded copy first: a migration batch that read it before retries with the new score
         current_app.db.users.update_one(
             {'_id': object_id, 'ratings.item_id': data['item_id']},
-            {'$set': {'ratings.$.score': rating['score'], 'ratings.$.timestamp': rating['timestamp']}}
+            {'$set': {'ratings.$.score': rating['score'], 'ratings.$.timestamp': rating['timestamp'],
+                      'ratings.$.updated_at': rating['timestamp']}}
+        )
+        current_app.db.ratings.update_one(
+            {'user_id': str(object_id), 'item_id': data['item_id']},
+            {'$set': {'score': rating['score'], 'timestamp': rating['timestamp'], 'updated_at': rating['timestamp']}}
         )
     except Exception as e:
         current_app.logger.error(f"Error updating rating: {e}")
         return jsonify({'error': 'Failed to update rating'}), 400
 
+    invalidate_cached_recommendations(user_id)
     return jsonify(rating), 200
 
 
@@ -344,13 +453,12 @@ def delete_user_ratings(sub, user_id):
         return jsonify({'message': 'Invalid user_id'}), 400
 
     try:
-
-        current_app.db.users.update_one(
-            {'_id': object_id},
-            {'$set': {'ratings': []}}
-        )
+        # Drop the embedded copy first, so that no migration batch can copy it back afterwards
+        current_app.db.users.update_one({'_id': object_id}, {'$unset': {'ratings': ''}})
+        current_app.db.ratings.delete_many({'user_id': str(object_id)})
     except Exception as e:
         current_app.logger.error(f"Error deleting ratings: {e}")
         return jsonify({'error': 'Failed to delete ratings'}), 400
 
+    invalidate_cached_recommendations(user_id)
     return jsonify({'message': 'Ratings deleted successfully'}), 200
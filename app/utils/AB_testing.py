@@ -1,15 +1,89 @@
+import hashlib
+from typing import List, Optional, Tuple
+
 from flask import current_app
+from pymongo import ReturnDocument
+
+from app.utils.settings import Config
+
+# Document of the `counters` collection counting the users allocated so far
+AB_COUNTER_ID = 'ab_test'
+
+
+def parse_ab_groups(spec: str) -> List[Tuple[str, int]]:
+    """
+    Parses a group specification such as "A:1,B:1" or "A:2,B:1,C:1".
+
+    Returns:
+        List[Tuple[str, int]]: Every group and its positive integer weight, 1 when omitted
+    """
+    groups = []
+    for part in spec.split(','):
+        name, _, weight = part.strip().partition(':')
+        if name:
+            groups.append((name, int(weight or 1)))
+    if not groups or any(weight < 1 for _, weight in groups):
+        raise ValueError(f"Invalid A/B test groups: {spec}")
+    return groups
+
+
+def get_ab_schedule(groups: List[Tuple[str, int]]) -> List[str]:
+    """
+    Interleaves the groups by weight over one period of sum(weights) signups.
+
+    Smooth weighted round-robin: at every step each group gains its weight
+    and the one with the most credit is picked and pays the total, so within
+    any prefix every group is within one user of its share. "A:1,B:1" gives
+    A, B and "A:2,B:1" gives A, B, A.
+    """
+    total = sum(weight for _, weight in groups)
+    credits = [0] * len(groups)
+    schedule = []
+    for _ in range(total):
+        credits = [credit + weight for credit, (_, weight) in zip(credits, groups)]
+        best = max(range(len(groups)), key=lambda group: credits[group])
+        credits[best] -= total
+        schedule.append(groups[best][0])
+    return schedule
+
+
+def get_hashed_ab_group(key: str, groups: Optional[List[Tuple[str, int]]] = None) -> str:
+    """
+    Assigns a key, e.g. a user id, to a group by hashing it.
+
+    The same key always gets the same group, with no database round trip;
+    groups are balanced by weight only on average.
+    """
+    groups = groups or parse_ab_groups(Config.AB_TEST_GROUPS)
+    total = sum(weight for _, weight in groups)
+    point = int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], 'big') % total
+    for name, weight in groups:
+        if point < weight:
+            return name
+        point -= weight
+
+
+def get_balanced_ab_group(user_id: Optional[str] = None) -> str:
+    """
+    Allocates a new user to an A/B test group, configured by Config.AB_TEST_GROUPS.
+
+    With the 'counter' allocation, one find_one_and_update increments the
+    `counters` document atomically and the count picks the group from the
+    weighted schedule, so concurrent signups never race and the groups stay
+    balanced whatever the number of users. With 'hash', the user id is hashed
+    and no query is run.
 
+    Args:
+        user_id (Optional[str]): Id of the new user, needed by the 'hash' allocation
 
-def get_balanced_ab_group():
-    with current_app.app_context():
-        users = current_app.db.users
-        test_group_a = users.count_documents({'test_group': 'A'})
-        test_group_b = users.count_documents({'test_group': 'B'})
+    Returns:
+        str: The group name
+    """
+    groups = parse_ab_groups(Config.AB_TEST_GROUPS)
+    if Config.AB_TEST_ALLOCATION == 'hash' and user_id is not None:
+        return get_hashed_ab_group(user_id, groups)
 
-        if test_group_a == test_group_b:
-            return 'A'
-        elif test_group_a < test_group_b:
-            return 'A'
-        else:
-            return 'B'
+    counter = current_app.db.counters.find_one_and_update(
+        {'_id': AB_COUNTER_ID}, {'$inc': {'allocated': 1}}, upsert=True, return_document=ReturnDocument.AFTER)
+    schedule = get_ab_schedule(groups)
+    return schedule[(counter['allocated'] - 1) % len(schedule)]
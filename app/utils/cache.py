@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe LRU cache whose entries also expire after a TTL.
+
+    Every entry belongs to an owner (e.g. a user id), so all entries of an
+    owner can be invalidated at once without knowing their keys.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._owner_keys: Dict[Hashable, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, owner: Hashable, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (owner, time.monotonic() + self.ttl, value)
+            self._owner_keys.setdefault(owner, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, owner: Hashable) -> None:
+        with self._lock:
+            for key in list(self._owner_keys.get(owner, ())):
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._owner_keys.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        owner = self._entries.pop(key)[0]
+        keys = self._owner_keys.get(owner)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._owner_keys[owner]
@@ -3,6 +3,8 @@ import csv
 
 from pymongo import MongoClient
 from pymongo.errors import ServerSelectionTimeoutError
+from app.utils.indexes import apply_indexes
+from app.utils.item_index import item_index
 from app.utils.settings import Config
 
 
@@ -13,16 +15,27 @@ def get_db_status(app):
     return 'All systems operational.', 200
 
 
+def connect_db(db_name=None):
+    """Connects to the database and returns it, raising ServerSelectionTimeoutError if unreachable."""
+    # Attempt to connect to the database with a timeout
+    client = MongoClient(Config.MONGODB_URI, serverSelectionTimeoutMS=2000)
+    client.server_info()  # Trigger a server info request to test the connection
+    return client[db_name or Config.MONGODB_DB]
+
+
 def init_db(app):
     """Initializes the database connection and optionally sets up the database."""
     print('Connecting to database...')
     try:
-        # Attempt to connect to the database with a timeout
-        client = MongoClient(Config.MONGODB_URI, serverSelectionTimeoutMS=2000)
-        client.server_info()  # Trigger a server info request to test the connection
-        app.db = client[app.config['MONGODB_DB']]
+        app.db = connect_db(app.config['MONGODB_DB'])
         print('Database connection established.')
 
+        # Create the missing indexes, see app/utils/indexes.py
+        apply_indexes(app.db)
+
+        # Load the movieLensId <-> item id index, setup_db() keeps it in sync with what it inserts
+        item_index.load(app.db)
+
         # Initialize the database if configured to do so
         if app.config['DROP_COLLECTIONS']:
             setup_db(app.db)
@@ -42,6 +55,8 @@ def setup_db(db):
     db.drop_collection('users')
     db.drop_collection('items')
     db.drop_collection('recommendations')
+    db.drop_collection('ratings')
+    item_index.clear()
     print('Collections dropped.')
 
     try:
@@ -51,8 +66,12 @@ def setup_db(db):
         db.create_collection('recommendations')
         print('Recommendations collection initialized.')
 
+        db.create_collection('ratings')
+        print('Ratings collection initialized.')
+
         db.create_collection('items')
-        db.items.create_index([('title', 'text')])
+
+        apply_indexes(db)
 
 
     except Exception as e:
@@ -65,6 +84,7 @@ def setup_db(db):
             reader = csv.DictReader(csvfile)
             items = list(reader)  # More direct list conversion
             db.items.insert_many(items)
+            item_index.add(items)  # insert_many() set the _id of every item
             print('Items collection initialized.')
     except FileNotFoundError:
         print(f'Error: File {csv_file_path} not found.')
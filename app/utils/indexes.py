@@ -0,0 +1,129 @@
+"""
+Index specification of every collection the routes query.
+
+apply_indexes() creates the indexes below and is run by init_db() at every
+startup; creating an index that already exists is a no-op, so it is safe to
+repeat. report_uncovered() runs explain() on a representative query of every
+hot lookup and lists the ones MongoDB would answer with a collection scan, so
+a missing or dropped index shows up before production traffic does.
+
+Usage:
+    python -m app.utils.indexes apply
+    python -m app.utils.indexes report
+"""
+import argparse
+import sys
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    'items': [
+        IndexModel([('title', TEXT)]),  # Text search
+        IndexModel([('title', ASCENDING)]),  # Search sorted by title
+        IndexModel([('imdbId', ASCENDING)]),  # Search sorted by imdbId
+        IndexModel([('movieLensId', ASCENDING)])  # Items of recommended movies
+    ],
+    'users': [
+        IndexModel([('test_group', ASCENDING)])  # Users of an A/B test group
+    ],
+    'recommendations': [
+        IndexModel([('user_id', ASCENDING), ('item_id', ASCENDING)], unique=True)  # Upserts per user and item
+    ],
+    'ratings': [
+        IndexModel([('user_id', ASCENDING), ('timestamp', DESCENDING)]),  # A user's ratings, latest first
+        IndexModel([('item_id', ASCENDING)]),  # An item's ratings
+        IndexModel([('timestamp', ASCENDING)])  # Ratings after the incremental updater's watermark
+    ]
+}
+
+# A representative query of every hot lookup, with placeholder values
+QUERIES = [
+    {'name': 'items by movieLensId', 'collection': 'items', 'filter': {'movieLensId': {'$in': ['1', '2']}}},
+    {'name': 'items text search', 'collection': 'items', 'filter': {'$text': {'$search': 'matrix'}}},
+    {'name': 'items sorted by title', 'collection': 'items', 'filter': {}, 'sort': [('title', ASCENDING)]},
+    {'name': 'users by test group', 'collection': 'users', 'filter': {'test_group': 'A'}},
+    {'name': 'recommendations by user and item', 'collection': 'recommendations',
+     'filter': {'user_id': '000000000000000000000000', 'item_id': {'$in': ['000000000000000000000000']}}},
+    {'name': 'latest ratings of a user', 'collection': 'ratings', 'filter': {'user_id': '000000000000000000000000'},
+     'sort': [('timestamp', DESCENDING)], 'limit': 6},
+    {'name': 'ratings of an item', 'collection': 'ratings', 'filter': {'item_id': '000000000000000000000000'}},
+    {'name': 'ratings after a watermark', 'collection': 'ratings',
+     'filter': {'timestamp': {'$gt': 0}, 'score': {'$ne': None}}}
+]
+
+
+def apply_indexes(db, collections: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+    """
+    Creates the specified indexes that do not exist yet.
+
+    An index that cannot be built, e.g. a unique one over duplicate documents,
+    is reported and skipped so that the server still starts.
+
+    Args:
+        db: The MongoDB database
+        collections (Optional[Iterable[str]]): Collections to index, all of INDEXES by default
+
+    Returns:
+        Dict[str, List[str]]: Names of the indexes in place per collection
+    """
+    applied = {}
+    for collection in collections or INDEXES:
+        applied[collection] = []
+        for index in INDEXES[collection]:
+            try:
+                applied[collection] += db[collection].create_indexes([index])
+            except OperationFailure as e:
+                print(f"Error creating index {index.document['name']} on {collection}: {e}")
+    return applied
+
+
+def get_plan_stages(plan: Dict) -> List[str]:
+    """Returns the stages of a query plan, from the root down."""
+    stages = [plan['stage']] if 'stage' in plan else []
+    for child in plan.get('inputStages', []) + [plan[key] for key in ('inputStage', 'queryPlan') if key in plan]:
+        stages += get_plan_stages(child)
+    return stages
+
+
+def report_uncovered(db) -> List[Dict]:
+    """
+    Explains every query of QUERIES and returns the ones planned as collection scans.
+
+    Args:
+        db: The MongoDB database
+
+    Returns:
+        List[Dict]: name, collection and plan stages of every uncovered query
+    """
+    uncovered = []
+    for query in QUERIES:
+        cursor = db[query['collection']].find(query['filter'])
+        if 'sort' in query:
+            cursor = cursor.sort(query['sort'])
+        if 'limit' in query:
+            cursor = cursor.limit(query['limit'])
+        stages = get_plan_stages(cursor.explain()['queryPlanner']['winningPlan'])
+        if 'COLLSCAN' in stages:
+            uncovered.append({'name': query['name'], 'collection': query['collection'], 'stages': stages})
+    return uncovered
+
+
+if __name__ == '__main__':
+    from app.utils.db import connect_db
+
+    parser = argparse.ArgumentParser(description='Create the indexes and report uncovered queries.')
+    parser.add_argument('command', choices=['apply', 'report'])
+    args = parser.parse_args()
+
+    db = connect_db()
+    if args.command == 'apply':
+        for collection, names in apply_indexes(db).items():
+            print(f"{collection}: {', '.join(names)}")
+    else:
+        uncovered = report_uncovered(db)
+        for query in uncovered:
+            print(f"Uncovered: {query['name']} ({query['collection']}): {' > '.join(query['stages'])}")
+        print(f"{len(QUERIES) - len(uncovered)} of {len(QUERIES)} queries use an index")
+        sys.exit(1 if uncovered else 0)
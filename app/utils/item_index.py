@@ -0,0 +1,133 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+class ItemIndex:
+    """
+    In-memory, thread-safe mapping between item ObjectIds and MovieLens ids.
+
+    The recommender speaks movieLensIds and the API speaks item `_id`s. The
+    index keeps every item of the `items` collection as a row of compact
+    arrays (the 12 bytes of the ObjectId, the movieLensId or -1, the title) plus a
+    dict from each id to its row, so translating ids costs no database round
+    trips. It is loaded once at startup and extended as items are inserted.
+
+    Updates build new arrays and dicts and swap them in as one tuple, so
+    readers never lock and never see half an update.
+    """
+
+    def __init__(self):
+        self.generation = 0
+        # Object ids, movieLensIds, titles, row per object id, row per movieLensId
+        self._state: Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[bytes, int], Dict[int, int]] = (
+            np.empty((0, 12), dtype=np.uint8), np.empty(0, dtype=np.int64), np.empty(0, dtype=object), {}, {})
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._state[0])
+
+    @property
+    def movie_ids(self) -> np.ndarray:
+        """The movieLensId of every item, -1 for items without one."""
+        return self._state[1]
+
+    def load(self, db) -> None:
+        """Replaces the index with every item of the `items` collection."""
+        items = db.items.find({}, {'_id': 1, 'movieLensId': 1, 'title': 1})
+        with self._lock:
+            self._set_rows([], [], [], items)
+
+    def add(self, items: Iterable[Dict]) -> None:
+        """Adds inserted items, which must carry their `_id`; known ids are updated in place."""
+        with self._lock:
+            object_ids, movie_ids, titles, _, _ = self._state
+            self._set_rows([object_id.tobytes() for object_id in object_ids], movie_ids.tolist(), list(titles), items)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._set_rows([], [], [], [])
+
+    def _set_rows(self, object_ids: List[bytes], movie_ids: List[int], titles: List[Optional[str]],
+                  items: Iterable[Dict]) -> None:
+        rows = {object_id: row for row, object_id in enumerate(object_ids)}
+        for item in items:
+            object_id = ObjectId(item['_id']).binary
+            row = rows.setdefault(object_id, len(object_ids))
+            if row == len(object_ids):
+                object_ids.append(object_id)
+                movie_ids.append(-1)
+                titles.append(None)
+            movie_ids[row] = _parse_movie_id(item.get('movieLensId'))
+            titles[row] = item.get('title')
+
+        rows_by_movie_id = {movie_id: row for row, movie_id in enumerate(movie_ids) if movie_id >= 0}
+        self._state = (np.frombuffer(b''.join(object_ids), dtype=np.uint8).reshape(-1, 12),
+                       np.array(movie_ids, dtype=np.int64),
+                       np.array(titles + [None], dtype=object)[:-1], rows, rows_by_movie_id)
+        self.generation += 1
+
+    def __contains__(self, item_id) -> bool:
+        return _get_row(self._state[3], item_id) is not None
+
+    def to_movielens_ids(self, item_ids: Iterable) -> List[Optional[str]]:
+        """
+        Translates item ids to movieLensIds.
+
+        Args:
+            item_ids (Iterable): Item ObjectIds or their strings
+
+        Returns:
+            List[Optional[str]]: The movieLensId of every item, as the recommender takes it, None for
+            unknown items and items without one
+        """
+        _, movie_ids, _, rows, _ = self._state
+        result = []
+        for item_id in item_ids:
+            row = _get_row(rows, item_id)
+            result.append(str(movie_ids[row]) if row is not None and movie_ids[row] >= 0 else None)
+        return result
+
+    def to_object_ids(self, movie_ids: Iterable) -> List[Optional[str]]:
+        """
+        Translates movieLensIds to item ids.
+
+        Args:
+            movie_ids (Iterable): movieLensIds, as strings or integers
+
+        Returns:
+            List[Optional[str]]: The ObjectId string of every movie's item, None for movies without one
+        """
+        object_ids, _, _, _, rows = self._state
+        result = []
+        for movie_id in movie_ids:
+            row = rows.get(_parse_movie_id(movie_id))
+            result.append(str(ObjectId(object_ids[row].tobytes())) if row is not None else None)
+        return result
+
+    def get_title(self, item_id) -> Optional[str]:
+        """Returns the title of an item, None if it is unknown."""
+        _, _, titles, rows, _ = self._state
+        row = _get_row(rows, item_id)
+        return titles[row] if row is not None else None
+
+
+def _get_row(rows: Dict[bytes, int], item_id) -> Optional[int]:
+    try:
+        return rows.get(ObjectId(item_id).binary)
+    except (TypeError, InvalidId):
+        return None
+
+
+def _parse_movie_id(movie_id) -> int:
+    try:
+        return int(movie_id)
+    except (TypeError, ValueError):
+        return -1
+
+
+# Process-wide index, loaded by init_db()
+item_index = ItemIndex()
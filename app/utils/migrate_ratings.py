@@ -0,0 +1,138 @@
+"""
+Online migration of the ratings embedded in `users` to the `ratings` collection.
+
+Users are read in _id order, batch_size at a time, and every rating of their
+embedded array is upserted into `ratings` keyed on (user_id, item_id,
+timestamp), in one unordered bulk write per batch. Users without ratings are
+only marked, so that every user document tells where its ratings live. Upserts
+make a batch safe to repeat, and the last migrated user id is checkpointed in
+the `migrations` collection after every batch, so an interrupted run resumes
+where it stopped. Once no user is left the checkpoint is marked completed, and
+find_item_ratings() stops merging in embedded ratings.
+
+The server keeps running meanwhile. Until a user is marked as migrated, it
+reads their ratings from the embedded array and applies every rating write to
+both the array and `ratings`. A user is marked only if their array is still
+the one that was copied; when a request changed it in between, the ratings
+this batch inserted for the user are deleted again and the user is copied
+anew, so a rating deleted or updated meanwhile never comes back.
+
+The embedded arrays are left in place unless --drop-embedded is given; then a
+user's array is unset along with the mark, and the arrays of users migrated by
+an earlier run are unset as well.
+
+Usage:
+    python -m app.utils.migrate_ratings [--batch-size 500] [--pause SECONDS] [--drop-embedded] [--restart]
+"""
+import argparse
+import time
+from typing import Dict, Optional
+
+from pymongo import ASCENDING, UpdateOne
+
+from app.models.Rating import MIGRATED_FIELD, MIGRATION_ID
+from app.utils.db import connect_db
+from app.utils.indexes import apply_indexes
+
+
+def migrate_batch(db, users, drop_embedded: bool = False) -> int:
+    """
+    Copies the embedded ratings of some users to the ratings collection and marks them as migrated.
+
+    Args:
+        db: The MongoDB database
+        users (List[Dict]): User documents with their _id, ratings and migration mark
+        drop_embedded (bool): Unset every copied array along with the mark
+
+    Returns:
+        int: Number of ratings copied
+    """
+    requests, owners = [], []
+    for user in users:
+        if user.get(MIGRATED_FIELD):
+            continue  # Copied by an earlier run, only its array is left to drop
+        user_id = str(user['_id'])
+        for rating in user.get('ratings') or []:
+            key = {'user_id': user_id, 'item_id': rating.get('item_id'), 'timestamp': rating.get('timestamp')}
+            requests.append(UpdateOne(key, {'$setOnInsert': {**rating, **key}}, upsert=True))
+            owners.append(user['_id'])
+    upserted = {}
+    if requests:
+        result = db.ratings.bulk_write(requests, ordered=False)
+        for index, upserted_id in result.upserted_ids.items():
+            upserted.setdefault(owners[index], []).append(upserted_id)
+
+    copied = 0
+    for user in users:
+        # Mark the user only if no request changed the array since it was read
+        update = {'$set': {MIGRATED_FIELD: True}}
+        if drop_embedded:
+            update['$unset'] = {'ratings': ''}
+        if db.users.update_one({'_id': user['_id'], 'ratings': user.get('ratings')}, update).matched_count:
+            copied += 0 if user.get(MIGRATED_FIELD) else len(user.get('ratings') or [])
+            continue
+
+        # The copy is stale: take back what it inserted and copy the array as it is now
+        if user['_id'] in upserted:
+            db.ratings.delete_many({'_id': {'$in': upserted[user['_id']]}})
+        current = db.users.find_one({'_id': user['_id'], 'ratings': {'$exists': True}},
+                                    {'ratings': 1, MIGRATED_FIELD: 1})
+        if current is not None:
+            copied += migrate_batch(db, [current], drop_embedded)
+    return copied
+
+
+def migrate_ratings(db, batch_size: int = 500, pause: float = 0.0, drop_embedded: bool = False,
+                    restart: bool = False) -> Dict[str, Optional[int]]:
+    """
+    Copies every embedded rating to the ratings collection, resuming from the checkpoint.
+
+    Args:
+        db: The MongoDB database
+        batch_size (int): Users migrated per batch
+        pause (float): Seconds to wait between batches, to leave the database to the server
+        drop_embedded (bool): Unset the embedded arrays once copied
+        restart (bool): Ignore the checkpoint and start from the first user
+
+    Returns:
+        Dict[str, Optional[int]]: The users and ratings migrated by this run and the last user id
+    """
+    apply_indexes(db, ['ratings'])
+    checkpoint = None if restart else db.migrations.find_one({'_id': MIGRATION_ID})
+    last_user_id = checkpoint['last_user_id'] if checkpoint else None
+    migrated_users = migrated_ratings = 0
+
+    while True:
+        if drop_embedded:
+            query = {'$or': [{'ratings': {'$exists': True}}, {MIGRATED_FIELD: {'$ne': True}}]}
+        else:
+            query = {MIGRATED_FIELD: {'$ne': True}}
+        if last_user_id is not None:
+            query['_id'] = {'$gt': last_user_id}
+        users = list(db.users.find(query, {'ratings': 1, MIGRATED_FIELD: 1}).sort('_id', ASCENDING).limit(batch_size))
+        if not users:
+            break
+
+        migrated_ratings += migrate_batch(db, users, drop_embedded)
+        migrated_users += len(users)
+        last_user_id = users[-1]['_id']
+        db.migrations.update_one({'_id': MIGRATION_ID}, {'$set': {'last_user_id': last_user_id}}, upsert=True)
+        print(f"Migrated {migrated_users} users, {migrated_ratings} ratings")
+        if pause:
+            time.sleep(pause)
+
+    # Every user is copied: readers stop looking for embedded ratings
+    db.migrations.update_one({'_id': MIGRATION_ID}, {'$set': {'completed': True}}, upsert=True)
+    return {'users': migrated_users, 'ratings': migrated_ratings,
+            'last_user_id': str(last_user_id) if last_user_id is not None else None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Copy the ratings embedded in users to the ratings collection.')
+    parser.add_argument('--batch-size', type=int, default=500, help='Users migrated per batch')
+    parser.add_argument('--pause', type=float, default=0.0, help='Seconds to wait between batches')
+    parser.add_argument('--drop-embedded', action='store_true', help='Unset the embedded arrays once copied')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start over')
+    args = parser.parse_args()
+
+    print(migrate_ratings(connect_db(), args.batch_size, args.pause, args.drop_embedded, args.restart))
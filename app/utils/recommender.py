@@ -1,140 +1,768 @@
+import hashlib
+import threading
+import time
+
+from app.utils.cache import LRUCache
+from app.utils.item_index import item_index
 from app.utils.settings import Config
 import pandas as pd
 import numpy as np
+from scipy.sparse import csr_matrix
 from scipy.sparse.linalg import svds
-import pickle
-from pathlib import Path
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.recsys.als import to_svd_factors, train_als
+from app.recsys.coldstart import build_cold_start_tables, get_cold_start_items, load_movie_genres
+from app.recsys.ann import build_ivf_index, get_item_vectors
+from app.recsys.neighbors import build_item_neighbors, merge_neighbors
+from app.recsys.matrix import build_rating_matrix, center_rating_matrix, get_dataset_checksum, load_ratings
+from app.recsys.pipeline import (RecommendationPipeline, availability_filter, factor_candidates, factor_scorer,
+                                 mmr_genre_reranker, neighbor_candidates, popularity_candidates,
+                                 popularity_penalty_scorer, rated_filter, top_n_order, top_n_reranker)
+from app.recsys.quantize import get_item_factors, quantize_item_factors, score_items
+from app.recsys.registry import (get_model, get_worker_memory, load_hyperparameters, load_model, model_build_lock,
+                                 save_model)
+
+# Readiness of the served model, see load_model_in_background()
+model_status = {"state": "loading", "version": None, "generation": None, "error": None}
+
+# Mask of the movies present in `items` per model version and item index generation, see get_available_movies()
+_available_movies: Dict[Tuple[str, int], np.ndarray] = {}
+
+# Recent top-N results per user, see get_cached_recommendations()
+recommendation_cache = LRUCache(Config.RECOMMENDATION_CACHE_SIZE, Config.RECOMMENDATION_CACHE_TTL)
+
+# Bounds of the MovieLens rating scale; served predictions are clipped to it, as the RMSE of the sweep is
+MIN_RATING, MAX_RATING = 0.5, 5.0
+
+
+def factorize(matrix_norm: csr_matrix, k: int, engine: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Factorizes the centered rating matrix into U, sigma and Vt.
+
+    Args:
+        matrix_norm (csr_matrix): Users x movies ratings centered on the user means
+        k (int): Number of latent factors
+        engine (str): 'svd' for scipy svds or 'als' for weighted ALS over the observed ratings
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: U, sigma and Vt, with orthonormal rows in Vt
+    """
+    if engine == 'svd':
+        return svds(matrix_norm, k=k)
+    elif engine == 'als':
+        user_factors, item_factors = train_als(
+            matrix_norm,
+            k=k,
+            reg=Config.ALS_REGULARIZATION,
+            iterations=Config.ALS_ITERATIONS
+        )
+        return to_svd_factors(user_factors, item_factors)
+    else:
+        raise ValueError(f"Unsupported recommender engine: {engine}")
+
+
+def get_hyperparameters() -> Dict:
+    """Returns the training parameters: the promoted ones where present, Config otherwise."""
+    hyperparameters = {
+        "engine": Config.RECSYS_ENGINE,
+        "k": Config.SVD_K,
+        "popularity_weight": Config.POPULARITY_WEIGHT
+    }
+    hyperparameters.update(load_hyperparameters())
+    return hyperparameters
+
 
-# Path to store precomputed SVD data
-SVD_STORAGE_PATH = Path("precomputed_svd.pkl")
+def get_popularity_penalty(rating_mass: np.ndarray, popularity_weight: float) -> np.ndarray:
+    """Returns the per-movie divisor 1 + weight * log(1 + count * mean) applied to predicted ratings."""
+    return (1 + popularity_weight * np.log1p(rating_mass)).astype(np.float32)
+
+
+def get_item_evidence(matrix_norm: csr_matrix, Vt: np.ndarray) -> np.ndarray:
+    """
+    Measures how much training data stands behind every item factor.
+
+    Training users are folded in the way serving folds users in,
+    p_u = (r_u - mean_u) . Vt^T, and every item gets the diagonal of its Gram
+    matrix sum_u p_u^2 over the users who rated it. The incremental updater
+    anchors an item's factors with this weight, so a few new ratings move an
+    item with hundreds of training ratings accordingly little.
+
+    Args:
+        matrix_norm (csr_matrix): Users x movies ratings centered on the user means
+        Vt (np.ndarray): factors x movies matrix
+
+    Returns:
+        np.ndarray: factors x movies matrix of the per-factor evidence
+    """
+    user_factors = matrix_norm @ Vt.T
+    observed = matrix_norm.copy()
+    observed.data[:] = 1
+    return np.asarray((observed.T @ user_factors ** 2).T, dtype=np.float32)
 
 
-def precompute_svd(k: int = 30) -> None:
+def precompute_svd(k: Optional[int] = None, ratings: Optional[pd.DataFrame] = None, engine: Optional[str] = None,
+                   popularity_weight: Optional[float] = None, dataset_checksum: Optional[str] = None,
+                   sources: Optional[Dict[str, Any]] = None) -> str:
     """
     Precomputes the SVD components and user ratings mean for the dataset
-    and saves them to a pickle file.
+    and publishes them as a new model version.
+
+    Parameters left to None come from get_hyperparameters().
 
     Args:
-        k (int): Number of latent factors for SVD
+        k (Optional[int]): Number of latent factors for SVD
+        ratings (Optional[pd.DataFrame]): Ratings to train on, defaults to Config.RATINGS_PATH
+        engine (Optional[str]): Factorization engine, 'svd' or 'als'
+        popularity_weight (Optional[float]): Strength of the popularity penalty
+        dataset_checksum (Optional[str]): Checksum of the dataset `ratings` come from,
+            recorded so that ensure_model() can skip rebuilding an up-to-date model
+        sources (Optional[Dict[str, Any]]): Description of the ratings beyond the dataset,
+            e.g. the Mongo ratings the scheduler adds, recorded in the metadata
+
+    Returns:
+        str: The published model version
     """
-    # Load the dataset
-    ratings = pd.read_csv(Config.RATINGS_PATH)
+    trained_at = time.time()
+    hyperparameters = get_hyperparameters()
+    k = k or hyperparameters["k"]
+    engine = engine or hyperparameters["engine"]
+    if popularity_weight is None:
+        popularity_weight = hyperparameters["popularity_weight"]
+
+    # Load the dataset into a sparse user-movie matrix
+    if ratings is None:
+        ratings = load_ratings()
+        dataset_checksum = get_dataset_checksum()
+    user_movie_matrix, user_ids, movie_ids = build_rating_matrix(ratings)
+
+    # Normalize the observed ratings by subtracting the mean rating for each user
+    matrix_norm, user_ratings_mean = center_rating_matrix(user_movie_matrix)
+
+    # Factorize the sparse matrix
+    U, sigma, Vt = factorize(matrix_norm, k, engine)
+    item_evidence = get_item_evidence(matrix_norm, Vt)
+
+    # Penalize popular movies by the log of their total rating mass (count * mean)
+    rating_mass = np.asarray(user_movie_matrix.sum(axis=0)).ravel()
+    popularity_penalty = get_popularity_penalty(rating_mass, popularity_weight)
 
-    # Create the user-movie matrix
-    user_movie_matrix = ratings.pivot(
-        index='userId',
-        columns='movieId',
-        values='rating'
-    ).fillna(0)
+    # Serving folds users in from the item factors, so U is not part of the artifact
+    arrays = {
+        "sigma": sigma,
+        "user_ratings_mean": user_ratings_mean,
+        "user_ids": user_ids,
+        "movie_ids": movie_ids,
+        "popularity_penalty": popularity_penalty,
+        "item_evidence": item_evidence
+    }
 
-    # Normalize ratings by subtracting the mean rating for each user
-    user_ratings_mean = user_movie_matrix.mean(axis=1)
-    matrix_norm = user_movie_matrix.sub(user_ratings_mean, axis=0)
+    # Precompute the most similar movies of every movie
+    if Config.ITEM_NEIGHBORS > 0:
+        arrays.update(build_item_neighbors(matrix_norm, Config.ITEM_NEIGHBORS))
 
-    # Perform SVD
-    U, sigma, Vt = svds(matrix_norm.values, k=k)
-    sigma = np.diag(sigma)  # Convert diagonal array to matrix
+    # Precompute the best rated movies overall, per genre and per genre pair for new users
+    if Config.COLD_START_RATINGS > 0:
+        arrays.update(build_cold_start_tables(user_movie_matrix, movie_ids, load_movie_genres(),
+                                              Config.COLD_START_LIST_SIZE, Config.COLD_START_PRIOR))
 
-    # Save precomputed components to pickle
-    with open(SVD_STORAGE_PATH, "wb") as f:
-        pickle.dump({
-            "U": U,
-            "sigma": sigma,
-            "Vt": Vt,
-            "user_ratings_mean": user_ratings_mean,
-            "user_movie_matrix": user_movie_matrix
-        }, f)
+    # Partition the items for approximate retrieval on large catalogs
+    if Config.ANN_LISTS > 0:
+        arrays.update(build_ivf_index(get_item_vectors(Vt, popularity_penalty), Config.ANN_LISTS,
+                                      Config.ANN_EXEMPLARS))
 
-    print(f"SVD components precomputed and saved to {SVD_STORAGE_PATH}")
+    # Store the item factors in the configured precision
+    arrays.update(quantize_item_factors(Vt, Config.ITEM_FACTOR_DTYPE))
 
-def load_precomputed_svd():
+    # Save precomputed components as memory-mappable arrays
+    metadata = {
+        "engine": engine,
+        "k": k,
+        "popularity_weight": popularity_weight,
+        "item_factor_dtype": Config.ITEM_FACTOR_DTYPE,
+        "dataset_checksum": dataset_checksum,
+        "trained_at": trained_at,
+        **(sources or {})
+    }
+    if engine == 'als':
+        # New users are folded in with the ridge problem ALS solves for the training users
+        metadata["als_regularization"] = Config.ALS_REGULARIZATION
+    version = save_model(arrays, metadata=metadata)
+
+    print(f"SVD components precomputed and saved as model version {version}")
+    return version
+
+
+def is_model_up_to_date(model: Dict) -> bool:
+    """Checks that a model was trained on the current dataset with the current hyperparameters."""
+    metadata = model["metadata"]
+    if metadata.get("dataset_checksum") != get_dataset_checksum():
+        return False
+    if metadata.get("item_factor_dtype", "float64") != Config.ITEM_FACTOR_DTYPE:
+        return False
+    if metadata.get("engine") == 'als' and metadata.get("als_regularization") != Config.ALS_REGULARIZATION:
+        return False
+    return all(metadata.get(name) == value for name, value in get_hyperparameters().items())
+
+
+def ensure_model(force: bool = False) -> str:
     """
-    Loads the precomputed SVD components and user ratings mean from a pickle file.
+    Builds the model unless the published one is already up to date.
+
+    Every worker process of the server calls this at startup. The build runs
+    under the model directory's lock, so the first worker builds and publishes
+    the model and the others, once they get the lock, find it up to date and
+    only map it.
+
+    Args:
+        force (bool): Rebuild even if the published model is up to date
+
+    Returns:
+        str: The version of the up-to-date model
+    """
+    if not force:
+        try:
+            model = get_model()
+            if is_model_up_to_date(model):
+                return model["version"]
+        except FileNotFoundError:
+            pass
+
+    with model_build_lock():
+        if not force:
+            try:
+                # Read the CURRENT file again: another worker may have published while this one waited
+                model = load_model()
+                if is_model_up_to_date(model):
+                    return model["version"]
+            except FileNotFoundError:
+                pass
+        return precompute_svd()
+
+
+def load_model_in_background() -> threading.Thread:
+    """
+    Makes sure the model is built and loaded without blocking the caller.
+
+    The server starts answering at once; get_model_status() reports when the
+    model is ready to serve.
 
     Returns:
-        Dict: Dictionary containing SVD components and user-movie matrix
+        threading.Thread: The daemon thread doing the work
     """
-    if not SVD_STORAGE_PATH.exists():
-        raise FileNotFoundError(f"No precomputed SVD data found at {SVD_STORAGE_PATH}. Please run precompute_svd().")
+    def run():
+        try:
+            version = ensure_model()
+            get_model()
+            model_status.update(state="ready", version=version, error=None)
+        except Exception as e:
+            print(f"Error loading the recommender model: {e}")
+            model_status.update(state="error", error=str(e))
 
-    with open(SVD_STORAGE_PATH, "rb") as f:
-        data = pickle.load(f)
+    model_status.update(state="loading", version=None, generation=None, error=None)
+    thread = threading.Thread(target=run, name='model-loader', daemon=True)
+    thread.start()
+    return thread
 
-    return data
 
-def get_recommendation_items(new_user_ratings: Dict[str, float], top_n: int = 10) -> pd.Series:
+def get_model_status() -> Dict:
+    """
+    Returns the readiness of the recommender model: its state ('loading', 'ready'
+    or 'error'), version and generation, and the memory of this worker process.
+    """
+    status = dict(model_status)
+    if status["state"] == "ready":
+        model = get_model()
+        status.update(version=model["version"], generation=model["generation"])
+    status["worker"] = get_worker_memory()
+    return status
+
+
+def get_rated_positions(new_user_ratings: Dict[str, float], model: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Maps a {movie_id: rating} dictionary onto columns of the item factors.
+
+    Movies unknown to the model and ratings without a score are dropped.
+
+    Args:
+        new_user_ratings (Dict[str, float]): Dictionary of {movie_id: rating} for the new user
+        model (Dict): Precomputed SVD components as returned by get_model()
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Column positions and the matching ratings
+    """
+    rated = {int(movie_id): rating for movie_id, rating in new_user_ratings.items() if rating is not None}
+    movie_ids = np.fromiter(rated.keys(), dtype=np.int64, count=len(rated))
+    scores = np.fromiter(rated.values(), dtype=np.float64, count=len(rated))
+
+    positions = model["movie_index"].get_indexer(movie_ids)
+    known = positions >= 0
+    return positions[known], scores[known]
+
+
+def fold_in_user(new_user_ratings: Dict[str, float], model: Dict) -> Tuple[np.ndarray, float]:
+    """
+    Projects a new user onto the precomputed latent space without refactorizing.
+
+    The user's ratings are centered on their own mean, the same way
+    precompute_svd() centers the observed training entries, and then projected
+    with u = (r - mean) . Vt^T . sigma^-1. ALS models instead solve the ridge
+    problem ALS solves for every training user over their observed ratings
+    only, see fold_in_ridge(). Only the rated columns are touched, so the cost
+    depends on the number of ratings and factors, not on the number of users
+    in the training set.
+
+    Args:
+        new_user_ratings (Dict[str, float]): Dictionary of {movie_id: rating} for the new user
+        model (Dict): Precomputed SVD components as returned by get_model()
+
+    Returns:
+        Tuple[np.ndarray, float]: The user's latent factors and rating mean
+    """
+    positions, scores = get_rated_positions(new_user_ratings, model)
+    return fold_in_positions(positions, scores, model)
+
+
+def fold_in_positions(positions: np.ndarray, scores: np.ndarray, model: Dict) -> Tuple[np.ndarray, float]:
+    """fold_in_user() for ratings already mapped to columns by get_rated_positions()."""
+    # Unrated movies are implicit zeros after centering, so only the rated columns are read
+    user_mean = scores.mean() if len(scores) else 0.0
+    regularization = model.get("metadata", {}).get("als_regularization")
+    if regularization is not None:
+        return fold_in_ridge(positions, scores - user_mean, model, regularization), user_mean
+
+    projection = (scores - user_mean) @ get_item_factors(model, positions).T
+    user_factors = projection / model["sigma"]
+
+    return user_factors, user_mean
+
+
+def fold_in_ridge(positions: np.ndarray, centered: np.ndarray, model: Dict, regularization: float) -> np.ndarray:
+    """
+    Folds a user into an ALS model with u = (Y_r^T Y_r + reg * n * I)^-1 Y_r^T (r - mean).
+
+    Y_r are the ALS item factors of the n rated movies, Vt scaled by sigma (see
+    to_svd_factors()). Unlike the projection, the movies the user did not rate
+    are left out instead of being read as ratings equal to the user's mean.
+
+    Args:
+        positions (np.ndarray): Columns of the rated movies
+        centered (np.ndarray): The ratings minus the user's mean
+        model (Dict): ALS model
+        regularization (float): The regularization ALS was trained with
+
+    Returns:
+        np.ndarray: The user's latent factors
+    """
+    item_factors = get_item_factors(model, positions).T * model["sigma"]
+    lhs = item_factors.T @ item_factors + regularization * max(len(positions), 1) * np.eye(len(model["sigma"]))
+    return np.linalg.solve(lhs, centered @ item_factors)
+
+
+def select_top_n(scores: np.ndarray, top_n: int) -> np.ndarray:
+    """
+    Returns the positions of the top_n highest finite scores, best first.
+
+    Ties are broken by position, as in the pipeline's top_n_reranker(), so that
+    the single and batch paths return the same list.
+
+    Args:
+        scores (np.ndarray): Score per item, -inf for items that must not be returned
+        top_n (int): Number of positions to return
+
+    Returns:
+        np.ndarray: Item positions sorted by descending score
+    """
+    candidates = top_n_order(scores, top_n)
+    return candidates[np.isfinite(scores[candidates])]
+
+
+def select_top_n_rows(scores: np.ndarray, top_n: int) -> np.ndarray:
+    """
+    Row-wise select_top_n() for a users x items score matrix.
+
+    Args:
+        scores (np.ndarray): Score matrix, -inf for items that must not be returned
+        top_n (int): Number of positions to return per row
+
+    Returns:
+        np.ndarray: users x top_n item positions sorted by descending score, then position
+    """
+    top_n = min(top_n, scores.shape[1])
+    if top_n <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+
+    candidates = np.argpartition(scores, scores.shape[1] - top_n, axis=1)[:, -top_n:]
+    top_scores = np.take_along_axis(scores, candidates, axis=1)
+
+    # Rows with ties at the cut-off take the tied movies with the lowest positions
+    tied = (scores >= top_scores.min(axis=1)[:, None]).sum(axis=1) > top_n
+    for row in np.flatnonzero(tied):
+        candidates[row] = top_n_order(scores[row], top_n)
+        top_scores[row] = scores[row, candidates[row]]
+
+    order = np.lexsort((candidates, -top_scores), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def build_pipeline() -> RecommendationPipeline:
+    """
+    Builds the recommendation pipeline from the settings.
+
+    Candidates come from factor scoring (all movies, or the probed ANN
+    partitions), the rated movies' neighbours and the most popular movies.
+    Rated and unavailable movies are dropped, the rest are scored by predicted
+    rating over popularity penalty, and the top N are picked by score or, with
+    Config.DIVERSITY_LAMBDA < 1, by MMR over genres.
+    """
+    return RecommendationPipeline(
+        generators=[factor_candidates, neighbor_candidates, popularity_candidates],
+        filters=[rated_filter, availability_filter],
+        scorers=[factor_scorer, popularity_penalty_scorer],
+        rerankers=[mmr_genre_reranker if Config.DIVERSITY_LAMBDA < 1 else top_n_reranker]
+    )
+
+
+# Candidate generation, filtering, scoring and re-ranking of get_recommendation_items()
+recommendation_pipeline = build_pipeline()
+
+
+def get_recommendation_context(new_user_ratings: Dict[str, float], model: Dict,
+                               available: Optional[np.ndarray] = None) -> Dict:
+    """
+    Folds a user in and collects everything the pipeline stages read.
+
+    Args:
+        new_user_ratings (Dict[str, float]): Dictionary of {movie_id: rating} for the new user
+        model (Dict): Model to score with
+        available (Optional[np.ndarray]): Mask of the movies that may be recommended, see get_available_movies()
+
+    Returns:
+        Dict: The pipeline context
+    """
+    positions, scores = get_rated_positions(new_user_ratings, model)
+    user_factors, user_mean = fold_in_positions(positions, scores, model)
+    return make_recommendation_context(model, positions, scores, user_factors, user_mean, available)
+
+
+def make_recommendation_context(model: Dict, positions: np.ndarray, scores: np.ndarray, user_factors: np.ndarray,
+                                user_mean: float, available: Optional[np.ndarray] = None,
+                                predicted: Optional[np.ndarray] = None) -> Dict:
+    """
+    The pipeline context of a user already folded in.
+
+    Args:
+        model (Dict): Model to score with
+        positions (np.ndarray): Columns of the rated movies
+        scores (np.ndarray): The ratings of the rated movies
+        user_factors (np.ndarray): The user's latent factors
+        user_mean (float): The user's rating mean
+        available (Optional[np.ndarray]): Mask of the movies that may be recommended
+        predicted (Optional[np.ndarray]): Predicted rating of every movie, when already computed
+
+    Returns:
+        Dict: The pipeline context
+    """
+    return {
+        "model": model,
+        "positions": positions,
+        "scores": scores,
+        "user_mean": user_mean,
+        "query": user_factors * model["sigma"],
+        "predicted": predicted,
+        "available": available,
+        "ann_probes": Config.ANN_PROBES,
+        "mmr_lambda": Config.DIVERSITY_LAMBDA,
+        "mmr_pool_size": Config.DIVERSITY_POOL_SIZE
+    }
+
+
+def ranks_whole_catalog(model: Dict) -> bool:
+    """
+    Checks that recommendation_pipeline returns the plain top N of every movie by score.
+
+    It does unless the model has an ANN index, which restricts the candidates to
+    the probed partitions and the neighbour and popularity candidates, or the
+    reranker is MMR; then the batch path runs the pipeline's stages per user.
+    """
+    if "ann_centroids" in model and Config.ANN_PROBES > 0:
+        return False
+    return recommendation_pipeline.rerankers == [top_n_reranker]
+
+
+def get_recommendation_items(new_user_ratings: Dict[str, float], top_n: int = 10,
+                             model: Optional[Dict] = None, available: Optional[np.ndarray] = None) -> pd.Series:
     """
     Recommends movies for a new user based on collaborative filtering with SVD.
 
+    The user is folded into the precomputed factorization and the candidates
+    of recommendation_pipeline are scored with a single vector-matrix product,
+    divided by the precomputed popularity penalty. Models built with an ANN
+    index only score the movies of the Config.ANN_PROBES partitions closest to
+    the user, plus the neighbour and popularity candidates.
+
     Args:
         new_user_ratings (Dict[str, float]): Dictionary of {movie_id: rating} for the new user
         top_n (int): Number of recommendations to return
+        model (Optional[Dict]): Model to score with, defaults to get_model()
+        available (Optional[np.ndarray]): Mask of the movies that may be recommended, all by default
 
     Returns:
         pd.Series: Series of recommended movie_ids and their predicted ratings
     """
-    # Load the dataset
-    ratings = pd.read_csv(Config.RATINGS_PATH)
-
-    # Create the user-movie matrix
-    user_movie_matrix = ratings.pivot(
-        index='userId',
-        columns='movieId',
-        values='rating'
-    ).fillna(0)
-
-    # Add the new user to the matrix
-    new_user_id = user_movie_matrix.index.max() + 1
-    new_user_row = pd.Series(0, index=user_movie_matrix.columns)
-
-    # Populate the new user's row with the provided ratings
-    for movie_id, rating in new_user_ratings.items():
-        movie_id = int(movie_id)
-        if movie_id in new_user_row.index:
-            new_user_row[movie_id] = rating
-
-    # Add new user to the matrix
-    user_movie_matrix.loc[new_user_id] = new_user_row
-
-    # Normalize ratings by subtracting the mean rating for each user
-    user_ratings_mean = user_movie_matrix.mean(axis=1)
-    matrix_norm = user_movie_matrix.sub(user_ratings_mean, axis=0)
-
-    # Perform SVD
-    U, sigma, Vt = svds(matrix_norm.values, k=30)
-
-    # Convert diagonal array to matrix
-    sigma = np.diag(sigma)
-
-    # Predict ratings using the SVD components
-    predicted_ratings = np.dot(np.dot(U, sigma), Vt) + user_ratings_mean.values.reshape(-1, 1)
-    predicted_ratings_df = pd.DataFrame(
-        predicted_ratings,
-        index=user_movie_matrix.index,
-        columns=user_movie_matrix.columns
+    model = model or get_model()
+    context = get_recommendation_context(new_user_ratings, model, available)
+    candidates, columns = recommendation_pipeline.run(context, top_n)
+    return pd.Series(columns["predicted"], index=model["movie_ids"][candidates])
+
+
+def get_available_movies(model: Optional[Dict] = None) -> np.ndarray:
+    """
+    Returns the mask of the model's movies that exist in the `items` collection.
+
+    The mask is computed from the in-memory item index, and cached until the
+    model version or the index changes.
+    """
+    model = model or get_model()
+    key = (model["version"], item_index.generation)
+    cached = _available_movies.get(key)
+    if cached is not None:
+        return cached
+
+    available = np.zeros(len(model["movie_ids"]), dtype=bool)
+    positions = model["movie_index"].get_indexer(item_index.movie_ids)
+    available[positions[positions >= 0]] = True
+
+    _available_movies.clear()
+    _available_movies[key] = available
+    return available
+
+
+def get_similar_items(new_user_ratings: Dict[str, float], top_n: int = 10,
+                      model: Optional[Dict] = None) -> pd.Series:
+    """
+    Movies most similar to the given ones, from the precomputed neighbour table.
+
+    The neighbour lists of the rated movies are merged, each weighted by its
+    rating, so this serves both "because you rated X" lists and a cheap
+    candidate set for the factorization. The rated movies are left out.
+
+    Args:
+        new_user_ratings (Dict[str, float]): Dictionary of {movie_id: rating} of the seed movies
+        top_n (int): Number of movies to return
+        model (Optional[Dict]): Model to read the table from, defaults to get_model()
+
+    Returns:
+        pd.Series: Series of similar movie_ids and their merged similarity, empty
+        when the model has no neighbour table
+    """
+    model = model or get_model()
+    if "neighbor_items" not in model:
+        return pd.Series(dtype=np.float64)
+
+    positions, scores = get_rated_positions(new_user_ratings, model)
+    candidates, similarities = merge_neighbors(model["neighbor_items"], model["neighbor_scores"], positions, scores)
+    return pd.Series(similarities[:top_n], index=model["movie_ids"][candidates[:top_n]])
+
+
+def get_batch_recommendation_items(users_ratings: Dict[str, Dict[str, float]], top_n: int = 10,
+                                   chunk_size: int = 512,
+                                   model: Optional[Dict] = None) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Recommends movies for many users at once.
+
+    Users are folded in together and scored chunk by chunk with a single
+    (users x factors) . (factors x items) product, so the dense prediction block
+    never exceeds chunk_size x items. When recommendation_pipeline does more
+    than rank every movie by score (see ranks_whole_catalog()), every user's
+    row of predictions then goes through its candidate generation, filters and
+    reranker, so the batch returns what get_recommendation_items() returns.
+
+    Args:
+        users_ratings (Dict[str, Dict[str, float]]): {user_key: {movie_id: rating}} for every user
+        top_n (int): Number of recommendations to return per user
+        chunk_size (int): Number of users scored per matrix product
+        model (Optional[Dict]): Model to score with, defaults to get_model()
+
+    Returns:
+        Dict[str, Tuple[np.ndarray, np.ndarray]]: Recommended movie_ids and their predicted
+        ratings per user_key
+    """
+    model = model or get_model()
+    n_items = len(model["movie_ids"])
+    user_keys = list(users_ratings)
+    recommendations = {}
+
+    for start in range(0, len(user_keys), chunk_size):
+        chunk = user_keys[start:start + chunk_size]
+
+        # Sparse chunk x items matrix of the users' known ratings
+        rows, movie_ids, values = [], [], []
+        for row, user_key in enumerate(chunk):
+            for movie_id, rating in users_ratings[user_key].items():
+                if rating is not None:
+                    rows.append(row)
+                    movie_ids.append(int(movie_id))
+                    values.append(rating)
+        positions = model["movie_index"].get_indexer(np.array(movie_ids, dtype=np.int64))
+        known = positions >= 0
+        rated = csr_matrix(
+            (np.array(values, dtype=np.float64)[known], (np.array(rows, dtype=np.int64)[known], positions[known])),
+            shape=(len(chunk), n_items)
+        )
+
+        # Fold in every user of the chunk from the rated columns only and predict all ratings in one product
+        centered, user_means = center_rating_matrix(rated)
+        regularization = model.get("metadata", {}).get("als_regularization")
+        if regularization is not None:
+            user_factors = np.stack([
+                fold_in_ridge(centered.indices[begin:end], centered.data[begin:end], model, regularization)
+                for begin, end in zip(centered.indptr[:-1], centered.indptr[1:])
+            ])
+        else:
+            rated_columns = np.unique(centered.indices)
+            user_factors = (centered[:, rated_columns] @ get_item_factors(model, rated_columns).T) / model["sigma"]
+        predicted_ratings = score_items(user_factors * model["sigma"], model) + user_means[:, None]
+
+        if not ranks_whole_catalog(model):
+            for row, user_key in enumerate(chunk):
+                begin, end = rated.indptr[row], rated.indptr[row + 1]
+                context = make_recommendation_context(model, rated.indices[begin:end], rated.data[begin:end],
+                                                      user_factors[row], user_means[row],
+                                                      predicted=predicted_ratings[row])
+                candidates, columns = recommendation_pipeline.run(context, top_n)
+                recommendations[user_key] = (model["movie_ids"][candidates], columns["predicted"])
+            continue
+
+        # Calculate final scores and filter out movies the users have already rated
+        final_scores = predicted_ratings / model["popularity_penalty"]
+        rated_rows, rated_cols = rated.nonzero()
+        final_scores[rated_rows, rated_cols] = -np.inf
+
+        top = select_top_n_rows(final_scores, top_n)
+        top_finite = np.isfinite(np.take_along_axis(final_scores, top, axis=1))
+        top_predictions = np.take_along_axis(predicted_ratings, top, axis=1)
+        for row, user_key in enumerate(chunk):
+            keep = top_finite[row]
+            recommendations[user_key] = (model["movie_ids"][top[row][keep]], top_predictions[row][keep])
+
+    return recommendations
+
+
+def is_cold_start(new_user_ratings: Dict[str, float], model: Dict) -> bool:
+    """
+    Checks whether a user's ratings cannot be served by the factorization.
+
+    That is the case with fewer than Config.COLD_START_RATINGS ratings known to
+    the model, and with ratings that all have the same score: centered on their
+    mean they are all zero, so the folded-in user is the zero vector and every
+    movie would be predicted at the user's mean.
+    """
+    if Config.COLD_START_RATINGS <= 0 or "cold_start_index" not in model:
+        return False
+    positions, scores = get_rated_positions(new_user_ratings, model)
+    return len(positions) < Config.COLD_START_RATINGS or np.ptp(scores) == 0
+
+
+def get_cold_start_recommendation_items(new_user_ratings: Dict[str, float], top_n: int = 10,
+                                        model: Optional[Dict] = None,
+                                        available: Optional[np.ndarray] = None) -> pd.Series:
+    """
+    Recommends movies to a user with few or no ratings from the precomputed cold-start lists.
+
+    The list of the genre pair, or genre, the user liked most is served,
+    without the movies they already rated; users without liked movies get the
+    overall list.
+
+    Args:
+        new_user_ratings (Dict[str, float]): Dictionary of {movie_id: rating}, possibly empty
+        top_n (int): Number of recommendations to return
+        model (Optional[Dict]): Model holding the cold-start tables, defaults to get_model()
+        available (Optional[np.ndarray]): Mask of the movies that may be recommended, all by default
+
+    Returns:
+        pd.Series: Series of recommended movie_ids and their Bayesian-average ratings
+    """
+    model = model or get_model()
+    positions, scores = get_rated_positions(new_user_ratings, model)
+    candidates, ratings = get_cold_start_items(positions, scores, model, top_n, available)
+    return pd.Series(ratings, index=model["movie_ids"][candidates])
+
+
+def get_recommendations(items, top_n=3, model=None, available=None):
+    model = model or get_model()
+    if is_cold_start(items, model):
+        recommendations = get_cold_start_recommendation_items(items, top_n, model, available)
+    else:
+        recommendations = get_recommendation_items(items, top_n, model, available)
+    return [
+        {"movieLensId": str(movie_id), "pred_score": float(np.clip(score, MIN_RATING, MAX_RATING)),
+         "model_version": model["version"]}
+        for movie_id, score in recommendations.items()
+    ]
+
+
+def get_batch_recommendations(users_items, top_n=3):
+    model = get_model()
+    cold_start = {user_key: items for user_key, items in users_items.items() if is_cold_start(items, model)}
+    recommendations = get_batch_recommendation_items(
+        {user_key: items for user_key, items in users_items.items() if user_key not in cold_start},
+        top_n,
+        model=model
     )
+    for user_key, items in cold_start.items():
+        cold_start_items = get_cold_start_recommendation_items(items, top_n, model)
+        recommendations[user_key] = (cold_start_items.index, cold_start_items.to_numpy())
+    return {
+        user_key: [
+            {"movieLensId": str(movie_id), "pred_score": float(np.clip(score, MIN_RATING, MAX_RATING)),
+             "model_version": model["version"]}
+            for movie_id, score in zip(*recommendations[user_key])
+        ]
+        for user_key in users_items
+    }
+
+
+def get_ratings_fingerprint(items: Dict[str, float], model_version: str, top_n: int,
+                            item_generation: Optional[int] = None) -> str:
+    """
+    Hashes the (movieLensId, score) pairs fed to the recommender together with
+    the model version and the item index generation the availability mask was built from.
+    """
+    pairs = sorted((str(movie_id), score) for movie_id, score in items.items())
+    return hashlib.sha1(repr((pairs, model_version, top_n, item_generation)).encode()).hexdigest()
 
-    # Get the new user's predicted ratings
-    new_user_predictions = predicted_ratings_df.loc[new_user_id]
 
-    # Filter out movies the user has already rated
-    rated_movies = set(int(movie_id) for movie_id, rating in new_user_ratings.items() if rating > 0)
-    unrated_movies = new_user_predictions[~new_user_predictions.index.isin(rated_movies)]
+def get_cached_recommendations(user_id: str, items: Dict[str, float], top_n: int = 3,
+                               available: Optional[np.ndarray] = None) -> List[Dict]:
+    """
+    get_recommendations() behind a per-user LRU + TTL cache.
 
-    # Calculate popularity scores
-    popularity_scores = ratings.groupby('movieId')['rating'].agg(['count', 'mean']).reset_index()
-    popularity_scores['score'] = popularity_scores['count'] * popularity_scores['mean']
-    popularity_dict = popularity_scores.set_index('movieId')['score'].to_dict()
+    An entry is only reused while the user's ratings, the served model version
+    and, with an availability mask, the item index generation are unchanged,
+    since all of them are part of its key: inserted items are recommended
+    right away instead of once the entry expires.
 
-    # Calculate final scores
-    final_scores = unrated_movies.map(lambda x: x / (1 + np.log(1 + popularity_dict.get(x, 0))))
+    Args:
+        user_id (str): The user the recommendations are for
+        items (Dict[str, float]): Dictionary of {movieLensId: rating} fed to the recommender
+        top_n (int): Number of recommendations to return
+        available (Optional[np.ndarray]): Mask of the movies that may be recommended, all by default
 
-    # Return top N recommendations
-    recommendations = final_scores.sort_values(ascending=False).head(top_n)
+    Returns:
+        List[Dict]: The recommendations as returned by get_recommendations()
+    """
+    model = get_model()
+    item_generation = item_index.generation if available is not None else None
+    key = (user_id, get_ratings_fingerprint(items, model["version"], top_n, item_generation))
 
+    recommendations = recommendation_cache.get(key)
+    if recommendations is None:
+        recommendations = get_recommendations(items, top_n, model, available)
+        recommendation_cache.put(user_id, key, recommendations)
     return recommendations
 
-def get_recommendations(items, top_n=3):
-    recommendations = get_recommendation_items(items, top_n)
-    return [{"movieLensId": str(movie_id), "pred_score": score} for movie_id, score in recommendations.items()]
\ No newline at end of file
+
+def invalidate_cached_recommendations(user_id: str) -> None:
+    """Drops every cached recommendation of the user, called whenever their ratings change."""
+    recommendation_cache.invalidate(user_id)
@@ -40,8 +40,40 @@ class Config:
     LLM_TEMPERATURE = float(os.environ.get("LLM_TEMPERATURE", 0)) # Default temperature
     LLM_ENDPOINT_TYPE = os.environ.get("LLM_ENDPOINT_TYPE")
 
+    # Users listing settings
+    USERS_PAGE_SIZE = int(os.environ.get("USERS_PAGE_SIZE", 100))  # Users per page of GET /api/users
+    USERS_PAGE_MAX_SIZE = int(os.environ.get("USERS_PAGE_MAX_SIZE", 1000))  # Largest page a caller may ask for
+    USERS_EXPORT_BATCH_SIZE = int(os.environ.get("USERS_EXPORT_BATCH_SIZE", 500))  # Users per cursor batch of the NDJSON export
+
+    # A/B test settings
+    AB_TEST_GROUPS = os.environ.get("AB_TEST_GROUPS", "A:1,B:1")  # Groups and their integer weights
+    AB_TEST_ALLOCATION = os.environ.get("AB_TEST_ALLOCATION", "counter")  # 'counter' (balanced) or 'hash' (of the user id)
+
     # Recommender settings
     RATINGS_PATH = os.environ.get("RATINGS_PATH", "recsys/datasets/ratings.csv")
+    MOVIES_PATH = os.environ.get("MOVIES_PATH", "recsys/datasets/movies.csv")
+    RATINGS_CACHE_DIR = os.environ.get("RATINGS_CACHE_DIR", "recsys/cache")  # Columnar cache of the ratings, empty disables it
+    MODEL_DIR = os.environ.get("MODEL_DIR", "recsys/model")
+    MODEL_KEEP_VERSIONS = int(os.environ.get("MODEL_KEEP_VERSIONS", 3))
+    MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", 30))  # Seconds between checks for a new model version
+    RECSYS_ENGINE = os.environ.get("RECSYS_ENGINE", "svd")  # 'svd' or 'als'
+    SVD_K = int(os.environ.get("SVD_K", 30))  # Number of latent factors
+    POPULARITY_WEIGHT = float(os.environ.get("POPULARITY_WEIGHT", 0.0))  # Strength of the popularity penalty, 0 disables it
+    ITEM_FACTOR_DTYPE = os.environ.get("ITEM_FACTOR_DTYPE", "float64")  # 'float64', 'float32', 'float16' or per-item scaled 'int8'
+    ALS_ITERATIONS = int(os.environ.get("ALS_ITERATIONS", 10))
+    ALS_REGULARIZATION = float(os.environ.get("ALS_REGULARIZATION", 0.1))
+    ANN_LISTS = int(os.environ.get("ANN_LISTS", 0))  # Partitions of the item ANN index, 0 builds no index
+    ANN_PROBES = int(os.environ.get("ANN_PROBES", 16))  # Partitions read per query when the model has an index
+    ANN_EXEMPLARS = int(os.environ.get("ANN_EXEMPLARS", 16))  # Largest-norm items per partition its probe score reads
+    ITEM_NEIGHBORS = int(os.environ.get("ITEM_NEIGHBORS", 20))  # Similar movies precomputed per movie, 0 builds no table
+    COLD_START_RATINGS = int(os.environ.get("COLD_START_RATINGS", 3))  # Users with fewer ratings get cold-start lists, 0 disables them
+    COLD_START_LIST_SIZE = int(os.environ.get("COLD_START_LIST_SIZE", 50))  # Movies precomputed per cold-start list
+    COLD_START_PRIOR = float(os.environ.get("COLD_START_PRIOR", 10))  # Weight of the global mean in the Bayesian average
+    DIVERSITY_LAMBDA = float(os.environ.get("DIVERSITY_LAMBDA", 1.0))  # MMR relevance weight, below 1 trades relevance for genre diversity
+    DIVERSITY_POOL_SIZE = int(os.environ.get("DIVERSITY_POOL_SIZE", 5))  # MMR picks from the best top_n * pool size candidates
+    RECOMMENDATION_CACHE_SIZE = int(os.environ.get("RECOMMENDATION_CACHE_SIZE", 10000))  # Cached top-N results, 0 disables the cache
+    RECOMMENDATION_CACHE_TTL = float(os.environ.get("RECOMMENDATION_CACHE_TTL", 300))  # Seconds a cached result stays valid
+    RETRAIN_INTERVAL = float(os.environ.get("RETRAIN_INTERVAL", 0))  # Seconds between background retrainings, 0 disables them
 
 
 
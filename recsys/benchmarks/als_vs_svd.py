@@ -0,0 +1,62 @@
+"""
+Training wall time and held-out RMSE of the svd and als engines.
+
+The ratings are split at random into train and test; each engine is trained
+on the train split and scored on the test ratings of known users and movies.
+Test users are folded in from their training ratings with fold_in_user(), the
+path serving takes, since the training U is not part of the model artifact.
+
+Usage:
+    python -m recsys.benchmarks.als_vs_svd [k] [test_fraction]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.recsys.matrix import build_rating_matrix, center_rating_matrix, load_ratings
+from app.utils.recommender import factorize, fold_in_user
+from app.utils.settings import Config
+
+
+def rmse(predictions, targets):
+    return float(np.sqrt(np.mean((predictions - targets) ** 2)))
+
+
+if __name__ == '__main__':
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    test_fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+
+    ratings = load_ratings()
+    test_mask = np.random.default_rng(0).random(len(ratings)) < test_fraction
+    train, test = ratings[~test_mask], ratings[test_mask]
+
+    matrix, user_ids, movie_ids = build_rating_matrix(train)
+    matrix_norm, user_means = center_rating_matrix(matrix)
+    histories = {
+        user_id: dict(zip(user_ratings['movieId'].astype(str), user_ratings['rating'].astype(float)))
+        for user_id, user_ratings in train.groupby('userId')
+    }
+
+    test = test[test['userId'].isin(user_ids) & test['movieId'].isin(movie_ids)]
+    targets = test['rating'].to_numpy(dtype=np.float64)
+    print(f"train {len(train)} ratings, test {len(targets)} ratings, k={k}")
+    print(f"{'user mean':<10} rmse {rmse(user_means[np.searchsorted(user_ids, test['userId'])], targets):.4f}")
+
+    for engine in ('svd', 'als'):
+        start = time.perf_counter()
+        _, sigma, Vt = factorize(matrix_norm, k, engine)
+        elapsed = time.perf_counter() - start
+
+        metadata = {"engine": engine}
+        if engine == 'als':
+            metadata["als_regularization"] = Config.ALS_REGULARIZATION
+        model = {"sigma": sigma, "Vt": Vt, "movie_index": pd.Index(movie_ids), "metadata": metadata}
+
+        predictions = np.empty(len(test))
+        for user_id, rows in test.groupby('userId').indices.items():
+            user_factors, user_mean = fold_in_user(histories[user_id], model)
+            positions = model["movie_index"].get_indexer(test['movieId'].to_numpy()[rows])
+            predictions[rows] = (user_factors * sigma) @ Vt[:, positions] + user_mean
+        print(f"{engine:<10} rmse {rmse(predictions, targets):.4f}  train {elapsed:6.2f}s")
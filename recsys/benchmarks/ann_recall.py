@@ -0,0 +1,60 @@
+"""
+Recall@N and per-query latency of IVF retrieval against exact scoring.
+
+Every MovieLens user is folded in from their latest ratings and recommended
+top N movies, once exactly and once per number of probed partitions. Many
+movies share identical factors (e.g. the ones rated by a single user), so a
+retrieved movie counts as a hit when its final score reaches the exact N-th
+best score, whichever of the tied movies was returned.
+
+Usage:
+    python -m recsys.benchmarks.ann_recall [n_lists] [top_n]
+"""
+import sys
+import time
+
+import numpy as np
+
+from app.recsys.matrix import load_ratings
+from app.recsys.registry import get_model
+from app.utils.recommender import get_recommendation_items, precompute_svd
+from app.utils.settings import Config
+
+
+def recommend_all(users_ratings, top_n, model):
+    start = time.perf_counter()
+    results = [get_recommendation_items(ratings, top_n, model) for ratings in users_ratings]
+    latency = (time.perf_counter() - start) / len(users_ratings)
+
+    # Final scores the recommendations were ranked by
+    final_scores = [
+        recommendations.to_numpy() / model["popularity_penalty"][model["movie_index"].get_indexer(recommendations.index)]
+        for recommendations in results
+    ]
+    return final_scores, latency
+
+
+if __name__ == '__main__':
+    Config.ANN_LISTS = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    top_n = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    precompute_svd()
+    model = get_model()
+    ratings = load_ratings().sort_values('timestamp')
+    users_ratings = [
+        dict(zip(user_ratings['movieId'].astype(str), user_ratings['rating'].astype(float)))
+        for _, user_ratings in ratings.groupby('userId').tail(6).groupby('userId')
+    ]
+
+    Config.ANN_PROBES = 0
+    exact, exact_latency = recommend_all(users_ratings, top_n, model)
+    print(f"{len(model['movie_ids'])} movies, {Config.ANN_LISTS} lists, {len(users_ratings)} users")
+    print(f"exact          recall@{top_n} 1.000  {exact_latency * 1000:.3f} ms/query")
+
+    for n_probe in (1, 2, 4, 8, 16, 32):
+        Config.ANN_PROBES = n_probe
+        approximate, latency = recommend_all(users_ratings, top_n, model)
+        recall = np.mean([
+            np.mean(a >= e.min() - 1e-9) * len(a) / max(len(e), 1) for a, e in zip(approximate, exact) if len(e)
+        ])
+        print(f"probe {n_probe:<8} recall@{top_n} {recall:.3f}  {latency * 1000:.3f} ms/query")
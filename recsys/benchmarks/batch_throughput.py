@@ -0,0 +1,37 @@
+"""
+Measures recommendation throughput in users per second, scoring the MovieLens
+users' latest ratings one request at a time versus through the batch path.
+
+Usage:
+    python -m recsys.benchmarks.batch_throughput [ratings_per_user] [chunk_size]
+"""
+import sys
+import time
+
+from app.recsys.matrix import load_ratings
+from app.utils.recommender import get_batch_recommendation_items, get_recommendation_items, precompute_svd
+
+
+if __name__ == '__main__':
+    ratings_per_user = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+
+    precompute_svd()
+    ratings = load_ratings().sort_values('timestamp')
+    users_ratings = {
+        str(user_id): dict(zip(user_ratings['movieId'].astype(str), user_ratings['rating'].astype(float)))
+        for user_id, user_ratings in ratings.groupby('userId').tail(ratings_per_user).groupby('userId')
+    }
+
+    start = time.perf_counter()
+    for new_user_ratings in users_ratings.values():
+        get_recommendation_items(new_user_ratings, 10)
+    single = len(users_ratings) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    get_batch_recommendation_items(users_ratings, 10, chunk_size)
+    batch = len(users_ratings) / (time.perf_counter() - start)
+
+    print(f"users        {len(users_ratings)}")
+    print(f"one by one   {single:10.0f} users/s")
+    print(f"batch        {batch:10.0f} users/s")
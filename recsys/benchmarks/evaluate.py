@@ -0,0 +1,165 @@
+"""
+Offline evaluation and latency benchmark of the served recommender.
+
+The ratings are split by time per user: every user's earliest ratings train
+the model exactly as the server builds it, and their latest ones are the test
+set. Each test user is served from their latest training ratings through
+get_recommendations(), as the recommendations route does: users with too few
+or constant ratings get the cold-start lists, and the recommendations are
+restricted to the movies of the catalog (movies.csv, from which the `items`
+collection is filled). Every test user is evaluated on:
+
+    - rating accuracy: RMSE and MAE of the predicted test ratings
+    - ranking quality: precision@k, recall@k and NDCG@k of the top-k
+      recommendations against the test ratings >= the relevance threshold
+    - cost: training time, p50/p95/p99 recommendation latency, peak RSS
+
+Results are written as JSON and compared against a stored baseline, so that
+every engine change can be checked for regressions.
+
+Usage:
+    python -m recsys.benchmarks.evaluate [--engine svd|als] [--k 30] [--output results.json]
+                                         [--baseline recsys/benchmarks/baseline.json] [--save-baseline]
+"""
+import argparse
+import json
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+
+from app.recsys.matrix import load_ratings
+from app.recsys.metrics import latest_histories, ranking_metrics, time_split
+from app.recsys.quantize import get_item_factors
+from app.recsys.registry import clear_model, get_model
+from app.utils.item_index import item_index
+from app.utils.recommender import fold_in_user, get_available_movies, get_recommendations, precompute_svd
+from app.utils.settings import Config
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+
+
+def evaluate(ratings: pd.DataFrame, engine: str, k: int, train_fraction: float = 0.8, history: int = 6,
+             top_k: int = 10, relevance_threshold: float = 4.0):
+    train, test = time_split(ratings, train_fraction)
+
+    start = time.perf_counter()
+    precompute_svd(k, train, engine)
+    train_seconds = time.perf_counter() - start
+    model = get_model()
+    movie_index = model["movie_index"]
+
+    # The served catalog: every movie of movies.csv as an item, masked as the routes mask it
+    movies = pd.read_csv(Config.MOVIES_PATH, usecols=['movieId'])
+    item_index.clear()
+    item_index.add({'_id': ObjectId(), 'movieLensId': str(movie_id)} for movie_id in movies['movieId'])
+    available = get_available_movies(model)
+
+    histories = latest_histories(train, history)
+
+    errors, precisions, recalls, ndcgs, latencies = [], [], [], [], []
+    for user_id, user_test in test.groupby('userId'):
+        new_user_ratings = histories.get(user_id, {})
+
+        # Rating accuracy of the factorization on the test movies the model knows
+        positions = movie_index.get_indexer(user_test['movieId'].to_numpy())
+        known = positions >= 0
+        if new_user_ratings and known.any():
+            user_factors, user_mean = fold_in_user(new_user_ratings, model)
+            predictions = (user_factors * model["sigma"]) @ get_item_factors(model, positions[known]) + user_mean
+            errors.append(np.clip(predictions, 0.5, 5) - user_test['rating'].to_numpy()[known])
+
+        # Ranking quality and latency of the served path
+        start = time.perf_counter()
+        recommendations = get_recommendations(new_user_ratings, top_k, model, available)
+        latencies.append(time.perf_counter() - start)
+
+        relevant = set(user_test.loc[user_test['rating'] >= relevance_threshold, 'movieId'])
+        if relevant:
+            recommended = [int(recommendation['movieLensId']) for recommendation in recommendations]
+            precision, recall, ndcg = ranking_metrics(recommended, relevant, top_k)
+            precisions.append(precision)
+            recalls.append(recall)
+            ndcgs.append(ndcg)
+
+    errors = np.concatenate(errors) if errors else np.empty(0)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'config': {
+            'engine': engine,
+            'k': k,
+            'train_fraction': train_fraction,
+            'history': history,
+            'top_k': top_k,
+            'relevance_threshold': relevance_threshold,
+            'train_ratings': len(train),
+            'test_ratings': len(test),
+            'test_users': len(latencies)
+        },
+        'metrics': {
+            'rmse': float(np.sqrt(np.mean(errors ** 2))) if len(errors) else None,
+            'mae': float(np.mean(np.abs(errors))) if len(errors) else None,
+            f'precision@{top_k}': float(np.mean(precisions)) if precisions else None,
+            f'recall@{top_k}': float(np.mean(recalls)) if recalls else None,
+            f'ndcg@{top_k}': float(np.mean(ndcgs)) if ndcgs else None
+        },
+        'cost': {
+            'train_seconds': train_seconds,
+            'latency_p50_ms': float(np.percentile(latencies_ms, 50)),
+            'latency_p95_ms': float(np.percentile(latencies_ms, 95)),
+            'latency_p99_ms': float(np.percentile(latencies_ms, 99)),
+            # ru_maxrss is in KiB on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        }
+    }
+
+
+def compare(results, baseline):
+    """Prints every metric next to the baseline value and the relative change."""
+    for section in ('metrics', 'cost'):
+        for name, value in results[section].items():
+            reference = baseline.get(section, {}).get(name)
+            if value is None or reference is None:
+                print(f"{name:<18} {value}")
+            else:
+                change = (value - reference) / reference * 100 if reference else 0.0
+                print(f"{name:<18} {value:12.4f}  baseline {reference:12.4f}  {change:+7.1f}%")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate the served recommender on a per-user time-based split.')
+    parser.add_argument('--engine', default=Config.RECSYS_ENGINE, choices=['svd', 'als'])
+    parser.add_argument('--k', type=int, default=Config.SVD_K, help='Number of latent factors')
+    parser.add_argument('--train-fraction', type=float, default=0.8, help="Share of each user's ratings used for training")
+    parser.add_argument('--history', type=int, default=6, help='Latest ratings fed to the recommender per user')
+    parser.add_argument('--top-k', type=int, default=10, help='Cut-off of the ranking metrics')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', default=str(BASELINE_PATH), help='Baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    args = parser.parse_args()
+
+    # Train into a scratch directory so the served model is left untouched
+    with tempfile.TemporaryDirectory() as model_dir:
+        Config.MODEL_DIR = model_dir
+        clear_model()
+        results = evaluate(load_ratings(), args.engine, args.k, args.train_fraction, args.history, args.top_k)
+        clear_model()
+        item_index.clear()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if Path(args.baseline).exists() and not args.save_baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
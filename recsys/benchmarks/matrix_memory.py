@@ -0,0 +1,46 @@
+"""
+Compares peak memory and build time of the dense pandas pivot that the
+recommender used to build against the sparse CSR rating matrix.
+
+Usage:
+    python -m recsys.benchmarks.matrix_memory [ratings.csv]
+"""
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from app.recsys.matrix import build_rating_matrix, center_rating_matrix, load_ratings
+from app.utils.settings import Config
+
+
+def build_dense_pivot(path):
+    ratings = pd.read_csv(path)
+    user_movie_matrix = ratings.pivot(index='userId', columns='movieId', values='rating').fillna(0)
+    user_ratings_mean = user_movie_matrix.mean(axis=1)
+    return user_movie_matrix.sub(user_ratings_mean, axis=0)
+
+
+def build_sparse_matrix(path):
+    matrix, _, _ = build_rating_matrix(load_ratings(path))
+    centered, _ = center_rating_matrix(matrix)
+    return centered
+
+
+def measure(build, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    build(path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else Config.RATINGS_PATH
+
+    for name, build in (('dense pivot', build_dense_pivot), ('sparse csr', build_sparse_matrix)):
+        peak, elapsed = measure(build, path)
+        print(f"{name:<12} peak {peak / 2 ** 20:8.1f} MiB  time {elapsed * 1000:8.1f} ms")
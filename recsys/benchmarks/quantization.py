@@ -0,0 +1,135 @@
+"""
+Serving memory and ranking agreement of the item factor storage types.
+
+One model is built per storage type (float64, float32, float16, int8) from the
+same factorization. Each is then served from a fresh worker process that
+recommends the top 10 movies to every MovieLens user, folded in from their
+latest 6 ratings, and reports:
+
+    - the bytes of the model arrays and of Vt alone
+    - the growth of the worker's resident and private memory while serving
+    - top-10 agreement with float64: the share of the float64 top 10 that is
+      kept, and the tie-aware share of returned movies whose float64 final score
+      reaches the float64 10th best (many movies share identical factors, so
+      ties are reordered by the tiniest rounding)
+    - the largest difference in predicted rating
+
+Usage:
+    python -m recsys.benchmarks.quantization
+"""
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from app.recsys.matrix import load_ratings
+from app.recsys.quantize import FACTOR_DTYPES
+from app.recsys.registry import clear_model, get_model
+from app.utils.recommender import fold_in_user, get_recommendation_items, precompute_svd
+from app.utils.settings import Config
+
+
+def read_memory_kib():
+    """Returns the resident and private memory of this process, in KiB."""
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields['Rss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+
+def get_users_ratings():
+    ratings = load_ratings().sort_values('timestamp')
+    return [
+        dict(zip(user_ratings['movieId'].astype(str), user_ratings['rating'].astype(float)))
+        for _, user_ratings in ratings.groupby('userId').tail(6).groupby('userId')
+    ]
+
+
+def serve(model_dir, output):
+    """Worker side: serves every user from the model in model_dir and writes the results."""
+    users_ratings = get_users_ratings()
+    rss_before, private_before = read_memory_kib()
+
+    Config.MODEL_DIR = model_dir
+    model = get_model()
+    results = [get_recommendation_items(ratings, 10, model) for ratings in users_ratings]
+    rss_after, private_after = read_memory_kib()
+
+    arrays = [value for value in model.values() if isinstance(value, np.ndarray)]
+    with open(output, 'w') as f:
+        json.dump({
+            'model_bytes': int(sum(array.nbytes for array in arrays)),
+            'vt_bytes': int(model['Vt'].nbytes + (model['Vt_scale'].nbytes if 'Vt_scale' in model else 0)),
+            'rss_kib': rss_after - rss_before,
+            'private_kib': private_after - private_before,
+            'recommendations': [
+                [[int(movie_id) for movie_id in result.index], [float(score) for score in result]]
+                for result in results
+            ]
+        }, f)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--worker':
+        serve(sys.argv[2], sys.argv[3])
+        sys.exit()
+
+    reports = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype in FACTOR_DTYPES:
+            Config.MODEL_DIR = str(Path(tmp) / dtype)
+            Config.ITEM_FACTOR_DTYPE = dtype
+            clear_model()
+            precompute_svd()
+
+            output = Path(tmp) / f"{dtype}.json"
+            subprocess.run([sys.executable, '-m', 'recsys.benchmarks.quantization', '--worker', Config.MODEL_DIR,
+                            str(output)], check=True, stdout=subprocess.DEVNULL)
+            reports[dtype] = json.loads(output.read_text())
+
+        # Final scores of every returned movie under the float64 model
+        Config.MODEL_DIR = str(Path(tmp) / 'float64')
+        clear_model()
+        model = get_model()
+        users_factors = [fold_in_user(ratings, model) for ratings in get_users_ratings()]
+
+        def final_scores(recommendations):
+            scores = []
+            for (user_factors, user_mean), (ids, _) in zip(users_factors, recommendations):
+                positions = model['movie_index'].get_indexer(ids)
+                predicted = (user_factors * model['sigma']) @ model['Vt'][:, positions] + user_mean
+                scores.append(predicted / model['popularity_penalty'][positions])
+            return scores
+
+        baseline_scores = final_scores(reports['float64']['recommendations'])
+        for report in reports.values():
+            report['tie_aware'] = np.mean([
+                np.mean(scores >= base.min() - 1e-9) if len(scores) else 1.0
+                for scores, base in zip(final_scores(report['recommendations']), baseline_scores) if len(base)
+            ])
+        clear_model()
+
+    baseline = reports['float64']['recommendations']
+    n_users = len(baseline)
+    print(f"{n_users} users, top 10")
+    print(f"{'dtype':<8} {'model':>10} {'Vt':>10} {'RSS/worker':>11} {'private':>10} {'overlap':>8} "
+          f"{'tie-aware':>10} {'max |dpred|':>12}")
+    for dtype, report in reports.items():
+        agreement = np.mean([
+            len(set(ids) & set(base_ids)) / max(len(base_ids), 1)
+            for (ids, _), (base_ids, _) in zip(report['recommendations'], baseline)
+        ])
+        error = max(
+            (abs(score - dict(zip(*base))[movie_id]) for (ids, scores), base in zip(report['recommendations'], baseline)
+             for movie_id, score in zip(ids, scores) if movie_id in base[0]),
+            default=0.0
+        )
+        print(f"{dtype:<8} {report['model_bytes'] / 2 ** 20:8.2f}MB {report['vt_bytes'] / 2 ** 20:8.2f}MB "
+              f"{report['rss_kib'] / 1024:9.2f}MB {report['private_kib'] / 1024:8.2f}MB {agreement:8.4f} "
+              f"{report['tie_aware']:10.4f} {error:12.5f}")
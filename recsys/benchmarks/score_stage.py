@@ -0,0 +1,59 @@
+"""
+Microbenchmark of the per-request final-score stage: popularity re-scoring,
+masking of already-rated movies and top-N selection.
+
+"before" is the pandas stage the recommender used to run on every request
+(groupby over all ratings, dict lookup through Series.map, full sort_values).
+"after" is the NumPy stage over the popularity penalty precomputed at build time.
+
+Usage:
+    python -m recsys.benchmarks.score_stage [repeats]
+"""
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from app.recsys.matrix import load_ratings
+from app.recsys.registry import get_model
+from app.utils.recommender import precompute_svd, select_top_n
+
+
+def score_before(ratings, predictions, new_user_ratings, top_n):
+    rated_movies = set(int(movie_id) for movie_id, rating in new_user_ratings.items() if rating > 0)
+    unrated_movies = predictions[~predictions.index.isin(rated_movies)]
+
+    popularity_scores = ratings.groupby('movieId')['rating'].agg(['count', 'mean']).reset_index()
+    popularity_scores['score'] = popularity_scores['count'] * popularity_scores['mean']
+    popularity_dict = popularity_scores.set_index('movieId')['score'].to_dict()
+
+    final_scores = unrated_movies.map(lambda x: x / (1 + np.log(1 + popularity_dict.get(x, 0))))
+    return final_scores.sort_values(ascending=False).head(top_n)
+
+
+def score_after(model, predicted_ratings, rated_positions, top_n):
+    final_scores = predicted_ratings / model["popularity_penalty"]
+    final_scores[rated_positions] = -np.inf
+    top = select_top_n(final_scores, top_n)
+    return pd.Series(predicted_ratings[top], index=model["movie_ids"][top])
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    precompute_svd()
+    model = get_model()
+    ratings = load_ratings()
+
+    rng = np.random.default_rng(0)
+    predicted_ratings = rng.normal(3.5, 0.5, len(model["movie_ids"]))
+    rated_positions = rng.choice(len(model["movie_ids"]), 6, replace=False)
+    new_user_ratings = {str(model["movie_ids"][p]): 4.0 for p in rated_positions}
+    predictions = pd.Series(predicted_ratings, index=model["movie_index"])
+
+    before = timeit.timeit(lambda: score_before(ratings, predictions, new_user_ratings, 10), number=repeats)
+    after = timeit.timeit(lambda: score_after(model, predicted_ratings, rated_positions, 10), number=repeats)
+
+    print(f"before {before / repeats * 1000:8.3f} ms/request")
+    print(f"after  {after / repeats * 1000:8.3f} ms/request")
@@ -0,0 +1,89 @@
+"""
+Memory of the model across server worker processes.
+
+Starts 1, 2, 4 and 8 worker processes side by side, as a multi-worker WSGI
+server would. Every worker loads the published model and recommends to a few
+hundred users, then all of them report the growth of their memory while the
+others are still alive:
+
+    - mmap: the model as served, every array memory-mapped read-only, so the
+      workers share its pages through the page cache
+    - copy: every array copied into the worker, as when each worker trained or
+      unpickled its own model
+
+Per worker the growth of the resident size (RSS) and of the proportional size
+(PSS, where shared pages are split between the processes mapping them) is
+printed, with the total PSS of all workers: with mmap it grows by the private
+structures only, with copy by a whole model per worker.
+
+Usage:
+    python -m recsys.benchmarks.worker_memory [--workers 1 2 4 8] [--users 300]
+"""
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from app.recsys.matrix import load_ratings
+from app.recsys.registry import get_model, get_worker_memory
+from app.utils.recommender import ensure_model, get_recommendation_items
+
+
+def get_users_ratings(n_users):
+    ratings = load_ratings().sort_values('timestamp')
+    latest = ratings.groupby('userId').tail(6)
+    return [
+        dict(zip(user_ratings['movieId'].astype(str), user_ratings['rating'].astype(float)))
+        for _, user_ratings in list(latest.groupby('userId'))[:n_users]
+    ]
+
+
+def serve(mode, users_ratings, barrier, results):
+    """Worker side: loads the model, serves every user and reports once all workers are done."""
+    before = get_worker_memory()
+    model = get_model()
+    if mode == 'copy':
+        model = {name: np.array(value) if isinstance(value, np.ndarray) else value for name, value in model.items()}
+    for ratings in users_ratings:
+        get_recommendation_items(ratings, 10, model)
+
+    barrier.wait()
+    after = get_worker_memory()
+    results.put({name: after[name] - before[name] for name in ('rss_kib', 'pss_kib', 'private_kib')})
+    # Stay alive until every worker has read its memory, so shared pages stay shared
+    barrier.wait()
+
+
+def run_workers(mode, n_workers, users_ratings):
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(n_workers)
+    results = context.Queue()
+    workers = [context.Process(target=serve, args=(mode, users_ratings, barrier, results)) for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure model memory across worker processes.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Numbers of worker processes')
+    parser.add_argument('--users', type=int, default=300, help='Users served by every worker')
+    args = parser.parse_args()
+
+    version = ensure_model()
+    model = get_model()
+    model_bytes = sum(value.nbytes for value in model.values() if isinstance(value, np.ndarray))
+    users_ratings = get_users_ratings(args.users)
+    print(f"Model version {version} (generation {model['generation']}), arrays {model_bytes / 2 ** 20:.2f}MB")
+
+    print(f"{'mode':<5} {'workers':>7} {'RSS/worker':>11} {'PSS/worker':>11} {'private':>10} {'total PSS':>10}")
+    for mode in ('mmap', 'copy'):
+        for n_workers in args.workers:
+            reports = run_workers(mode, n_workers, users_ratings)
+            rss, pss, private = (np.mean([report[name] for report in reports]) / 1024
+                                 for name in ('rss_kib', 'pss_kib', 'private_kib'))
+            total = sum(report['pss_kib'] for report in reports) / 1024
+            print(f"{mode:<5} {n_workers:>7} {rss:9.2f}MB {pss:9.2f}MB {private:8.2f}MB {total:8.2f}MB")
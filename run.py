@@ -6,7 +6,8 @@ from flask_cors import CORS
 from app.routes.items import items_bp
 from app.routes.recommendations import recommendations_bp
 from app.routes.users import users_bp
-from app.utils.recommender import precompute_svd
+from app.recsys.scheduler import start_scheduler
+from app.utils.recommender import get_model_status, load_model_in_background
 from app.utils.swagger import swagger_ui_blueprint
 
 from app.utils.db import init_db, get_db_status
@@ -31,7 +32,12 @@ app.url_map.strict_slashes = False
 @app.route('/', methods=['GET'])
 def hello_world():
     (message, status_code) = get_db_status(app)
-    return jsonify({"message": message}), status_code
+    model_status = get_model_status()
+    if status_code == 200 and model_status['state'] == 'loading':
+        message, status_code = 'Recommender model is loading.', 503
+    elif status_code == 200 and model_status['state'] == 'error':
+        message, status_code = 'Error: Could not load the recommender model.', 503
+    return jsonify({"message": message, "model": model_status}), status_code
 
 
 @app.errorhandler(404)
@@ -50,7 +56,9 @@ app.register_blueprint(recommendations_bp, url_prefix='/api')
 app.register_blueprint(items_bp, url_prefix='/api')
 
 init_db(app)
-precompute_svd()
+load_model_in_background()
+if app.config['RETRAIN_INTERVAL'] > 0:
+    start_scheduler(app.db, app.config['RETRAIN_INTERVAL'])
 
 if __name__ == '__main__':
     app.run(
@@ -0,0 +1,104 @@
+"""
+Shared fixtures: a model trained once per session on the bundled MovieLens
+ratings, and a Flask app backed by mongomock with a token helper.
+"""
+import shutil
+
+import mongomock
+import pytest
+from flask import Flask
+
+from app.recsys.matrix import load_ratings
+from app.recsys.registry import clear_model, get_model
+from app.routes.items import items_bp
+from app.routes.recommendations import recommendations_bp
+from app.routes.users import users_bp
+from app.utils.auth.auth import get_jwt
+from app.utils.item_index import item_index
+from app.utils.recommender import precompute_svd, recommendation_cache
+from app.utils.settings import Config
+
+
+@pytest.fixture(scope='session')
+def ratings():
+    return load_ratings()
+
+
+@pytest.fixture(scope='session')
+def model_dir(tmp_path_factory, ratings):
+    """A model directory holding one SVD model trained with the default settings."""
+    patch = pytest.MonkeyPatch()
+    path = tmp_path_factory.mktemp('model')
+    patch.setattr(Config, 'MODEL_DIR', str(path))
+    precompute_svd(ratings=ratings)
+    yield str(path)
+    patch.undo()
+    clear_model()
+
+
+@pytest.fixture(scope='session')
+def ann_model_dir(tmp_path_factory, ratings):
+    """A model directory holding one SVD model with a 64-list ANN index."""
+    patch = pytest.MonkeyPatch()
+    path = tmp_path_factory.mktemp('ann_model')
+    patch.setattr(Config, 'MODEL_DIR', str(path))
+    patch.setattr(Config, 'ANN_LISTS', 64)
+    precompute_svd(ratings=ratings)
+    yield str(path)
+    patch.undo()
+    clear_model()
+
+
+@pytest.fixture
+def model(model_dir):
+    clear_model()
+    recommendation_cache.clear()
+    yield get_model()
+    clear_model()
+
+
+@pytest.fixture
+def ann_model(ann_model_dir, monkeypatch):
+    monkeypatch.setattr(Config, 'MODEL_DIR', ann_model_dir)
+    clear_model()
+    yield get_model()
+    clear_model()
+
+
+@pytest.fixture(params=['model_dir', 'ann_model_dir'])
+def model_copy(request, tmp_path, monkeypatch):
+    """A private copy of the session models, for tests that publish new versions."""
+    path = tmp_path / 'model'
+    shutil.copytree(request.getfixturevalue(request.param), path)
+    monkeypatch.setattr(Config, 'MODEL_DIR', str(path))
+    clear_model()
+    yield get_model()
+    clear_model()
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().app
+
+
+@pytest.fixture
+def app(db):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(NO_AUTH_IPS=['127.0.0.1'], JWT_SECRET='test-secret', JWT_ISSUER='test', JWT_AUDIENCE='test')
+    app.register_blueprint(users_bp, url_prefix='/api')
+    app.register_blueprint(recommendations_bp, url_prefix='/api')
+    app.register_blueprint(items_bp, url_prefix='/api')
+    app.db = db
+    item_index.clear()
+    yield app
+    item_index.clear()
+
+
+@pytest.fixture
+def auth_headers(app):
+    """Returns the Authorization header of a user."""
+    def make(user_id):
+        with app.app_context():
+            return {'Authorization': get_jwt({'sub': str(user_id)})}
+    return make
@@ -0,0 +1,50 @@
+import numpy as np
+
+from app.recsys.ann import build_ivf_index, probe_ivf_index, reassign_ivf_items
+
+
+def make_vectors():
+    rng = np.random.default_rng(0)
+    centers = np.array([[10.0, 0.0], [0.0, 10.0], [-10.0, 0.0]])
+    return np.vstack([center + rng.normal(size=(20, 2)) for center in centers])
+
+
+def list_of(index, position):
+    return int(np.searchsorted(index["ann_offsets"], np.flatnonzero(index["ann_items"] == position)[0], side='right') - 1)
+
+
+def test_probing_returns_the_lists_closest_to_the_query():
+    vectors = make_vectors()
+    index = build_ivf_index(vectors, 3)
+
+    candidates = probe_ivf_index(np.array([1.0, 0.0]), index, 1)
+    assert sorted(candidates) == list(range(20))
+
+
+def test_exemplars_rank_the_list_holding_the_best_item_first():
+    # Heavy-tailed norms: the best items are a few long vectors among many short ones
+    rng = np.random.default_rng(1)
+    directions = rng.normal(size=(500, 4))
+    vectors = directions / np.linalg.norm(directions, axis=1)[:, None] * rng.lognormal(sigma=1.5, size=(500, 1))
+    index = build_ivf_index(vectors, 10, n_exemplars=500)
+
+    # With every item an exemplar, a list's probe score is its best inner product
+    for query in rng.normal(size=(50, 4)):
+        assert np.argmax(vectors @ query) in probe_ivf_index(query, index, 1)
+
+
+def test_reassigned_items_move_to_their_nearest_list():
+    vectors = make_vectors()
+    index = build_ivf_index(vectors, 3)
+    before = {position: list_of(index, position) for position in range(60)}
+
+    # Item 5 moved from the first cluster to the third one
+    vectors[5] = [-10.0, 0.5]
+    updated = reassign_ivf_items(index, vectors, np.array([5]))
+
+    np.testing.assert_array_equal(updated["ann_centroids"], index["ann_centroids"])
+    assert [-10.0, 0.5] in updated["ann_exemplars"][list_of(updated, 5)].tolist()
+    assert sorted(updated["ann_items"]) == list(range(60))
+    assert list_of(updated, 5) == list_of(index, 45)
+    assert all(list_of(updated, position) == before[position] for position in range(60) if position != 5)
+    assert 5 in probe_ivf_index(np.array([-1.0, 0.0]), updated, 1)
@@ -0,0 +1,132 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.models.Rating import MIGRATED_FIELD, find_item_ratings, find_user_ratings, is_migration_complete
+from app.utils import migrate_ratings as migration
+from app.utils.migrate_ratings import MIGRATION_ID, migrate_ratings
+
+
+def make_rating(item: int, score: int, day: int):
+    return {'item_id': f'item{item}', 'score': score, 'timestamp': datetime(2024, 1, day), 'version': 1}
+
+
+@pytest.fixture
+def users(db):
+    """Five legacy users with embedded ratings, one without any."""
+    user_ids = [ObjectId() for _ in range(6)]
+    for number, user_id in enumerate(sorted(user_ids)):
+        ratings = [make_rating(item, 1 + (number + item) % 5, 1 + item) for item in range(number)]
+        db.users.insert_one({'_id': user_id, 'ratings': ratings})
+    return sorted(user_ids)
+
+
+def copied(db, user_id):
+    return sorted((rating['item_id'], rating['score']) for rating in db.ratings.find({'user_id': str(user_id)}))
+
+
+def test_migration_copies_every_rating_once(db, users):
+    result = migrate_ratings(db, batch_size=2)
+
+    assert result['ratings'] == sum(range(6))
+    assert db.ratings.count_documents({}) == sum(range(6))
+    assert all(db.users.find_one({'_id': user_id})[MIGRATED_FIELD] for user_id in users)
+    assert db.migrations.find_one({'_id': MIGRATION_ID}) == {'_id': MIGRATION_ID, 'last_user_id': users[-1],
+                                                             'completed': True}
+
+    # Nothing is left to copy, and repeating a run from the start copies nothing twice
+    assert migrate_ratings(db, batch_size=2)['users'] == 0
+    migrate_ratings(db, batch_size=2, restart=True)
+    assert db.ratings.count_documents({}) == sum(range(6))
+
+
+def test_migration_resumes_from_the_checkpoint(db, users, monkeypatch):
+    batches = []
+    migrate_batch = migration.migrate_batch
+
+    def interrupted(db, batch, drop_embedded=False):
+        if len(batches) == 1:
+            raise KeyboardInterrupt
+        batches.append([user['_id'] for user in batch])
+        return migrate_batch(db, batch, drop_embedded)
+
+    monkeypatch.setattr(migration, 'migrate_batch', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        migrate_ratings(db, batch_size=2)
+    assert db.migrations.find_one({'_id': MIGRATION_ID}) == {'_id': MIGRATION_ID, 'last_user_id': batches[0][-1]}
+    assert not is_migration_complete(db)
+
+    monkeypatch.setattr(migration, 'migrate_batch', migrate_batch)
+    result = migrate_ratings(db, batch_size=2)
+
+    # The resumed run starts after the checkpointed user
+    assert result['users'] == len(users) - len(batches[0])
+    assert db.ratings.count_documents({}) == sum(range(6))
+    for number, user_id in enumerate(users):
+        assert len(copied(db, user_id)) == number
+
+
+def test_migration_recopies_a_user_changed_during_the_batch(db, users, monkeypatch):
+    changed = users[3]
+    bulk_write = db.ratings.bulk_write
+
+    def racing_bulk_write(requests, ordered=True):
+        # A request deletes one of the user's ratings and updates another between the read and the mark
+        result = bulk_write(requests, ordered=ordered)
+        monkeypatch.setattr(db.ratings, 'bulk_write', bulk_write)
+        db.users.update_one({'_id': changed}, {'$pop': {'ratings': 1}})
+        db.users.update_one({'_id': changed, 'ratings.item_id': 'item0'}, {'$set': {'ratings.$.score': 5}})
+        return result
+
+    monkeypatch.setattr(db.ratings, 'bulk_write', racing_bulk_write)
+    migrate_ratings(db, batch_size=10)
+
+    assert copied(db, changed) == [('item0', 5), ('item1', 5)]
+    assert db.users.find_one({'_id': changed})[MIGRATED_FIELD]
+
+
+def test_migration_drops_the_embedded_arrays_on_request(db, users):
+    migrate_ratings(db, batch_size=2)
+    migrate_ratings(db, batch_size=2, drop_embedded=True, restart=True)
+
+    assert db.users.count_documents({'ratings': {'$exists': True}}) == 0
+    assert db.ratings.count_documents({}) == sum(range(6))
+
+
+def test_user_ratings_are_read_from_where_they_live(db, users):
+    user_id = str(users[4])
+    before = find_user_ratings(db, user_id, limit=2)
+    migrate_ratings(db, batch_size=2, drop_embedded=True)
+    after = find_user_ratings(db, user_id, limit=2)
+
+    assert [rating['item_id'] for rating in before] == ['item3', 'item2']
+    assert [(rating['item_id'], rating['score']) for rating in after] == \
+        [(rating['item_id'], rating['score']) for rating in before]
+    assert len(find_user_ratings(db, user_id)) == 4
+
+
+def test_migrated_users_skip_the_embedded_lookup(db, users, monkeypatch):
+    migrate_ratings(db, batch_size=2)
+
+    def no_lookup(*args, **kwargs):
+        raise AssertionError('users.find_one called')
+
+    monkeypatch.setattr(db.users, 'find_one', no_lookup)
+    assert len(find_user_ratings(db, str(users[4]), limit=6, migrated=True)) == 4
+
+
+def test_item_ratings_include_users_not_migrated_yet(db, users):
+    # A legacy user's rating written through the routes is in both places until the migration copies them
+    legacy = users[3]
+    db.ratings.insert_one({'user_id': str(legacy), **make_rating(1, 5, 2)})
+    db.ratings.insert_one({'user_id': 'new-user', **make_rating(1, 3, 9)})
+
+    before = find_item_ratings(db, 'item1')
+    assert sorted((rating['user_id'], rating['score']) for rating in before) == sorted(
+        [(str(user_id), 1 + (number + 1) % 5) for number, user_id in enumerate(users) if number > 1] + [('new-user', 3)])
+
+    migrate_ratings(db, batch_size=2, drop_embedded=True)
+    after = find_item_ratings(db, 'item1')
+    assert sorted((rating['user_id'], rating['score']) for rating in after) == \
+        sorted((rating['user_id'], rating['score']) for rating in before)
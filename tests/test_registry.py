@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from app.recsys import registry
+from app.recsys.registry import (StaleModelError, get_model, load_model, read_current, rollback_model,
+                                 save_model)
+from app.utils.settings import Config
+
+
+def make_arrays(value: float):
+    return {
+        "sigma": np.full(2, value),
+        "Vt": np.full((2, 3), value),
+        "user_ratings_mean": np.zeros(1),
+        "user_ids": np.array([1], dtype=np.int32),
+        "movie_ids": np.array([10, 20, 30], dtype=np.int32),
+        "popularity_penalty": np.ones(3, dtype=np.float32)
+    }
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'MODEL_DIR', str(tmp_path))
+    monkeypatch.setattr(Config, 'MODEL_RELOAD_INTERVAL', 0)
+    registry.clear_model()
+    yield tmp_path
+    registry.clear_model()
+
+
+def test_publish_makes_the_new_version_current(model_dir):
+    first = save_model(make_arrays(1.0), metadata={"k": 2})
+    second = save_model(make_arrays(2.0))
+
+    assert read_current() == (second, 2)
+    model = get_model()
+    assert model["version"] == second and model["generation"] == 2
+    assert model["sigma"][0] == 2.0
+    assert load_model(version=first)["metadata"] == {"k": 2}
+    assert not any(path.name.startswith(".") and path.is_dir() for path in model_dir.iterdir())
+
+
+def test_publish_inherits_the_arrays_it_does_not_replace(model_dir):
+    save_model({**make_arrays(1.0), "item_evidence": np.ones((2, 3))})
+    version = save_model({"Vt": np.full((2, 3), 5.0)}, inherit=True)
+
+    model = load_model(version=version)
+    assert model["Vt"][0, 0] == 5.0
+    assert model["sigma"][0] == 1.0
+    assert "item_evidence" in model
+
+
+def test_publish_rejects_a_stale_base_version(model_dir):
+    first = save_model(make_arrays(1.0))
+    second = save_model(make_arrays(2.0))
+
+    with pytest.raises(StaleModelError):
+        save_model(make_arrays(3.0), inherit=True, base_version=first)
+    assert read_current() == (second, 2)
+    assert len([path for path in model_dir.iterdir() if path.is_dir()]) == 2
+
+
+def test_publish_prunes_old_versions_but_keeps_the_current_one(model_dir, monkeypatch):
+    monkeypatch.setattr(Config, 'MODEL_KEEP_VERSIONS', 2)
+    versions = [save_model(make_arrays(float(value))) for value in range(4)]
+
+    assert sorted(path.name for path in model_dir.iterdir() if path.is_dir()) == versions[-2:]
+
+
+def test_rollback_serves_the_older_version_under_a_new_generation(model_dir):
+    first = save_model(make_arrays(1.0))
+    save_model(make_arrays(2.0))
+    assert get_model()["sigma"][0] == 2.0
+
+    assert rollback_model(first) == 3
+    assert read_current() == (first, 3)
+    model = get_model()
+    assert model["version"] == first and model["generation"] == 3
+    assert model["sigma"][0] == 1.0
+
+    # The next publish continues from the rolled back generation
+    third = save_model(make_arrays(3.0))
+    assert read_current() == (third, 4)
+
+
+def test_rollback_rejects_unknown_versions(model_dir):
+    save_model(make_arrays(1.0))
+
+    with pytest.raises(FileNotFoundError):
+        rollback_model("19700101T000000000000")
+    assert read_current()[1] == 1
@@ -0,0 +1,43 @@
+import pytest
+
+from app.recsys.registry import clear_model, load_metadata, read_current
+from app.recsys.scheduler import retrain
+from app.recsys.updater import load_watermark
+from app.utils.settings import Config
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'MODEL_DIR', str(tmp_path))
+    clear_model()
+    yield tmp_path
+    clear_model()
+
+
+@pytest.fixture
+def mongo_ratings(db):
+    db.items.insert_many([{'movieLensId': str(movie_id)} for movie_id in (1, 2, 260)])
+    item_ids = {item['movieLensId']: str(item['_id']) for item in db.items.find()}
+    db.ratings.insert_many([
+        {'user_id': 'u1', 'item_id': item_ids['1'], 'score': 5, 'timestamp': 10.0},
+        {'user_id': 'u1', 'item_id': item_ids['260'], 'score': 4, 'timestamp': 12.0},
+        {'user_id': 'u2', 'item_id': item_ids['2'], 'score': 2, 'timestamp': 13.0}
+    ])
+
+
+def test_retraining_records_the_mongo_ratings_it_trained_on(model_dir, db, mongo_ratings):
+    version = retrain(db)
+
+    metadata = load_metadata(version)
+    assert metadata['mongo_ratings'] == 3
+    assert metadata['mongo_watermark'] == 13.0
+    assert load_watermark(version=version) == 13.0
+
+
+def test_retraining_is_skipped_while_the_current_version_is_recent(model_dir, db, mongo_ratings):
+    # Every worker's scheduler fires each interval; the ones after the first find its fresh version
+    version = retrain(db, min_age=3600)
+    assert version is not None
+
+    assert retrain(db, min_age=3600) is None
+    assert read_current() == (version, 1)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from app.recsys.ann import get_item_vectors
+from app.recsys.registry import get_model, read_current
+from app.recsys.updater import apply_new_ratings, load_watermark, update_item_factors
+from app.utils.recommender import fold_in_positions
+
+
+def make_model(metadata):
+    rng = np.random.default_rng(1)
+    return {"sigma": np.array([4.0, 2.0, 1.0]), "Vt": np.linalg.qr(rng.normal(size=(12, 3)))[0].T,
+            "metadata": metadata}
+
+
+@pytest.mark.parametrize('metadata', [{"engine": "svd"}, {"engine": "als", "als_regularization": 0.1}])
+def test_item_step_fits_users_folded_in_as_serving_does(metadata):
+    model = make_model(metadata)
+    Vt = np.array(model["Vt"])
+    evidence = np.ones_like(Vt)
+    histories = [(np.array([0, 1, 2, 5]), np.array([5.0, 4.0, 1.0, 3.0])),
+                 (np.array([1, 3, 5, 7]), np.array([2.0, 5.0, 4.0, 1.0]))]
+    new_ratings = (np.array([0, 1]), np.array([5, 5]), np.array([3.0, 4.0]))
+
+    update_item_factors(model, Vt, evidence, histories, new_ratings, steps=1, reg=1.0)
+
+    # One step: the users are folded in with the factors before the update, then item 5 is solved for
+    P = np.stack([fold_in_positions(positions, scores, model)[0] * model["sigma"] for positions, scores in histories])
+    residuals = new_ratings[2] - np.array([scores.mean() for _, scores in histories])
+    weights = np.full(3, 2.0)
+    expected = np.linalg.solve(P.T @ P + np.diag(weights), P.T @ residuals + weights * model["Vt"][:, 5])
+    np.testing.assert_allclose(Vt[:, 5], expected, atol=1e-10)
+    np.testing.assert_array_equal(np.delete(Vt, 5, axis=1), np.delete(model["Vt"], 5, axis=1))
+
+
+def test_new_ratings_are_published_as_a_new_version(model_copy, db):
+    db.items.insert_many([{'movieLensId': str(movie_id)} for movie_id in (1, 2, 3, 260)])
+    item_ids = {item['movieLensId']: str(item['_id']) for item in db.items.find()}
+    db.ratings.insert_many([
+        {'user_id': 'u1', 'item_id': item_ids['1'], 'score': 5, 'timestamp': 10.0},
+        {'user_id': 'u1', 'item_id': item_ids['2'], 'score': 1, 'timestamp': 11.0},
+        {'user_id': 'u1', 'item_id': item_ids['260'], 'score': 4, 'timestamp': 12.0},
+        {'user_id': 'u2', 'item_id': item_ids['3'], 'score': 2, 'timestamp': 13.0},
+        {'user_id': 'u2', 'item_id': item_ids['260'], 'score': 5, 'timestamp': 14.0}
+    ])
+    base_version, generation = read_current()
+
+    assert apply_new_ratings(db) == 5
+    version, new_generation = read_current()
+    assert version != base_version and new_generation == generation + 1
+    assert load_watermark(version=version) == 14.0
+
+    updated = get_model()
+    column = model_copy["movie_index"].get_loc(260)
+    assert not np.allclose(updated["Vt"][:, column], model_copy["Vt"][:, column])
+    assert updated["item_evidence"][:, column].sum() > model_copy["item_evidence"][:, column].sum()
+    np.testing.assert_array_equal(updated["Vt"][:, model_copy["movie_index"].get_loc(50)],
+                                  model_copy["Vt"][:, model_copy["movie_index"].get_loc(50)])
+
+    # Updated items are listed under their nearest centroid, every item exactly once
+    if "ann_centroids" in updated:
+        offsets = updated["ann_offsets"]
+        assert sorted(updated["ann_items"]) == list(range(len(updated["movie_ids"])))
+        centroids = np.asarray(updated["ann_centroids"], dtype=np.float64)
+        vectors = get_item_vectors(np.asarray(updated["Vt"], dtype=np.float64), updated["popularity_penalty"])
+        for movie_id in (1, 2, 3, 260):
+            position = updated["movie_index"].get_loc(movie_id)
+            lists = np.searchsorted(offsets, np.flatnonzero(updated["ann_items"] == position), side='right') - 1
+            nearest = ((centroids - vectors[position]) ** 2).sum(axis=1).argmin()
+            assert list(lists) == [nearest]
+
+    # Nothing new since the watermark
+    assert apply_new_ratings(db) == 0
+    assert read_current() == (version, new_generation)
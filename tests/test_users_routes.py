@@ -0,0 +1,130 @@
+from collections import Counter
+
+import pytest
+from bson import ObjectId
+
+from app.models.Rating import MIGRATED_FIELD
+from app.utils.item_index import item_index
+from app.utils.recommender import recommendation_cache
+from app.utils.settings import Config
+
+
+class CountingDatabase:
+    """Wraps a database and records every collection method called through it, one entry per round trip."""
+
+    def __init__(self, db):
+        self._db = db
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        return CountingCollection(getattr(self._db, name), name, self.calls)
+
+
+class CountingCollection:
+    def __init__(self, collection, name, calls):
+        self._collection = collection
+        self._name = name
+        self._calls = calls
+
+    def __getattr__(self, method):
+        attribute = getattr(self._collection, method)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            self._calls[self._name, method] += 1
+            return attribute(*args, **kwargs)
+        return call
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def items(app, db):
+    """Items for the first 200 MovieLens movies, loaded into the item index."""
+    db.items.insert_many([{'movieLensId': str(movie_id), 'title': f'Movie {movie_id}'} for movie_id in range(1, 201)])
+    item_index.load(db)
+    return {item['movieLensId']: str(item['_id']) for item in db.items.find()}
+
+
+def test_users_are_paginated_by_id(client, db):
+    db.users.insert_many([{'test_group': 'A', 'ratings': [{'score': 1}]} for _ in range(5)])
+
+    first = client.get('/api/users?limit=2')
+    second = client.get(f"/api/users?limit=2&after={first.headers['X-Next-After']}")
+    last = client.get(f"/api/users?limit=2&after={second.headers['X-Next-After']}")
+
+    pages = [first.get_json(), second.get_json(), last.get_json()]
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert 'X-Next-After' not in last.headers
+    assert len({user['_id'] for page in pages for user in page}) == 5
+    assert all('ratings' not in user for page in pages for user in page)
+
+
+def test_users_listing_rejects_bad_parameters(client):
+    assert client.get('/api/users?after=nope').status_code == 400
+    assert client.get('/api/users?limit=-1').status_code == 400
+    assert client.get('/api/users?fields=$where').status_code == 400
+
+
+def test_new_users_are_allocated_by_the_weighted_schedule(client, db, monkeypatch):
+    monkeypatch.setattr(Config, 'AB_TEST_GROUPS', 'A:2,B:1')
+    monkeypatch.setattr(Config, 'AB_TEST_ALLOCATION', 'counter')
+
+    groups = [client.post('/api/users', json={}).get_json()['user']['test_group'] for _ in range(9)]
+
+    assert groups[:3] == ['A', 'B', 'A']
+    assert Counter(groups) == {'A': 6, 'B': 3}
+    assert db.users.count_documents({MIGRATED_FIELD: True}) == 9
+
+
+def test_new_ratings_invalidate_cached_recommendations(client, db, model, items, auth_headers):
+    user_id = str(db.users.insert_one({MIGRATED_FIELD: True}).inserted_id)
+    headers = auth_headers(user_id)
+    for movie_id, score in (('1', 5), ('2', 3), ('3', 4)):
+        response = client.post(f'/api/users/{user_id}/ratings', json={'item_id': items[movie_id], 'score': score},
+                               headers=headers)
+        assert response.status_code == 201
+
+    first = client.get(f'/api/users/{user_id}/recommendations', headers=headers).get_json()
+    assert recommendation_cache.stats()['size'] == 1
+    second = client.get(f'/api/users/{user_id}/recommendations', headers=headers).get_json()
+    assert [(r['_id'], r['item_id'], r['pred_score']) for r in second] == \
+        [(r['_id'], r['item_id'], r['pred_score']) for r in first]
+    assert recommendation_cache.stats()['hits'] >= 1
+
+    client.post(f'/api/users/{user_id}/ratings', json={'item_id': items['4'], 'score': 1}, headers=headers)
+    assert recommendation_cache.stats()['size'] == 0
+    assert db.recommendations.count_documents({'user_id': user_id}) == len(first)
+
+
+def test_recommendations_are_forbidden_for_other_users(client, model, auth_headers):
+    user_id = str(ObjectId())
+    response = client.get(f'/api/users/{user_id}/recommendations', headers=auth_headers(str(ObjectId())))
+    assert response.status_code == 403
+
+
+def test_recommendations_are_persisted_in_one_bulk_write(app, client, db, model, items, auth_headers):
+    user_id = str(db.users.insert_one({MIGRATED_FIELD: True}).inserted_id)
+    db.ratings.insert_many([{'user_id': user_id, 'item_id': items[movie_id], 'score': score, 'timestamp': day}
+                            for day, (movie_id, score) in enumerate((('1', 5), ('2', 3), ('3', 4), ('5', 2)))])
+    headers = auth_headers(user_id)
+    app.db = CountingDatabase(db)
+
+    # First request: every recommendation is new, the upserts return all their ids
+    first = client.get(f'/api/users/{user_id}/recommendations', headers=headers).get_json()
+    persisted = {call: count for call, count in app.db.calls.items() if call[0] == 'recommendations'}
+    assert persisted == {('recommendations', 'bulk_write'): 1}
+    assert len(first) == 3 and all(recommendation['_id'] for recommendation in first)
+
+    # Second request, cache dropped: every recommendation exists, one find fetches their ids
+    recommendation_cache.clear()
+    app.db.calls.clear()
+    second = client.get(f'/api/users/{user_id}/recommendations', headers=headers).get_json()
+    persisted = {call: count for call, count in app.db.calls.items() if call[0] == 'recommendations'}
+    assert persisted == {('recommendations', 'bulk_write'): 1, ('recommendations', 'find'): 1}
+    assert [recommendation['_id'] for recommendation in second] == [recommendation['_id'] for recommendation in first]
+    assert db.recommendations.count_documents({'user_id': user_id}) == len(first)